@@ -1,3 +1,4 @@
+import argparse
 import yaml
 from copy import deepcopy
 import os
@@ -46,7 +47,22 @@ def generate_configs(base_yaml, labels, scenes, output_dir):
             with open(os.path.join(output_dir, f"{label}_{scene}.yaml"), 'w') as file:
                 yaml.safe_dump(config, file)
 
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate one config per label and scene, by default all the hm3d and replica_cad ones")
+    parser.add_argument("--base_yaml", type=str, default=None)
+    parser.add_argument("--labels", type=str, nargs="+", default=None)
+    parser.add_argument("--scenes", type=str, nargs="+", default=None)
+    parser.add_argument("--output_dir", type=str, default=None)
+    return parser
+
 def main():
+    args = get_parser().parse_args()
+
+    if args.base_yaml is not None:
+        generate_configs(args.base_yaml, args.labels, args.scenes, args.output_dir or os.path.dirname(args.base_yaml))
+        return
+
     generate_configs('examples/configs/hm3d/example.yaml', hm3d_labels, hm3d_scenes, 'examples/configs/hm3d/')
     generate_configs('examples/configs/replica_cad/example.yaml', replica_cad_labels, replica_cad_scenes, 'examples/configs/replica_cad/')
 
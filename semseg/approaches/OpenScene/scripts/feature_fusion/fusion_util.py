@@ -1,7 +1,11 @@
 import os
+import json
 import torch
 import glob
 import math
+import hashlib
+import tempfile
+import imageio
 import numpy as np
 from tensorflow import io
 import tensorflow.compat.v1 as tf
@@ -139,6 +143,81 @@ class PointCloudToImageMapper(object):
         return mapping.T
 
 
+def get_mapping_cache_path(cache_dir, coords, pose_paths, depth_paths, depth_scale, point2img_mapper):
+    '''Cache file of the 3D-2D mappings of a scene, keyed by its points, poses, depth and the mapper parameters.'''
+
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(coords, dtype=np.float64).tobytes())
+    for path in list(pose_paths) + list(depth_paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    params = [depth_scale, list(point2img_mapper.image_dim), point2img_mapper.vis_thres,
+              point2img_mapper.cut_bound, np.asarray(point2img_mapper.intrinsics).tolist()]
+    digest.update(json.dumps(params).encode('utf-8'))
+
+    return os.path.join(cache_dir, digest.hexdigest() + '.npz')
+
+
+def compute_visible_mappings(point2img_mapper, coords, pose_paths, depth_paths, depth_scale):
+    '''
+    Ids and pixels (rows, cols) of the points visible in every image, concatenated over the
+    images, the ones of image i are in [offsets[i], offsets[i + 1]).
+    '''
+
+    point_ids, rows, cols, offsets = [], [], [], [0]
+    for pose_path, depth_path in zip(pose_paths, depth_paths):
+        pose = np.loadtxt(pose_path)
+        # load depth and convert to meter
+        depth = imageio.v2.imread(depth_path) / depth_scale
+
+        mapping = point2img_mapper.compute_mapping(pose, coords, depth)
+        visible = np.flatnonzero(mapping[:, 2])
+
+        point_ids.append(visible.astype(np.int32))
+        rows.append(mapping[visible, 0].astype(np.int32))
+        cols.append(mapping[visible, 1].astype(np.int32))
+        offsets.append(offsets[-1] + len(visible))
+
+    empty = np.zeros(0, dtype=np.int32)
+    return {
+        'point_ids': np.concatenate(point_ids) if point_ids else empty,
+        'rows': np.concatenate(rows) if rows else empty,
+        'cols': np.concatenate(cols) if cols else empty,
+        'offsets': np.array(offsets, dtype=np.int64),
+    }
+
+
+def load_or_compute_visible_mappings(cache_dir, point2img_mapper, coords, pose_paths, depth_paths, depth_scale):
+    '''
+    The mappings of compute_visible_mappings, read from `cache_dir` if given and computed before.
+    They only depend on the geometry, so the lighting variants of a scene share them.
+    '''
+
+    if not cache_dir:
+        return compute_visible_mappings(point2img_mapper, coords, pose_paths, depth_paths, depth_scale)
+
+    cache_path = get_mapping_cache_path(cache_dir, coords, pose_paths, depth_paths, depth_scale, point2img_mapper)
+    if os.path.exists(cache_path):
+        print('Reusing the 3D-2D mappings cached in ' + cache_path)
+        with np.load(cache_path) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    mappings = compute_visible_mappings(point2img_mapper, coords, pose_paths, depth_paths, depth_scale)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.npz.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **mappings)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return mappings
+
+
 def obtain_intr_extr_matterport(scene):
     '''Obtain the intrinsic and extrinsic parameters of Matterport3D.'''
 
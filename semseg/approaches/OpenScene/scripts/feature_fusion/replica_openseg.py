@@ -8,7 +8,7 @@ from tqdm import tqdm
 import tensorflow as tf2
 import tensorflow.compat.v1 as tf
 from os.path import join, exists
-from fusion_util import extract_openseg_img_feature, PointCloudToImageMapper, save_fused_feature
+from fusion_util import extract_openseg_img_feature, PointCloudToImageMapper, save_fused_feature, load_or_compute_visible_mappings
 
 
 def get_args():
@@ -23,6 +23,7 @@ def get_args():
     parser.add_argument('--split', type=str, default='test', help='split: "train"| "val" | "test" ')
     parser.add_argument('--openseg_model', type=str, default='', help='Where is the exported OpenSeg model')
     parser.add_argument('--img_feat_dir', type=str, default='', help='the id range to process')
+    parser.add_argument('--mapping_cache_dir', type=str, default='', help='Where to cache the 3D-2D mappings shared by the lighting variants of a scene')
 
     # Hyper parameters
     parser.add_argument('--hparams', default=[], nargs="+")
@@ -78,39 +79,37 @@ def process_one_scene(data_path, out_dir, args):
     sum_features = torch.zeros((n_points_cur, feat_dim), device=device)
 
     ################ Feature Fusion ###################
-    vis_id = torch.zeros((n_points_cur, num_img), dtype=int, device=device)
+    # the 3d-2d mappings are based on the depth only, so they are cached across the configs
+    pose_paths = [img_dir.replace('color', 'pose').replace('.png', '.txt') for img_dir in img_dirs]
+    depth_paths = [img_dir.replace('color', 'depth') for img_dir in img_dirs]
+    mappings = load_or_compute_visible_mappings(
+        args.mapping_cache_dir, point2img_mapper, locs_in, pose_paths, depth_paths, depth_scale)
+    offsets = mappings['offsets']
+
+    visible = torch.zeros(n_points_cur, dtype=torch.bool, device=device)
     for img_id, img_dir in enumerate(tqdm(img_dirs)):
-        # load pose
-        posepath = img_dir.replace('color', 'pose').replace('.png', '.txt')
-        pose = np.loadtxt(posepath)
-
-        # load depth and convert to meter
-        depth = imageio.v2.imread(img_dir.replace('color', 'depth')) / depth_scale
-
-        # calculate the 3d-2d mapping based on the depth
-        mapping = np.ones([n_points, 4], dtype=int)
-        mapping[:, 1:4] = point2img_mapper.compute_mapping(pose, locs_in, depth)
-        if mapping[:, 3].sum() == 0: # no points corresponds to this image, skip
+        start, end = offsets[img_id], offsets[img_id + 1]
+        if start == end: # no points corresponds to this image, skip
             continue
 
-        # calculate the 3d-2d mapping based on the depth
-        mapping = torch.from_numpy(mapping).to(device)
-        mask = mapping[:, 3]
-        vis_id[:, img_id] = mask
+        point_ids = torch.from_numpy(mappings['point_ids'][start:end]).long().to(device)
+        rows = torch.from_numpy(mappings['rows'][start:end]).long().to(device)
+        cols = torch.from_numpy(mappings['cols'][start:end]).long().to(device)
+        visible[point_ids] = True
+
         if keep_features_in_memory:
             feat_2d = img_features[img_id].to(device)
         else:
             feat_2d = extract_openseg_img_feature(img_dir, openseg_model, text_emb).to(device)
 
-        feat_2d_3d = feat_2d[:, mapping[:, 1], mapping[:, 2]].permute(1, 0)
+        feat_2d_3d = feat_2d[:, rows, cols].permute(1, 0)
 
-        
-        counter[mask!=0]+= 1
-        sum_features[mask!=0] += feat_2d_3d[mask!=0]
+        counter[point_ids] += 1
+        sum_features[point_ids] += feat_2d_3d
 
     counter[counter==0] = 1e-5
     feat_bank = sum_features/counter
-    point_ids = torch.unique(vis_id.nonzero(as_tuple=False)[:, 0])
+    point_ids = visible.nonzero(as_tuple=False)[:, 0]
 
     save_fused_feature(feat_bank, point_ids, n_points, out_dir, scene_id, args)
 
@@ -25,7 +25,8 @@ do
 
         python3 /scripts/adaptors/bbq.py \
             --config_path=/home/docker_user/BeyondBareQueries/examples/configs/hm3d/${scene_label}_${scene_name}.yaml \
-            --output_name=${scene_label}_${scene_name}_with_feats.pkl.gz
+            --output_name=${scene_label}_${scene_name}_with_feats.pkl.gz \
+            --skip_unchanged
 
         python /scripts/eval_semseg.py \
             --approach 'bbq' \
@@ -34,12 +35,15 @@ do
             --excluded_classes "0" \
             --pred_pc_path "/home/docker_user/BeyondBareQueries/output/scenes/hm3d/${scene_label}_${scene_name}_with_feats.pkl.gz" \
             --gt_pc_path "/data/gt/generated/hm3d/no_lights/${scene_name}/pointcloud.pcd" \
+            --gt_bake \
+            --gt_bake_dir "/results/gt_bake" \
             --output_path "/results/osma-bench/bbq/hm3d/${scene_label}" \
             --result_tag "${scene_name}" \
             --clip_prompts "an image of {}" \
             --clip_name "EVA02-B-16" \
             --clip_pretrained "merged2b_s8b_b131k" \
-            --nn_count 1
+            --nn_count 1 \
+            --skip_unchanged
     done
 done
 
@@ -36,12 +36,15 @@ do
             --excluded_classes "0" \
             --pred_pc_path "${DATASET_ROOT}/${scene_label}/${scene_name}/pcd_saves/full_pcd_none_overlap_maskconf0.95_simsum1.2_dbscan.1_merge20_masksub_post.pkl.gz" \
             --gt_pc_path "/data/gt/generated/hm3d/no_lights/${scene_name}/pointcloud.pcd" \
+            --gt_bake \
+            --gt_bake_dir "/results/gt_bake" \
             --output_path "/results/osma-bench/conceptgraphs/hm3d/${scene_label}" \
             --result_tag "${scene_name}" \
             --clip_prompts "an image of {}" \
             --clip_name "ViT-H-14" \
             --clip_pretrained "laion2b_s32b_b79k" \
-            --nn_count 1
+            --nn_count 1 \
+            --skip_unchanged
     done
 done
 
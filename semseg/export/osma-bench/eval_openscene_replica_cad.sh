@@ -40,12 +40,15 @@ do
             --excluded_classes "0" \
             --pred_pc_path "/home/docker_user/OpenScene/output/replica_cad/results/${scene_label}/${scene_name}/fusion" \
             --gt_pc_path "/data/gt/generated/replica_cad/${scene_name}/pointcloud.pcd" \
+            --gt_bake \
+            --gt_bake_dir "/results/gt_bake" \
             --output_path "/results/osma-bench/openscene/replica_cad/${scene_label}" \
             --result_tag "${scene_name}" \
             --clip_prompts "a {} in a scene" \
             --clip_name "ViT-L-14-336-quickgelu" \
             --clip_pretrained "openai" \
-            --nn_count 1
+            --nn_count 1 \
+            --skip_unchanged
     done
 done
 
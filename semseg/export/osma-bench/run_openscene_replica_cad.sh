@@ -58,6 +58,7 @@ do
             --stride $STRIDE \
             --downsample_rate 15 \
             --load_semseg \
+            --geometry_cache_dir /results/geometry_cache \
             --output_dir $TMP_DIR_PATH/rgb_clouds/$scene_label
 
         python3 ./scripts/preprocess/preprocess_replica.py \
@@ -72,7 +73,8 @@ do
             --config $scene_label \
             --output_dir $FEATURE_DIR_PREFIX/$scene_label \
             --split test \
-            --openseg_model $OPENSEG_PATH
+            --openseg_model $OPENSEG_PATH \
+            --mapping_cache_dir /results/geometry_cache/openscene_mappings
 
         sh ./run/eval.sh $RESULTS_PATH/$scene_label $CONFIG_ROOT/replica_openseg_pretrained.yaml fusion 
     done
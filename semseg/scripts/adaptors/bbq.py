@@ -1,10 +1,16 @@
 import argparse
 import glob
 import gzip
+import hashlib
+import json
 import os
 import pickle
 import re
+import sys
+import tempfile
 import yaml
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import torch
@@ -28,9 +34,44 @@ def get_parser():
         type=str,
     )
     
+    parser.add_argument(
+        "--batch_size", 
+        type=int, 
+        default=64,
+        help='Number of object crops encoded by CLIP at once'
+    )
+    
+    parser.add_argument(
+        "--num_workers", 
+        type=int, 
+        default=min(8, os.cpu_count() or 1),
+        help='Number of threads decoding the frames and preprocessing the object crops'
+    )
+    
+    parser.add_argument(
+        "--crop_cache_dir", 
+        type=Path, 
+        default=None,
+        help='Directory caching the CLIP feature of every crop, keyed by its frame, mask and CLIP model'
+    )
+    
+    parser.add_argument(
+        "--skip_unchanged", 
+        action="store_true",
+        help='Skip the scene if its output was produced from the same config, objects, frames and CLIP model, as recorded in eval_manifest.json next to it'
+    )
+    
     return parser
 
 
+CLIP_NAME = "EVA02-B-16"
+CLIP_PRETRAINED = "merged2b_s8b_b131k"
+CROP_PADDING = 30
+
+# Bump whenever a change alters the produced features, outputs recorded with another version are then recomputed
+ADAPTOR_VERSION = 1
+
+
 def get_xyxy_from_mask(mask):
     non_zero_indices = np.nonzero(mask)
 
@@ -70,28 +111,137 @@ def crop_image(image, mask, padding=30):
     return image_crop
 
 
+class CropFeatureCache:
+    '''On-disk CLIP features of object crops, keyed by (frame path and stats, mask hash, model)'''
+
+    def __init__(self, cache_dir, model_name, pretrained):
+        self.cache_dir = str(cache_dir)
+        self.model_name = model_name
+        self.pretrained = pretrained
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_digest(self, image_path, mask):
+        mask = np.asarray(mask, dtype=bool)
+
+        mask_hash = hashlib.sha1(str(mask.shape).encode("utf-8"))
+        mask_hash.update(np.packbits(mask).tobytes())
+
+        # Regenerated frames keep their paths, their stats tell them apart
+        stat = os.stat(image_path)
+
+        key = {
+            "frame": os.path.abspath(image_path),
+            "frame_size": stat.st_size,
+            "frame_mtime_ns": stat.st_mtime_ns,
+            "mask": mask_hash.hexdigest(),
+            "model": self.model_name,
+            "pretrained": self.pretrained,
+            "padding": CROP_PADDING,
+        }
+
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.npy")
+
+    def load(self, digest):
+        try:
+            return np.load(self._path(digest))
+        except (OSError, ValueError):
+            return None
+
+    def save(self, digest, feat):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, feat)
+            os.replace(tmp_path, self._path(digest))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def get_frame_crops(image_path, frame_objects, clip_preprocess):
+    '''Decode a frame once and preprocess the crops of all its objects'''
+    image = Image.open(image_path).convert("RGB")
+    resized_images = {}
+
+    crops = []
+    for obj_idx, obj in frame_objects:
+        mask = obj["mask"]
+
+        # Objects of the same frame share the resized image as long as their masks have the same size
+        if mask.shape not in resized_images:
+            resized_images[mask.shape] = image.resize((mask.shape[1], mask.shape[0]), Image.LANCZOS)
+
+        image_crop = crop_image(resized_images[mask.shape], mask, padding=CROP_PADDING)
+        crops.append((obj_idx, clip_preprocess(image_crop)))
+
+    return crops
+
+
+def iter_crops(frames, clip_preprocess, num_workers=1):
+    '''Preprocessed crops of every frame, keeping at most `2 * num_workers` frames in flight'''
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = deque()
+
+        for image_path, frame_objects in frames:
+            futures.append(executor.submit(get_frame_crops, image_path, frame_objects, clip_preprocess))
+
+            if len(futures) >= 2 * num_workers:
+                yield from futures.popleft().result()
+
+        while futures:
+            yield from futures.popleft().result()
+
+
 @torch.no_grad()
-def get_obg_feat(obj, image_paths, clip_preprocess, clip_model, device="cuda"):
-    image = Image.open(image_paths[obj['color_image_idx']]).convert("RGB")
-    mask = obj["mask"]
-    image = image.resize((mask.shape[1], mask.shape[0]), Image.LANCZOS)
-    image_crop = crop_image(image, mask)
-    # image_crop = crop_image(image, mask, padding=0)
+def encode_crops(crops, clip_model, device="cuda"):
+    obj_indices, crop_tensors = zip(*crops)
 
-    clip_image_crop = clip_preprocess(image_crop).unsqueeze(0).to(device)
-    image_features = clip_model.encode_image(clip_image_crop)
+    image_features = clip_model.encode_image(torch.stack(crop_tensors).to(device))
 
-    return image_features
+    return list(zip(obj_indices, image_features))
 
 
-def get_obj_descriptions(scene_dir, objects, start=0, end=-1, stride=1, device="cuda"):
+def get_image_paths(scene_dir):
     paths = glob.glob(
         os.path.join(
             scene_dir, "results/frame*.jpg"
         )
     )
 
-    image_paths = sorted(paths)
+    return sorted(paths)
+
+
+def get_adaptor_inputs(config_path, pred_pc_path, scene_dir):
+    '''Everything the output features depend on, recorded in the evaluation manifest of the output directory'''
+    from src.hashing import hash_file, hash_stats
+
+    return {
+        "adaptor_version": ADAPTOR_VERSION,
+        "config": hash_file(config_path),
+        "objects": hash_file(pred_pc_path),
+        # Frames are keyed by their stats, hashing thousands of images would cost as much as a part of the run
+        "frames": hash_stats(get_image_paths(scene_dir)),
+        "clip": [CLIP_NAME, CLIP_PRETRAINED, CROP_PADDING],
+    }
+
+
+def get_obj_descriptions(
+    scene_dir, 
+    objects, 
+    start=0, 
+    end=-1, 
+    stride=1, 
+    device="cuda", 
+    batch_size=64, 
+    num_workers=1, 
+    cache_dir=None
+):
+    image_paths = get_image_paths(scene_dir)
 
     # image_paths = {}
 
@@ -103,7 +253,7 @@ def get_obj_descriptions(scene_dir, objects, start=0, end=-1, stride=1, device="
     #         image_paths[index] = path
     
     clip_model, _, clip_preprocess = open_clip.create_model_and_transforms(
-        "EVA02-B-16", pretrained="merged2b_s8b_b131k"
+        CLIP_NAME, pretrained=CLIP_PRETRAINED
     )
 
     # clip_model, _, clip_preprocess = open_clip.create_model_and_transforms(
@@ -114,7 +264,7 @@ def get_obj_descriptions(scene_dir, objects, start=0, end=-1, stride=1, device="
     #     "ViT-B-32", pretrained="laion2b_s34b_b79k"
     # )
 
-    clip_model = clip_model.to('cuda')
+    clip_model = clip_model.to(device)
 
     objects_with_feats = objects.copy()
     data_slice = slice(
@@ -122,49 +272,80 @@ def get_obj_descriptions(scene_dir, objects, start=0, end=-1, stride=1, device="
         end + 1 if end >= 0 else len(image_paths) + 1 + end, 
         stride
     )
+    image_paths = image_paths[data_slice]
 
-    for obj in objects_with_feats:
-        clip_ft = get_obg_feat(
-            obj = obj, 
-            image_paths = image_paths[data_slice], 
-            clip_preprocess = clip_preprocess, 
-            clip_model = clip_model,
-            device = device
-        )
+    crop_cache = CropFeatureCache(cache_dir, CLIP_NAME, CLIP_PRETRAINED) if cache_dir is not None else None
+    crop_digests = {}
+
+    # Group the objects by source frame, so that every frame is decoded and resized once
+    frame_objects = defaultdict(list)
+
+    for obj_idx, obj in enumerate(objects_with_feats):
+        image_path = image_paths[obj['color_image_idx']]
+
+        if crop_cache is not None:
+            crop_digests[obj_idx] = crop_cache.get_digest(image_path, obj["mask"])
+            cached_feat = crop_cache.load(crop_digests[obj_idx])
+
+            if cached_feat is not None:
+                obj['clip_ft'] = torch.from_numpy(cached_feat).unsqueeze(0).to(device)
+                continue
+
+        frame_objects[image_path].append((obj_idx, obj))
+
+    def store_features(encoded_crops):
+        for obj_idx, clip_ft in encoded_crops:
+            objects_with_feats[obj_idx]['clip_ft'] = clip_ft.unsqueeze(0).clone()
+
+            if crop_cache is not None:
+                crop_cache.save(crop_digests[obj_idx], clip_ft.cpu().numpy())
+
+    batch = []
+    for crop in iter_crops(frame_objects.items(), clip_preprocess, num_workers=num_workers):
+        batch.append(crop)
 
-        obj['clip_ft'] = clip_ft
+        if len(batch) == batch_size:
+            store_features(encode_crops(batch, clip_model, device))
+            batch = []
+
+    if batch:
+        store_features(encode_crops(batch, clip_model, device))
 
     return objects_with_feats
 
 
-def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda'):
+def load_pred_objects(pred_pc_path, with_points=True):
+    '''
+    Object CLIP features and, if `with_points`, the concatenated object point clouds with the
+    object index of every point
+    '''
+    # Imported here, the module also runs as a standalone script outside of /scripts
+    from src.objects import get_point_object
+
     with gzip.open(pred_pc_path, "rb") as f:
         results = pickle.load(f)
 
     objects = results['objects']
 
-    object_feats = torch.cat([obj['clip_ft'] for obj in objects]).to(device)
-    object_class_sim = torch.nn.functional.cosine_similarity(
-        object_feats.unsqueeze(1), class_feats['feats'].unsqueeze(0), dim=-1
-    )
+    pred_objects = {'object_feats': torch.cat([torch.as_tensor(obj['clip_ft']) for obj in objects])}
+
+    if with_points:
+        pred_objects['xyz'] = torch.from_numpy(np.concatenate([obj['pcd_np'] for obj in objects], axis=0))
+        pred_objects['color'] = torch.from_numpy(np.concatenate([obj['pcd_color_np'] for obj in objects], axis=0))
+        pred_objects['point_object'] = get_point_object([obj['pcd_np'].shape[0] for obj in objects])
 
-    class_ids = torch.tensor(class_feats['ids'])
-    object_class = class_ids[object_class_sim.argmax(dim=-1).detach().cpu()] # (num_objects,)
+    return pred_objects
 
-    pred_xyz = []
-    pred_color = []
-    pred_class = []
-    for i in range(len(objects)):
-        # obj_pcd = objects[i]['pcd_np']
-        pred_xyz.append(objects[i]['pcd_np'])
-        pred_color.append(objects[i]['pcd_color_np'])
-        pred_class.append(np.ones(objects[i]['pcd_np'].shape[0]) * object_class[i].item())
 
-    pred_xyz = torch.from_numpy(np.concatenate(pred_xyz, axis=0))
-    pred_color = torch.from_numpy(np.concatenate(pred_color, axis=0))
-    pred_class = torch.from_numpy(np.concatenate(pred_class, axis=0)).long()
+def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda'):
+    from src.objects import broadcast_object_class, classify_objects
+
+    pred_objects = load_pred_objects(pred_pc_path)
+
+    object_class = classify_objects(pred_objects['object_feats'], class_feats, device)
+    pred_class = broadcast_object_class(object_class, pred_objects['point_object'])
 
-    return pred_xyz, pred_color, pred_class
+    return pred_objects['xyz'], pred_objects['color'], pred_class
 
 
 def main(args):
@@ -175,35 +356,57 @@ def main(args):
         config['nodes_constructor']['output_path'], 
         config['nodes_constructor']['output_name_objects']
     )
-    with gzip.open(pred_pc_path, "rb") as f:
-        results = pickle.load(f)
-
-
     scene_dir = os.path.join(
         config['dataset']['base_dir'], 
         config['dataset']['sequence']
     )
+    output_pc_path = os.path.join(
+        config['nodes_constructor']['output_path'], 
+        args.output_name
+    )
+
+    inputs = None
+    if args.skip_unchanged:
+        from src.eval_manifest import EvalManifest
+
+        manifest = EvalManifest(config['nodes_constructor']['output_path'])
+        inputs = get_adaptor_inputs(args.config_path, pred_pc_path, scene_dir)
+        changed = manifest.get_changed_inputs(args.output_name, inputs, [output_pc_path])
+
+        if not changed:
+            print(f"Reusing {output_pc_path}: inputs unchanged")
+            return
+
+        print(f"Computing {output_pc_path} ({', '.join(changed)})")
+
+    with gzip.open(pred_pc_path, "rb") as f:
+        results = pickle.load(f)
+
     objects_with_feats = get_obj_descriptions(
         scene_dir = scene_dir, 
         objects = results['objects'],
         start = config['dataset']['start'],
         end = config['dataset']['end'], 
         stride = config['dataset']['stride'],
-        device = config['dataset']['device']
+        device = config['dataset']['device'],
+        batch_size = args.batch_size,
+        num_workers = args.num_workers,
+        cache_dir = args.crop_cache_dir
     )
 
-    output_pc_path = os.path.join(
-        config['nodes_constructor']['output_path'], 
-        args.output_name
-    )
-    
     with gzip.open(output_pc_path, 'wb') as file:
         pickle.dump(
             {'objects': objects_with_feats}, file
         )
 
+    if inputs is not None:
+        manifest.record(args.output_name, inputs, [output_pc_path])
+
 
 if __name__ == '__main__':
+    # Run as a script, the shared modules of the scripts directory are imported from the parent directory
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
     parser = get_parser()
     args = parser.parse_args()
 
@@ -6,36 +6,61 @@ import pickle
 import torch
 import numpy as np
 
-from conceptgraph.slam.slam_classes import MapObjectList
+from src.objects import broadcast_object_class, classify_objects, get_point_object
 
 
-def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda'):   
-    with gzip.open(pred_pc_path, "rb") as f:
-            results = pickle.load(f)
+def get_object_offsets(s_obj_list):
+    '''Start of every object in the concatenated point cloud, with the total count appended'''
+    num_object_points = [len(s_obj_dict['pcd_np']) for s_obj_dict in s_obj_list]
+    
+    return np.concatenate([[0], np.cumsum(num_object_points)]).astype(np.int64)
+
+
+def concatenate_object_values(s_obj_list, key, object_offsets, dtype=np.float32):
+    '''Copy a per-point value of every serialized object into one preallocated buffer'''
+    num_channels = np.shape(s_obj_list[0][key])[-1] if s_obj_list else 3
+    values = np.empty((object_offsets[-1], num_channels), dtype=dtype)
+    
+    for s_obj_dict, start, end in zip(s_obj_list, object_offsets[:-1], object_offsets[1:]):
+        values[start:end] = s_obj_dict[key]
         
-    objects = MapObjectList()
-    objects.load_serializable(results['objects'])
+    return values
 
-    # Compute the CLIP similarity for the mapped objects and assign class to them
-    object_feats = objects.get_stacked_values_torch("clip_ft").to(device)
-    object_class_sim = torch.nn.functional.cosine_similarity(
-        object_feats.unsqueeze(1), class_feats['feats'].unsqueeze(0), dim=-1
+
+def load_pred_objects(pred_pc_path, with_points=True):
+    '''
+    Object CLIP features and, if `with_points`, the concatenated object point clouds with the
+    object index of every point. The arrays are read straight from the serialized object dicts,
+    without rebuilding the MapObjectList and its Open3D geometries.
+    '''
+    with gzip.open(pred_pc_path, "rb") as f:
+            results = pickle.load(f)
+    
+    s_obj_list = results['objects']
+    
+    object_feats = torch.from_numpy(
+        np.stack([np.asarray(s_obj_dict['clip_ft']) for s_obj_dict in s_obj_list], axis=0)
     )
     
-    class_ids = torch.tensor(class_feats['ids'])
-    object_class = class_ids[object_class_sim.argmax(dim=-1).detach().cpu()] # (num_objects,)
-    
-    pred_xyz = []
-    pred_color = []
-    pred_class = []
-    for i in range(len(objects)):
-        obj_pcd = objects[i]['pcd']
-        pred_xyz.append(np.asarray(obj_pcd.points))
-        pred_color.append(np.asarray(obj_pcd.colors))
-        pred_class.append(np.ones(len(obj_pcd.points)) * object_class[i].item())
-        
-    pred_xyz = torch.from_numpy(np.concatenate(pred_xyz, axis=0))
-    pred_color = torch.from_numpy(np.concatenate(pred_color, axis=0))
-    pred_class = torch.from_numpy(np.concatenate(pred_class, axis=0)).long()
+    if not with_points:
+        return {'object_feats': object_feats}
+    
+    object_offsets = get_object_offsets(s_obj_list)
+    
+    return {
+        'xyz': torch.from_numpy(concatenate_object_values(s_obj_list, 'pcd_np', object_offsets)),
+        'color': torch.from_numpy(concatenate_object_values(s_obj_list, 'pcd_color_np', object_offsets)),
+        'object_offsets': object_offsets,
+        'point_object': get_point_object(np.diff(object_offsets)),
+        'object_feats': object_feats,
+    }
+
+
+def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda'):   
+    pred_objects = load_pred_objects(pred_pc_path)
+
+    # Compute the CLIP similarity for the mapped objects and assign class to them
+    object_class = classify_objects(pred_objects['object_feats'], class_feats, device)
+    pred_class = broadcast_object_class(object_class, pred_objects['point_object'])
     
-    return pred_xyz, pred_color, pred_class
\ No newline at end of file
+    return pred_objects['xyz'], pred_objects['color'], pred_class
@@ -3,29 +3,21 @@ import numpy as np
 import open3d as o3d
 import torch
 
-def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda', batch_size=10_000):
+from src.objects import classify_point_features
+
+def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda', batch_size=65_536):
+    '''
+    Per-point features are memory-mapped and scored chunk by chunk, so only the chunk being
+    scored and the argmax labels are held in memory. float16 features are supported as stored.
+    '''
     pcd_filename = os.path.join(pred_pc_path, "gt.ply")
     pred_filename = os.path.join(pred_pc_path, "predictions.npy")
 
     pcd = o3d.io.read_point_cloud(pcd_filename)
-    pred_xyz = torch.tensor(np.asarray(pcd.points))
-    pred_color = torch.tensor(np.asarray(pcd.colors))
+    pred_xyz = torch.from_numpy(np.asarray(pcd.points))
+    pred_color = torch.from_numpy(np.asarray(pcd.colors))
+
+    feats = np.load(pred_filename, mmap_mode='r')
+    pred_class = classify_point_features(feats, class_feats, device, batch_size=batch_size)
 
-    feats = torch.tensor(np.load(pred_filename)).to(torch.float)
-    
-    pred_classes = []
-    
-    for i in range(0, feats.shape[0], batch_size):
-        batch_feats = feats[i:i+batch_size].to(device)
-        
-        class_sim = torch.nn.functional.cosine_similarity(
-            batch_feats.unsqueeze(1), class_feats['feats'].unsqueeze(0), dim=-1
-        )
-    
-        class_ids = torch.tensor(class_feats['ids'])
-        pred_class_batch = class_ids[class_sim.argmax(dim=-1).detach().cpu()] # (num_objects,)
-        pred_classes.append(pred_class_batch)
-        
-    pred_class = torch.cat(pred_classes, dim=0)    
-    
     return pred_xyz, pred_color, pred_class
@@ -0,0 +1,52 @@
+import torch
+import numpy as np
+
+from src.objects import broadcast_object_class, classify_objects, classify_point_features
+from src.pred_store import load_pred_store
+
+
+def get_color(store):
+    '''Stored uint8 colors to floats in [0, 1], as the other adaptors return them'''
+    if 'rgb' not in store:
+        return None
+    
+    return torch.from_numpy(store['rgb']).float() / 255
+
+
+def load_pred_objects(pred_pc_path, with_points=True):
+    store = load_pred_store(pred_pc_path)
+    
+    if not store.has_objects:
+        raise ValueError(f"The prediction store has no objects: {pred_pc_path}")
+    
+    pred_objects = {'object_feats': torch.from_numpy(store['object_features'])}
+    
+    if with_points:
+        pred_objects['xyz'] = torch.from_numpy(store['xyz'])
+        pred_objects['color'] = get_color(store)
+        pred_objects['point_object'] = torch.from_numpy(store['object_id'])
+        
+    return pred_objects
+
+
+def load_pred_pointcloud(pred_pc_path, class_feats, device='cuda'):
+    '''
+    Classify a prediction store with the most specific column it holds: per-point features,
+    then object features broadcast to the points, then the stored labels as they are
+    '''
+    store = load_pred_store(pred_pc_path)
+    
+    pred_xyz = torch.from_numpy(store['xyz'])
+    pred_color = get_color(store)
+    
+    if 'features' in store:
+        pred_class = classify_point_features(store['features'], class_feats, device)
+    elif store.has_objects:
+        object_class = classify_objects(torch.from_numpy(store['object_features']).float(), class_feats, device)
+        pred_class = broadcast_object_class(object_class, torch.from_numpy(store['object_id']))
+    elif 'label' in store:
+        pred_class = torch.from_numpy(store['label']).long()
+    else:
+        raise ValueError(f"The prediction store has neither features nor labels: {pred_pc_path}")
+    
+    return pred_xyz, pred_color, pred_class
@@ -1,12 +1,19 @@
 import os
-import torch
 import pickle
 import numpy as np
 import pandas as pd
 import argparse
+import sqlite3
 from pathlib import Path
 import json
 
+from src.results_index import get_default_index_path, get_run_key, upsert_run_metrics
+
+
+CONF_MATRIX_SUFFIX = "_conf_matrix.pkl"
+CONF_MATRIX_STORE_NAME = "conf_matrices.npz"
+
+
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -36,58 +43,94 @@ def get_parser():
         help="JSON-formatted string specifying class chunks, e.g., '{\"head\": [...], \"common\": [...], \"tail\": [...]}'"
     )
     
+    parser.add_argument(
+        "--rebuild_store", 
+        action="store_true",
+        help=f'Rebuild the {CONF_MATRIX_STORE_NAME} store even if it is up to date with the *_conf_matrix.pkl files'
+    )
+    
+    parser.add_argument(
+        "--results_index", 
+        type=Path, 
+        default=None,
+        help='SQLite results index to upsert the metrics into, defaults to <root>/results_index.sqlite for an output directory <root>/<approach>/<dataset>/<label> whose root is an osma-bench directory or holds an index already; other output directories are only indexed with this option'
+    )
+    
+    parser.add_argument(
+        "--no_results_index", 
+        action="store_true",
+        help='Do not upsert the metrics into the results index'
+    )
+    
     return parser
 
 
-def compute_metrics(confmatrix, labels=None, excluded=None, existed=None):
-    nonzero_mask = (confmatrix.sum(axis=1) != 0)
+def get_label_mask(labels, excluded=None, existed=None):
+    mask = np.ones(len(labels), dtype=bool)
     
-    if labels is not None:
-        if excluded is not None:
-            nonzero_mask = nonzero_mask * np.isin(labels, np.array(excluded), invert=True)
-        if existed is not None:
-            nonzero_mask = nonzero_mask * np.isin(labels, np.array(existed))
+    if excluded is not None:
+        mask &= np.isin(labels, np.array(excluded), invert=True)
+    if existed is not None:
+        mask &= np.isin(labels, np.array(existed))
+        
+    return mask
+
+
+def compute_metrics_batched(conf_matrices, label_masks=None):
+    '''Metrics of a (N x C x C) stack of confusion matrices sharing one label axis'''
+    conf_matrices = np.asarray(conf_matrices)
     
-    tp = np.diag(confmatrix)[nonzero_mask]
-    fp = confmatrix.sum(axis=0)[nonzero_mask] - tp
-    fn = confmatrix.sum(axis=1)[nonzero_mask] - tp
+    gt_count = conf_matrices.sum(axis=2)
+    pred_count = conf_matrices.sum(axis=1)
     
-    ious = tp / np.maximum(fn + fp + tp, 1e-7)
-    miou = ious.mean()
-    f_miou = (ious * (tp + fn) / (tp + fn).sum()).sum()
+    mask = gt_count != 0
+    if label_masks is not None:
+        mask &= np.asarray(label_masks, dtype=bool)
+    
+    tp = np.diagonal(conf_matrices, axis1=1, axis2=2)
+    fp = pred_count - tp
+    fn = gt_count - tp
     
-    precision = tp / np.maximum(tp + fp, 1e-7)
+    ious = tp / np.maximum(fn + fp + tp, 1e-7)
     recall = tp / np.maximum(tp + fn, 1e-7)
     
-    f1score = 2 * precision * recall / np.maximum(precision + recall, 1e-7)
-
-    macc = recall.mean()
-
-    mdict = {
-        # "iou": ious.tolist(),
-        "miou": miou.item(),
-        "fmiou": f_miou.item(),
-        "macc": macc.item(),
-        # "acc0.15": (ious > 0.15).sum().item(),
-        # "acc0.25": (ious > 0.25).sum().item(),
-        # "acc0.50": (ious > 0.50).sum().item(),
-        # "acc0.75": (ious > 0.75).sum().item(),
-        # "precision": precision.tolist(),
-        # "recall": recall.tolist(),
-        # "f1score": f1score.tolist()
+    num_classes = mask.sum(axis=1)
+    support = np.where(mask, tp + fn, 0)
+    
+    # Empty selections give NaN, as the mean of an empty array does
+    with np.errstate(invalid="ignore", divide="ignore"):
+        miou = np.where(mask, ious, 0).sum(axis=1) / num_classes
+        f_miou = (np.where(mask, ious, 0) * support).sum(axis=1) / support.sum(axis=1)
+        macc = np.where(mask, recall, 0).sum(axis=1) / num_classes
+    
+    return {
+        "miou": miou,
+        "fmiou": f_miou,
+        "macc": macc,
     }
 
-    return mdict
+
+def compute_metrics(confmatrix, labels=None, excluded=None, existed=None):
+    confmatrix = np.asarray(confmatrix)
+    label_masks = None
+    
+    if labels is not None:
+        label_masks = get_label_mask(np.asarray(labels), excluded=excluded, existed=existed)[None]
+    
+    metrics = compute_metrics_batched(confmatrix[None], label_masks)
+
+    return {name: values[0].item() for name, values in metrics.items()}
 
 
 def load_matrices(results_dir):
     matrices = {}
     
     for filename in sorted(os.listdir(results_dir)):
-        if filename.endswith("_conf_matrix.pkl"):
-            scene_name = filename.replace("_conf_matrix.pkl", "")
+        if filename.endswith(CONF_MATRIX_SUFFIX):
+            scene_name = filename[:-len(CONF_MATRIX_SUFFIX)]
             file_path = os.path.join(results_dir, filename)
             
+            # Unpickling the torch tensors imports torch implicitly, only the store rebuild pays for it
             with open(file_path, "rb") as f:
                 data = pickle.load(f)
                 
@@ -96,70 +139,143 @@ def load_matrices(results_dir):
     return matrices
 
 
-def get_overall_conf_matrix(matrices):
-    overall_labels = np.unique([idx for data in matrices.values() for idx in data['labels']])
+def get_source_stats(results_dir):
+    stats = []
     
-    overall_conf_matrix = np.zeros((len(overall_labels), len(overall_labels)), dtype=int)
+    for filename in sorted(os.listdir(results_dir)):
+        if filename.endswith(CONF_MATRIX_SUFFIX):
+            stat = os.stat(os.path.join(results_dir, filename))
+            stats.append((filename, stat.st_size, stat.st_mtime_ns))
+            
+    return np.array(stats, dtype=[("name", "U256"), ("size", "i8"), ("mtime_ns", "i8")])
+
+
+def stack_conf_matrices(matrices):
+    '''Stack per-scene confusion matrices on the union of their labels'''
+    labels = [np.asarray(data["labels"]).astype(np.int64) for data in matrices.values()]
+    overall_labels = np.unique(np.concatenate(labels)) if labels else np.zeros(0, dtype=np.int64)
     
-    for data in matrices.values():
-        labels = data['labels']
-        conf_matrix = data["conf_matrix"]
-        
-        index_map = {int(val): idx for idx, val in enumerate(overall_labels)}
-        indices = np.array([index_map[int(val)] for val in labels])
-        
-        I, J = np.meshgrid(indices, indices, indexing='ij')
-        overall_conf_matrix[I, J] += conf_matrix.numpy()
-        
-    return overall_conf_matrix, overall_labels
+    conf_matrices = np.zeros((len(matrices), len(overall_labels), len(overall_labels)), dtype=np.int64)
+    
+    for i, (scene_labels, data) in enumerate(zip(labels, matrices.values())):
+        indices = np.searchsorted(overall_labels, scene_labels)
+        conf_matrices[i][np.ix_(indices, indices)] = np.asarray(data["conf_matrix"])
         
+    return conf_matrices, overall_labels
 
-def process_scenes(results_dir, excluded=None):
-    scene_metrics = []
+
+def save_conf_matrix_store(store_path, scenes, labels, conf_matrices, sources=None):
+    tmp_path = f"{store_path}.tmp.npz"
     
-    matrices = load_matrices(results_dir)
+    np.savez(
+        tmp_path,
+        scenes = np.asarray(scenes, dtype=str),
+        labels = labels,
+        conf_matrices = conf_matrices,
+        sources = sources if sources is not None else get_source_stats(os.path.dirname(store_path)),
+    )
+    os.replace(tmp_path, store_path)
+
 
-    for scene_name, data in matrices.items():       
-        conf_matrix = data["conf_matrix"].numpy()
+def load_conf_matrix_store(store_path):
+    with np.load(store_path, allow_pickle=False) as store:
+        return {name: store[name] for name in store.files}
+
+
+def build_conf_matrix_store(results_dir, rebuild=False):
+    '''
+    Consolidate the *_conf_matrix.pkl files of a results directory into one
+    (scenes x C x C) array with a global label axis. The store is reused while
+    it matches the pickled matrices, so it is loaded without torch.
+    '''
+    store_path = os.path.join(results_dir, CONF_MATRIX_STORE_NAME)
+    sources = get_source_stats(results_dir)
+    
+    if not rebuild and os.path.exists(store_path):
+        store = load_conf_matrix_store(store_path)
         
-        metrics = compute_metrics(conf_matrix, data["labels"], excluded=excluded)
-        metrics["scene"] = scene_name
-        scene_metrics.append(metrics)
+        # Without any pickled matrix the store is the only copy of the results
+        if len(sources) == 0 or np.array_equal(store["sources"], sources):
+            return store
+    
+    matrices = load_matrices(results_dir)
+    conf_matrices, labels = stack_conf_matrices(matrices)
+    
+    save_conf_matrix_store(store_path, list(matrices.keys()), labels, conf_matrices, sources=sources)
+    
+    return load_conf_matrix_store(store_path)
+
+
+def process_scenes(results_dir, excluded=None, rebuild=False):
+    store = build_conf_matrix_store(results_dir, rebuild=rebuild)
+    
+    overall_labels = store["labels"]
+    conf_matrices = store["conf_matrices"]
+    
+    label_mask = get_label_mask(overall_labels, excluded=excluded)
+    scene_metrics = compute_metrics_batched(conf_matrices, label_mask[None])
 
     metrics_df = pd.DataFrame(scene_metrics)
+    metrics_df["scene"] = store["scenes"]
     
-    overall_conf_matrix, overall_labels = get_overall_conf_matrix(matrices)
+    overall_conf_matrix = conf_matrices.sum(axis=0)
     
     return overall_conf_matrix, overall_labels, metrics_df
 
 
+def update_results_index(index_path, output_dir, metrics_df, output_file):
+    '''Upsert the metrics of a run, a failure only warns as the metrics are already saved'''
+    if index_path is None:
+        index_path = get_default_index_path(output_dir)
+        
+        if index_path is None:
+            print(f"Not updating the results index: {output_dir} is not a <root>/<approach>/<dataset>/<label> "
+                  "results directory, pass --results_index to index it anyway")
+            return
+    
+    try:
+        upsert_run_metrics(index_path, get_run_key(output_dir), metrics_df, source_path=output_file)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Warning: could not update the results index {index_path}: {e}")
+        return
+    
+    print(f"Updated results index {index_path}")
+
+
 def main(args):   
     excluded = list(map(int, args.excluded.split()))
 
     overall_conf_matrix, overall_labels, metrics_df = \
-        process_scenes(args.results_dir, excluded=excluded)
+        process_scenes(args.results_dir, excluded=excluded, rebuild=args.rebuild_store)
     
     overall_metrics_list = []
     mean_overall = metrics_df.iloc[:, :-1].mean().to_dict()
     mean_overall["scene"] = "overall_mean"
     overall_metrics_list.append(mean_overall)
     
-    overall_metrics = compute_metrics(overall_conf_matrix, overall_labels, excluded=excluded)
-    overall_metrics["scene"] = "overall"
-    overall_metrics_list.append(overall_metrics)
+    # The overall matrix and every chunk are evaluated as one batch of label masks
+    names = ["overall"]
+    label_masks = [get_label_mask(overall_labels, excluded=excluded)]
     
     if args.chunks is not None:
         for chunk_name, existed in json.loads(args.chunks).items():
-            chunk_metrics = compute_metrics(overall_conf_matrix, overall_labels, excluded=excluded, existed=existed)
-            chunk_metrics["scene"] = chunk_name
-            overall_metrics_list.append(chunk_metrics)
+            names.append(chunk_name)
+            label_masks.append(get_label_mask(overall_labels, excluded=excluded, existed=existed))
+            
+    overall_conf_matrices = np.broadcast_to(overall_conf_matrix, (len(names),) + overall_conf_matrix.shape)
+    
+    overall_metrics = pd.DataFrame(compute_metrics_batched(overall_conf_matrices, np.stack(label_masks)))
+    overall_metrics["scene"] = names
     
-    metrics_df = pd.concat([metrics_df, pd.DataFrame(overall_metrics_list)], ignore_index=True)
+    metrics_df = pd.concat([metrics_df, pd.DataFrame(overall_metrics_list), overall_metrics], ignore_index=True)
     print(metrics_df)
 
     output_dir = args.output_dir if args.output_dir is not None else args.results_dir
     output_file = os.path.join(output_dir, 'metrics.csv')
     metrics_df.to_csv(output_file, index=False)
+    
+    if not args.no_results_index:
+        update_results_index(args.results_index, output_dir, metrics_df, output_file)
 
 
 if __name__ == "__main__":
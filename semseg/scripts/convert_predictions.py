@@ -0,0 +1,51 @@
+import argparse
+import json
+from pathlib import Path
+
+from src.pred_store import convert_pred_pointcloud
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Convert the predictions of an approach into a prediction store")
+    
+    parser.add_argument(
+        "--approach", type=str, required=True,
+        help="Approach name: 'cg', 'bbq' or 'openscene'"
+    )
+    
+    parser.add_argument(
+        "--pred_pc_path", type=Path, required=True,
+        help="Path to the native predictions, or to a directory written by save_pointcloud"
+    )
+    
+    parser.add_argument(
+        "--output", type=Path, required=True,
+        help="Prediction store directory to write"
+    )
+    
+    parser.add_argument(
+        "--semantic_info_path", type=Path, default=None,
+        help="Optional semantic info JSON, its class names are stored as the annotations"
+    )
+    
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    
+    annotations = None
+    
+    if args.semantic_info_path is not None:
+        with open(args.semantic_info_path) as f:
+            semantic_info = json.load(f)
+        
+        annotations = {obj["id"]: obj["name"] for obj in semantic_info["classes"]}
+    
+    convert_pred_pointcloud(args.approach, args.pred_pc_path, args.output, annotations=annotations)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,35 @@
 import argparse
 import json
+import multiprocessing
 import os
 import pickle
+import queue
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 
 import open_clip
+import yaml
 import torch
 import numpy as np
 import open3d as o3d
 
-from src.eval import evaluate_scen, load_gt_pointcloud, load_pred_pointcloud
-from src.pointcloud import save_pointcloud
+from compute_metrics import compute_metrics as compute_conf_metrics, compute_metrics_batched, get_label_mask
+from src.approx import bootstrap_conf_matrices, get_row_weights, stratified_sample
+from src.association_cache import AssociationCache
+from src.clip_cache import TextEmbeddingCache
+from src.eval import (
+    EVALUATOR_VERSION, evaluate_scen, evaluate_scen_sweep, has_pred_objects, load_gt_pointcloud, 
+    load_pred_objects, load_pred_pointcloud
+)
+from src.eval_manifest import EvalManifest
+from src.gt_bake import get_gt_source_paths
+from src.hashing import hash_path, hash_paths
+from src.knn import KNN_BACKENDS
+from src.objects import broadcast_object_class, classify_objects
+from src.pointcloud import SAVE_FORMATS, save_pointcloud
+from src.shared import SharedArray, attach_shared_array, detach_shared_array
 
 
 def get_parser():
@@ -18,22 +37,43 @@ def get_parser():
         description="Evaluate semantic segmentation predictions")
     
     parser.add_argument(
-        "--approach", type=str, required=True,
+        "--approach", type=str,
         help="Name of the approach being evaluated"
     )
     
     parser.add_argument(
-        "--semantic_info_path", type=Path, required=True,
+        "--semantic_info_path", type=Path,
         help="Path to the semantic info JSON file"
     )
     
     parser.add_argument(
-        "--gt_pc_path", type=Path, required=True,
+        "--gt_pc_path", type=Path,
         help="Path to the ground-truth point cloud file"
     )
     
     parser.add_argument(
-        "--pred_pc_path", type=Path, required=True,
+        "--gt_bbox", type=str, default=None,
+        help=(
+            'Evaluate only the GT points inside "xmin ymin zmin xmax ymax zmax", '
+            "reading only the intersecting tiles of a tiled .h5 GT point cloud (run_slam.py --save_h5)"
+        )
+    )
+    
+    parser.add_argument(
+        "--gt_bake", action='store_true',
+        help=(
+            "Load the GT from a memory-mapped baked copy next to --gt_pc_path or in --gt_bake_dir (float32 xyz, int16/int32 classes), "
+            "creating it on the first run and whenever the source files change"
+        )
+    )
+    
+    parser.add_argument(
+        "--gt_bake_dir", type=Path, default=None,
+        help="Directory of the baked GT copies of --gt_bake, instead of next to --gt_pc_path"
+    )
+    
+    parser.add_argument(
+        "--pred_pc_path", type=Path,
         help="Path to the predicted point cloud results"
     )
     
@@ -42,6 +82,14 @@ def get_parser():
         help="Optional directory to save predicted point clouds"
     )
     
+    parser.add_argument(
+        "--pred_pc_save_format", type=str, choices=SAVE_FORMATS, default='pcd',
+        help=(
+            "Format of the saved predicted point clouds: pointcloud.pcd + semantic.npy + annotations.json, "
+            "or a memory-mappable prediction store readable by eval_semseg.py and semantic_gui.py"
+        )
+    )
+    
     parser.add_argument(
         "--existed_classes", type=str, default=None,
         help="Space-separated list of class indices to include (e.g., \"1 2 3\")"
@@ -63,12 +111,12 @@ def get_parser():
     )
     
     parser.add_argument(
-        "--output_path", type=Path, required=True,
+        "--output_path", type=Path,
         help="Directory to save final evaluation metrics and outputs"
     )
     
     parser.add_argument(
-        "--result_tag", type=str, required=True,
+        "--result_tag", type=str,
         help="Unique identifier for this result (used to label outputs)"
     )
     
@@ -95,14 +143,253 @@ def get_parser():
         )
     )
     
+    parser.add_argument(
+        "--clip_cache_dir", type=Path, default=None,
+        help=(
+            "Directory of cached CLIP class text embeddings, keyed by model, pretrained tag, "
+            "prompt template and class name. The CLIP model is not loaded if all classes are cached"
+        )
+    )
+    
     parser.add_argument(
         "--nn_count", type=int, default=5,
         help="Number of nearest neighbors used in k-NN when assigning predicted points to ground truth"
     )
+    
+    parser.add_argument(
+        "--knn_backend", type=str, default="auto", choices=KNN_BACKENDS,
+        help=(
+            "k-NN implementation: 'cuda' (pytorch3d), 'kdtree' (CPU KD-tree over the predicted cloud) "
+            "or 'auto' (cuda if available, kdtree otherwise)"
+        )
+    )
+    
+    parser.add_argument(
+        "--knn_chunk_size", type=int, default=262_144,
+        help="Number of GT points per k-NN query chunk of the kdtree backend"
+    )
+    
+    parser.add_argument(
+        "--knn_workers", type=int, default=None,
+        help="Number of threads querying the KD-tree (all CPUs by default)"
+    )
+    
+    parser.add_argument(
+        "--association", type=str, default="knn", choices=["knn", "voxel"],
+        help=(
+            "How GT points get predicted labels: 'knn' votes over the --nn_count nearest predicted points, "
+            "'voxel' takes the majority predicted label of the shared voxel (O(N) approximation)"
+        )
+    )
+    
+    parser.add_argument(
+        "--voxel_size", type=float, default=0.05,
+        help="Voxel size in meters for --association voxel"
+    )
+    
+    parser.add_argument(
+        "--association_report", action='store_true',
+        help=(
+            "Also run the exact k-NN association and save the metric delta and timings "
+            "to <result_tag>_association_report.json"
+        )
+    )
+    
+    parser.add_argument(
+        "--association_cache_dir", type=Path, default=None,
+        help=(
+            "Directory caching the k-NN indices of the GT points and the point to object mapping of "
+            "object-based predictions (cg, bbq), keyed by the prediction and GT file hashes. "
+            "Re-evaluating the same maps with other CLIP models or prompts then skips the association"
+        )
+    )
+    
+    parser.add_argument(
+        "--eval_block_size", type=int, default=1_000_000,
+        help=(
+            "Number of GT points associated and accumulated into the confusion matrix at once; "
+            "bounds peak memory on large GT clouds. 0 processes the whole cloud in one block"
+        )
+    )
+    
+    parser.add_argument(
+        "--approx", type=float, default=None,
+        help=(
+            "Fast approximate evaluation: associate only this fraction of the GT points of every class, "
+            "weight them by their inverse sampling probability and save the mIoU/fmIoU/mAcc estimates with "
+            "bootstrap confidence intervals to <output_path>/<result_tag>_approx_report.json instead of the "
+            "confusion matrix"
+        )
+    )
+    
+    parser.add_argument(
+        "--approx_min_per_class", type=int, default=100,
+        help="Minimum number of sampled GT points of every class in --approx mode, smaller classes are kept whole"
+    )
+    
+    parser.add_argument(
+        "--approx_bootstrap", type=int, default=200,
+        help="Number of bootstrap resamples of the confidence intervals in --approx mode"
+    )
+    
+    parser.add_argument(
+        "--approx_confidence", type=float, default=0.95,
+        help="Confidence level of the intervals in --approx mode"
+    )
+    
+    parser.add_argument(
+        "--approx_seed", type=int, default=0,
+        help="Seed of the GT sampling and of the bootstrap in --approx mode"
+    )
+    
+    parser.add_argument(
+        "--sweep_nn_counts", type=str, default=None,
+        help=(
+            'Space-separated list of k-NN counts (e.g., "1 3 5") evaluated from a single association pass. '
+            'Results are saved to <output_path>/sweep/<class_set>/k<k>/'
+        )
+    )
+    
+    parser.add_argument(
+        "--sweep_class_sets", type=str, default=None,
+        help=(
+            "JSON string or JSON/YAML file mapping a class set name to overrides of "
+            "existed_classes/excluded_classes/scene_label_set, e.g., "
+            '\'{"all": {"excluded_classes": null}, "no_background": {"excluded_classes": "0"}}\'. '
+            "Every class set is evaluated for every --sweep_nn_counts value in the same pass"
+        )
+    )
+    
+    parser.add_argument(
+        "--manifest", type=Path, default=None,
+        help=(
+            "JSON/YAML list of entries to evaluate in a single process. Each entry may set "
+            "approach, scene, label, pred_pc_path (pred), gt_pc_path (gt), semantic_info_path, "
+            "output_path, result_tag and any other option of this script; missing keys fall back "
+            "to the command line values. The CLIP model and GT point clouds are reused across entries"
+        )
+    )
+    
+    parser.add_argument(
+        "--num_workers", type=int, default=1,
+        help=(
+            "Number of worker processes evaluating --manifest entries in parallel. GT point clouds and "
+            "CLIP class features are computed once by the parent and shared with the workers"
+        )
+    )
+    
+    parser.add_argument(
+        "--worker_memory_gb", type=float, default=None,
+        help=(
+            "Address space limit of every worker process in GB (RLIMIT_AS). "
+            "Only meaningful for CPU evaluation, CUDA reserves large virtual address ranges"
+        )
+    )
+    
+    parser.add_argument(
+        "--gt_cache_size", type=int, default=2,
+        help="Number of GT point clouds kept in memory in --manifest mode"
+    )
+    
+    parser.add_argument(
+        "--skip_unchanged", action='store_true',
+        help=(
+            "Record the hashes of the prediction, GT and semantic info files, the CLIP settings, the options and "
+            "the evaluator version of every result in <output_path>/eval_manifest.json, and skip the entries "
+            "whose results exist and were produced from the same inputs"
+        )
+    )
 
     return parser
 
 
+REQUIRED_ARGS = ['approach', 'semantic_info_path', 'gt_pc_path', 'pred_pc_path', 'output_path', 'result_tag']
+
+MANIFEST_ALIASES = {
+    'pred': 'pred_pc_path',
+    'gt': 'gt_pc_path',
+    'semantic_info': 'semantic_info_path',
+    'output': 'output_path',
+    'tag': 'result_tag',
+}
+
+
+def check_required_args(args):
+    missing = [name for name in REQUIRED_ARGS if getattr(args, name, None) is None]
+    
+    if missing:
+        raise ValueError(f"Missing required arguments: {', '.join('--' + name for name in missing)}")
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path) as f:
+        if manifest_path.suffix in ['.yaml', '.yml']:
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    
+    defaults = {}
+    
+    if isinstance(manifest, dict):
+        defaults = manifest.get('defaults', {})
+        manifest = manifest['entries']
+        
+    return [{**defaults, **entry} for entry in manifest]
+
+
+def get_entry_args(parser, args, entry):
+    actions = {action.dest: action for action in parser._actions}
+    entry_args = argparse.Namespace(**vars(args))
+    
+    for key, value in entry.items():
+        key = MANIFEST_ALIASES.get(key, key)
+        
+        if key in ['scene', 'label']:
+            setattr(entry_args, key, value)
+            continue
+        
+        if key not in actions:
+            raise ValueError(f"Unknown manifest key: {key}")
+        
+        if isinstance(value, (list, tuple)):
+            value = " ".join(map(str, value))
+        
+        if value is not None and actions[key].type is not None:
+            value = actions[key].type(value)
+            
+        setattr(entry_args, key, value)
+    
+    if entry_args.result_tag is None and entry.get('scene') is not None:
+        entry_args.result_tag = str(entry['scene'])
+    
+    check_required_args(entry_args)
+    
+    return entry_args
+
+
+class PointCloudCache:
+    '''Keeps the most recently used GT point clouds in memory'''
+    
+    def __init__(self, max_size=2):
+        self._max_size = max_size
+        self._items = OrderedDict()
+        
+    def get(self, key, loader):
+        if key in self._items:
+            self._items.move_to_end(key)
+            return self._items[key]
+        
+        value = loader()
+        
+        if self._max_size > 0:
+            self._items[key] = value
+            
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+            
+        return value
+
+
 def get_semseg_class_names(semantic_info, existed_classes, excluded_classes):        
     class_id_to_label_mapping = {class_param['id']: class_param['name'] for class_param in semantic_info['classes']}
     class_id_to_label_mapping[0] = "background"
@@ -140,21 +427,51 @@ def get_prompts_feats(prompts, clip_model, clip_tokenizer, device='cuda', batch_
     return class_feats
 
 
-def compute_clip_embeddings(class_ids, class_id_to_label_mapping, device='cuda', batch_size=64, 
-                            model_name="ViT-H-14", pretrained="laion2b_s32b_b79k", prompt_templates = ['{}']):
-    class_ids = sorted(class_ids)
-    class_names = [class_id_to_label_mapping[idx] for idx in class_ids]
-
+@lru_cache(maxsize=None)
+def get_clip_model(model_name, pretrained, device='cuda'):
     clip_model, _, _ = open_clip.create_model_and_transforms(model_name, pretrained)
     clip_model = clip_model.to(device)
     clip_tokenizer = open_clip.get_tokenizer(model_name)
     
+    return clip_model, clip_tokenizer
+
+
+def compute_clip_embeddings(class_ids, class_id_to_label_mapping, device='cuda', batch_size=64, 
+                            model_name="ViT-H-14", pretrained="laion2b_s32b_b79k", prompt_templates = ['{}'],
+                            cache_dir=None):
+    class_ids = sorted(class_ids)
+    class_names = [class_id_to_label_mapping[idx] for idx in class_ids]
+    
+    cache = TextEmbeddingCache(cache_dir, model_name, pretrained) if cache_dir is not None else None
+    
     template_feats = []
     
     for template in prompt_templates:
-        prompts = [template.format(name.replace('_', ' ')) for name in class_names]
+        if cache is None:
+            clip_model, clip_tokenizer = get_clip_model(model_name, pretrained, device)
+            prompts = [template.format(name.replace('_', ' ')) for name in class_names]
+            
+            template_feats.append(get_prompts_feats(prompts, clip_model, clip_tokenizer, device, batch_size))
+            continue
         
-        template_feats.append(get_prompts_feats(prompts, clip_model, clip_tokenizer, device, batch_size))
+        cached_feats = [cache.load(template, name) for name in class_names]
+        missing_names = [name for name, feat in zip(class_names, cached_feats) if feat is None]
+        
+        if missing_names:
+            # The model is instantiated only if some classes are not cached yet
+            clip_model, clip_tokenizer = get_clip_model(model_name, pretrained, device)
+            prompts = [template.format(name.replace('_', ' ')) for name in missing_names]
+            
+            missing_feats = get_prompts_feats(prompts, clip_model, clip_tokenizer, device, batch_size)
+            missing_feats = missing_feats.float().cpu().numpy()
+            cache.save(template, missing_names, missing_feats)
+            
+            missing_feats = iter(missing_feats.astype(np.float16))
+            cached_feats = [next(missing_feats) if feat is None else feat for feat in cached_feats]
+        
+        # Cached fp16 values are used even for freshly computed classes to keep runs consistent
+        feats = torch.from_numpy(np.stack(cached_feats).astype(np.float32)).to(device)
+        template_feats.append(feats)
         
     class_feats = torch.stack(template_feats, dim=-1).mean(dim=-1)
     class_feats /= class_feats.norm(dim=-1, keepdim=True)
@@ -162,7 +479,7 @@ def compute_clip_embeddings(class_ids, class_id_to_label_mapping, device='cuda',
     return {'feats': class_feats, 'names': class_names, 'ids': class_ids}
 
 
-def save_results(output_path, result_tag, conf_matrix=None, df_result=None):   
+def save_results(output_path, result_tag, conf_matrix=None, df_result=None, association_report=None, approx_report=None):   
     os.makedirs(output_path, exist_ok=True)
     
     if conf_matrix is not None:
@@ -181,15 +498,53 @@ def save_results(output_path, result_tag, conf_matrix=None, df_result=None):
             
         df_result.to_csv(save_path, index=False)
         
+    if association_report is not None:
+        save_path = os.path.join(
+            output_path,
+            f"{result_tag}_association_report.json"
+        )
+        
+        with open(save_path, 'w') as f:
+            json.dump(association_report, f, indent=4)
+            
+    if approx_report is not None:
+        save_path = os.path.join(
+            output_path,
+            f"{result_tag}_approx_report.json"
+        )
+        
+        with open(save_path, 'w') as f:
+            json.dump(approx_report, f, indent=4)
+        
 
-def main():
-    parser = get_parser()
-    args = parser.parse_args()
+def get_gt_key(args):
+    # The semantic info only affects the labels of .ply meshes
+    return (
+        str(args.gt_pc_path), 
+        str(args.semantic_info_path) if args.gt_pc_path.suffix == '.ply' else None, 
+        args.gt_bbox
+    )
+
+
+def group_entries_by_gt(entries_args, entries_inputs):
+    '''Stable reorder so that the entries of one GT, e.g. the lighting variants of a scene, run back to back'''
+    first_index = {}
+    for entry_args in entries_args:
+        first_index.setdefault(get_gt_key(entry_args), len(first_index))
     
-    semantic_info = json.load(open(args.semantic_info_path))
+    order = sorted(range(len(entries_args)), key=lambda i: first_index[get_gt_key(entries_args[i])])
     
-    gt_pointcloud = load_gt_pointcloud(args.gt_pc_path, semantic_info)
+    return [entries_args[i] for i in order], [entries_inputs[i] for i in order]
+
+
+def load_entry_gt(args, semantic_info, gt_cache=None):
+    if gt_cache is None:
+        return load_gt_pointcloud(args.gt_pc_path, semantic_info, bake=args.gt_bake, bbox=args.gt_bbox, bake_dir=args.gt_bake_dir)
     
+    return gt_cache.get(get_gt_key(args), lambda: load_gt_pointcloud(args.gt_pc_path, semantic_info, bake=args.gt_bake, bbox=args.gt_bbox, bake_dir=args.gt_bake_dir))
+
+
+def get_entry_class_feats(args, semantic_info, gt_pointcloud):
     if args.scene_label_set:
         gt_class = gt_pointcloud[-1]
         args.existed_classes = set(gt_class.tolist())
@@ -208,10 +563,56 @@ def main():
         batch_size = args.clip_batch_size,
         model_name = args.clip_name,
         pretrained = args.clip_pretrained,
-        prompt_templates = list(map(str.strip, args.clip_prompts.split(';')))
+        prompt_templates = list(map(str.strip, args.clip_prompts.split(';'))),
+        cache_dir = args.clip_cache_dir
     )
     
-    pred_pointcloud = load_pred_pointcloud(args.approach, args.pred_pc_path, class_feats, args.device)
+    return class_feats, class_id_to_label_mapping
+
+
+def get_association_cache(args):
+    # Cached k-NN indices cover every GT point, the approximate mode only associates a sample of them
+    if args.association_cache_dir is None or args.association != 'knn' or args.approx is not None:
+        return None
+    
+    if not has_pred_objects(args.approach, args.pred_pc_path):
+        return None
+    
+    return AssociationCache(
+        args.association_cache_dir,
+        pred_hash = hash_path(args.pred_pc_path),
+        gt_hash = hash_paths(get_gt_source_paths(args.gt_pc_path)) + (f"@{args.gt_bbox}" if args.gt_bbox else ""),
+        nn_count = args.nn_count
+    )
+
+
+def load_cached_pred_pointcloud(args, association_cache, class_feats):
+    '''
+    Classify the predicted objects and broadcast their class with the cached point to object
+    mapping. The object point clouds are only loaded when the association has to be computed.
+    '''
+    point_object = association_cache.load_point_object()
+    
+    with_points = point_object is None or not association_cache.has_knn_indices() or args.pred_pc_save_dir is not None
+    pred_objects = load_pred_objects(args.approach, args.pred_pc_path, with_points=with_points)
+    
+    if point_object is None:
+        point_object = pred_objects['point_object'].numpy()
+        association_cache.save_point_object(point_object)
+    
+    object_class = classify_objects(pred_objects['object_feats'], class_feats, args.device)
+    pred_class = broadcast_object_class(object_class, torch.from_numpy(point_object))
+    
+    return pred_objects.get('xyz'), pred_objects.get('color'), pred_class
+
+
+def run_entry(args, gt_pointcloud, class_feats, class_id_to_label_mapping):
+    association_cache = get_association_cache(args)
+    
+    if association_cache is None:
+        pred_pointcloud = load_pred_pointcloud(args.approach, args.pred_pc_path, class_feats, args.device)
+    else:
+        pred_pointcloud = load_cached_pred_pointcloud(args, association_cache, class_feats)
     
     if args.pred_pc_save_dir is not None:
         pred_xyz, pred_color, pred_class = pred_pointcloud
@@ -221,17 +622,563 @@ def main():
             xyz = pred_xyz,
             colors = pred_color,
             semantics = pred_class,
-            annotations = class_id_to_label_mapping
+            annotations = class_id_to_label_mapping,
+            save_format = args.pred_pc_save_format
         )
     
+    start_time = time.perf_counter()
+    
     conf_matrix = evaluate_scen(
         gt_pointcloud,
         pred_pointcloud, 
         class_feats,
-        nn_count = args.nn_count
+        nn_count = args.nn_count,
+        knn_backend = args.knn_backend,
+        knn_chunk_size = args.knn_chunk_size,
+        knn_workers = args.knn_workers,
+        block_size = args.eval_block_size,
+        association = args.association,
+        voxel_size = args.voxel_size,
+        association_cache = association_cache
+    )
+    
+    elapsed_time = time.perf_counter() - start_time
+    
+    association_report = None
+    
+    if args.association_report and args.association != 'knn':
+        association_report = report_association_delta(
+            args, gt_pointcloud, pred_pointcloud, class_feats, conf_matrix, elapsed_time
+        )
+        
+    return conf_matrix, association_report
+
+
+def evaluate_entry(args, gt_cache=None):
+    semantic_info = json.load(open(args.semantic_info_path))
+    
+    gt_pointcloud = load_entry_gt(args, semantic_info, gt_cache)
+    class_feats, class_id_to_label_mapping = get_entry_class_feats(args, semantic_info, gt_pointcloud)
+    
+    conf_matrix, association_report = run_entry(args, gt_pointcloud, class_feats, class_id_to_label_mapping)
+    
+    save_results(args.output_path, args.result_tag, conf_matrix=conf_matrix, association_report=association_report)
+
+
+APPROX_METRICS = ["miou", "fmiou", "macc"]
+
+
+def get_approx_report(args, conf_matrix, labels, classes, counts, sampled):
+    '''
+    Metrics of the confusion matrix of a stratified GT sample with every row weighted by the inverse
+    sampling probability of its class, and their bootstrap percentile intervals
+    '''
+    conf_matrix = np.asarray(conf_matrix)
+    row_weights = get_row_weights(labels, classes, counts, sampled)
+    
+    estimate = compute_conf_metrics(conf_matrix * row_weights[:, None], labels, excluded=[-1])
+    
+    resampled = bootstrap_conf_matrices(conf_matrix, args.approx_bootstrap, seed=args.approx_seed)
+    label_masks = get_label_mask(labels, excluded=[-1])[None]
+    bootstrap = compute_metrics_batched(resampled * row_weights[None, :, None], label_masks)
+    
+    alpha = (1 - args.approx_confidence) / 2 * 100
+    metrics = {}
+    
+    for metric in APPROX_METRICS:
+        low, high = np.nanpercentile(bootstrap[metric], [alpha, 100 - alpha]) if args.approx_bootstrap > 0 else (np.nan, np.nan)
+        
+        metrics[metric] = {
+            "estimate": estimate[metric],
+            "ci_low": float(low),
+            "ci_high": float(high),
+            "std": float(np.nanstd(bootstrap[metric])) if args.approx_bootstrap > 0 else None,
+        }
+    
+    return {
+        "fraction": args.approx,
+        "min_per_class": args.approx_min_per_class,
+        "num_bootstrap": args.approx_bootstrap,
+        "confidence": args.approx_confidence,
+        "seed": args.approx_seed,
+        "num_gt_points": int(counts.sum()),
+        "num_sampled_points": int(sampled.sum()),
+        "metrics": metrics,
+    }
+
+
+def approx_entry(args, gt_cache=None):
+    '''Evaluate a stratified sample of the GT points, see --approx'''
+    semantic_info = json.load(open(args.semantic_info_path))
+    
+    gt_pointcloud = load_entry_gt(args, semantic_info, gt_cache)
+    class_feats, _ = get_entry_class_feats(args, semantic_info, gt_pointcloud)
+    
+    gt_xyz, gt_class = gt_pointcloud
+    indices, classes, counts, sampled = stratified_sample(
+        gt_class.numpy(), 
+        args.approx, 
+        min_per_class = args.approx_min_per_class, 
+        seed = args.approx_seed
+    )
+    indices = torch.from_numpy(indices)
+    
+    pred_pointcloud = load_pred_pointcloud(args.approach, args.pred_pc_path, class_feats, args.device)
+    
+    start_time = time.perf_counter()
+    
+    result = evaluate_scen(
+        (gt_xyz[indices], gt_class[indices]),
+        pred_pointcloud, 
+        class_feats,
+        nn_count = args.nn_count,
+        knn_backend = args.knn_backend,
+        knn_chunk_size = args.knn_chunk_size,
+        knn_workers = args.knn_workers,
+        block_size = args.eval_block_size,
+        association = args.association,
+        voxel_size = args.voxel_size
+    )
+    
+    elapsed_time = time.perf_counter() - start_time
+    
+    report = get_approx_report(args, result["conf_matrix"].numpy(), result["labels"].numpy(), classes, counts, sampled)
+    report["time"] = elapsed_time
+    
+    print(f"Approximate metrics ({report['num_sampled_points']} of {report['num_gt_points']} GT points, "
+          f"{args.approx_confidence:.0%} CI): " + 
+          ", ".join(
+              f"{metric}={value['estimate'] * 100:.2f} [{value['ci_low'] * 100:.2f}, {value['ci_high'] * 100:.2f}]"
+              for metric, value in report["metrics"].items()
+          ) + f", time {elapsed_time:.1f}s")
+    
+    save_results(args.output_path, args.result_tag, approx_report=report)
+
+
+SWEEP_CLASS_SET_KEYS = ['existed_classes', 'excluded_classes', 'scene_label_set']
+
+
+def is_sweep(args):
+    return args.sweep_nn_counts is not None or args.sweep_class_sets is not None
+
+
+def get_sweep_nn_counts(args):
+    return sorted(set(map(int, args.sweep_nn_counts.split()))) if args.sweep_nn_counts else [args.nn_count]
+
+
+def load_sweep_class_sets(sweep_class_sets):
+    if sweep_class_sets is None:
+        return {"default": {}}
+    
+    if os.path.isfile(sweep_class_sets):
+        with open(sweep_class_sets) as f:
+            class_sets = yaml.safe_load(f)
+    else:
+        class_sets = json.loads(sweep_class_sets)
+        
+    for name, overrides in class_sets.items():
+        unknown_keys = set(overrides) - set(SWEEP_CLASS_SET_KEYS)
+        
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in class set {name}: {sorted(unknown_keys)}")
+        
+    return class_sets
+
+
+def sweep_entry(args, gt_cache=None):
+    '''Evaluate every (class set, k) combination of the sweep with one k-NN pass'''
+    if args.association != 'knn':
+        raise ValueError("Sweeps are only supported with --association knn")
+    
+    semantic_info = json.load(open(args.semantic_info_path))
+    gt_pointcloud = load_entry_gt(args, semantic_info, gt_cache)
+    
+    nn_counts = get_sweep_nn_counts(args)
+    
+    pred_xyz = None
+    pred_classes = {}
+    
+    for name, overrides in load_sweep_class_sets(args.sweep_class_sets).items():
+        set_args = argparse.Namespace(**{**vars(args), **overrides})
+        
+        if isinstance(set_args.existed_classes, (list, tuple)):
+            set_args.existed_classes = " ".join(map(str, set_args.existed_classes))
+        if isinstance(set_args.excluded_classes, (list, tuple)):
+            set_args.excluded_classes = " ".join(map(str, set_args.excluded_classes))
+        
+        class_feats, _ = get_entry_class_feats(set_args, semantic_info, gt_pointcloud)
+        pred_xyz, _, pred_class = load_pred_pointcloud(args.approach, args.pred_pc_path, class_feats, args.device)
+        
+        pred_classes[name] = (pred_class, class_feats['ids'])
+    
+    results = evaluate_scen_sweep(
+        gt_pointcloud,
+        pred_xyz,
+        pred_classes,
+        nn_counts = nn_counts,
+        knn_backend = args.knn_backend,
+        knn_chunk_size = args.knn_chunk_size,
+        knn_workers = args.knn_workers,
+        block_size = args.eval_block_size
     )
     
-    save_results(args.output_path, args.result_tag, conf_matrix=conf_matrix)
+    for (name, k), conf_matrix in results.items():
+        save_results(
+            os.path.join(args.output_path, "sweep", name, f"k{k}"), 
+            args.result_tag, 
+            conf_matrix = conf_matrix
+        )
+
+
+EVAL_OPTION_KEYS = [
+    'existed_classes', 'excluded_classes', 'scene_label_set', 'gt_bbox', 'nn_count', 'association', 'voxel_size',
+    'association_report', 'sweep_nn_counts', 'pred_pc_save_dir', 'pred_pc_save_format',
+    'approx', 'approx_min_per_class', 'approx_bootstrap', 'approx_confidence', 'approx_seed',
+    # Cached text embeddings are fp16, predictions may differ from fresh fp32 ones
+    'clip_cache_dir'
+]
+
+
+def get_entry_inputs(args):
+    '''Everything the results of an entry depend on, recorded in the evaluation manifest'''
+    return {
+        "evaluator_version": EVALUATOR_VERSION,
+        "approach": args.approach,
+        "pred": hash_path(args.pred_pc_path),
+        "gt": hash_paths(get_gt_source_paths(args.gt_pc_path)),
+        "semantic_info": hash_path(args.semantic_info_path),
+        "clip": [args.clip_name, args.clip_pretrained, args.clip_prompts],
+        "options": {key: getattr(args, key) for key in EVAL_OPTION_KEYS},
+        "sweep_class_sets": load_sweep_class_sets(args.sweep_class_sets) if args.sweep_class_sets is not None else None,
+    }
+
+
+def get_entry_outputs(args):
+    if is_sweep(args):
+        return [
+            os.path.join(args.output_path, "sweep", name, f"k{k}", f"{args.result_tag}_conf_matrix.pkl")
+            for name in load_sweep_class_sets(args.sweep_class_sets) for k in get_sweep_nn_counts(args)
+        ]
+    
+    if args.approx is not None:
+        return [os.path.join(args.output_path, f"{args.result_tag}_approx_report.json")]
+    
+    outputs = [os.path.join(args.output_path, f"{args.result_tag}_conf_matrix.pkl")]
+    
+    if args.association_report and args.association != 'knn':
+        outputs.append(os.path.join(args.output_path, f"{args.result_tag}_association_report.json"))
+        
+    return outputs
+
+
+def describe_entry(args):
+    return f"{args.approach}: {getattr(args, 'label', None) or '-'}/{args.result_tag}"
+
+
+def filter_unchanged_entries(entries_args):
+    '''
+    Entries whose results are missing or whose inputs changed since they were recorded, with
+    their current inputs. The other entries are reported as reused.
+    '''
+    pending_args, pending_inputs = [], []
+    
+    for entry_args in entries_args:
+        inputs = get_entry_inputs(entry_args)
+        changed = EvalManifest(entry_args.output_path).get_changed_inputs(
+            entry_args.result_tag, inputs, get_entry_outputs(entry_args)
+        )
+        
+        if changed:
+            print(f"To evaluate {describe_entry(entry_args)} ({', '.join(changed)})")
+            pending_args.append(entry_args)
+            pending_inputs.append(inputs)
+        else:
+            print(f"Reusing {describe_entry(entry_args)}: inputs unchanged")
+    
+    print(f"Reusing {len(entries_args) - len(pending_args)} of {len(entries_args)} entries, "
+          f"evaluating {len(pending_args)}")
+    
+    return pending_args, pending_inputs
+
+
+def record_entry(args, inputs):
+    if inputs is not None:
+        EvalManifest(args.output_path).record(args.result_tag, inputs, get_entry_outputs(args))
+
+
+def report_association_delta(args, gt_pointcloud, pred_pointcloud, class_feats, conf_matrix, elapsed_time):
+    '''Compare the metrics of the current association against the exact k-NN one'''
+    start_time = time.perf_counter()
+    
+    knn_conf_matrix = evaluate_scen(
+        gt_pointcloud,
+        pred_pointcloud, 
+        class_feats,
+        nn_count = args.nn_count,
+        knn_backend = args.knn_backend,
+        knn_chunk_size = args.knn_chunk_size,
+        knn_workers = args.knn_workers,
+        block_size = args.eval_block_size,
+        association = 'knn'
+    )
+    
+    knn_elapsed_time = time.perf_counter() - start_time
+    
+    report = {"association": args.association, "voxel_size": args.voxel_size, "nn_count": args.nn_count}
+    
+    for name, result, elapsed in [
+        (args.association, conf_matrix, elapsed_time),
+        ("knn", knn_conf_matrix, knn_elapsed_time)
+    ]:
+        metrics = compute_conf_metrics(result["conf_matrix"].numpy(), result["labels"].numpy(), excluded=[-1])
+        report[name] = {**metrics, "time": elapsed}
+    
+    report["delta"] = {
+        metric: report[args.association][metric] - report["knn"][metric]
+        for metric in ["miou", "fmiou", "macc"]
+    }
+    
+    print(f"Association delta ({args.association} - knn): " + 
+          ", ".join(f"{metric}={value * 100:+.2f}" for metric, value in report["delta"].items()) +
+          f", time {elapsed_time:.1f}s vs {knn_elapsed_time:.1f}s")
+    
+    return report
+
+
+def init_worker(num_threads, memory_limit_gb=None):
+    torch.set_num_threads(num_threads)
+    
+    if memory_limit_gb is not None:
+        import resource
+        
+        memory_limit = int(memory_limit_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def evaluate_entry_worker(task):
+    entry_args, gt_descriptors, feats_descriptor, class_names, class_ids, class_id_to_label_mapping = task
+    
+    # GT arrays and class features are attached from the parent, not copied
+    gt_pointcloud = tuple(torch.from_numpy(attach_shared_array(descriptor)) for descriptor in gt_descriptors)
+    
+    class_feats = {
+        'feats': torch.from_numpy(attach_shared_array(feats_descriptor)).to(entry_args.device),
+        'names': class_names,
+        'ids': class_ids
+    }
+    
+    try:
+        return run_entry(entry_args, gt_pointcloud, class_feats, class_id_to_label_mapping)
+    finally:
+        # The features belong to this entry only, the views are dropped first so the mapping is released
+        class_feats = gt_pointcloud = None
+        detach_shared_array(feats_descriptor)
+
+
+def get_gt_groups(entries_args):
+    '''Runs of consecutive entries sharing a GT, as lists of entry indices'''
+    groups = []
+    
+    for i, entry_args in enumerate(entries_args):
+        if groups and get_gt_key(entries_args[groups[-1][0]]) == get_gt_key(entry_args):
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+            
+    return groups
+
+
+def share_gt_group(entries_args, group):
+    '''Shared arrays of the GT of a group of entries and the tasks of the entries, with their class features'''
+    shared_arrays = []
+    tasks = []
+    
+    try:
+        gt_pointcloud = None
+        
+        for i in group:
+            entry_args = entries_args[i]
+            semantic_info = json.load(open(entry_args.semantic_info_path))
+            
+            if gt_pointcloud is None:
+                gt_pointcloud = load_entry_gt(entry_args, semantic_info)
+                gt_shared = [SharedArray.from_array(array.numpy()) for array in gt_pointcloud]
+                shared_arrays += gt_shared
+                
+                gt_pointcloud = tuple(torch.from_numpy(shared.array) for shared in gt_shared)
+                
+            class_feats, class_id_to_label_mapping = get_entry_class_feats(entry_args, semantic_info, gt_pointcloud)
+            
+            feats = SharedArray.from_array(class_feats['feats'].cpu().numpy())
+            shared_arrays.append(feats)
+            
+            tasks.append((i, (
+                entry_args,
+                [shared.descriptor for shared in gt_shared],
+                feats.descriptor,
+                class_feats['names'],
+                class_feats['ids'],
+                class_id_to_label_mapping
+            )))
+    except BaseException:
+        for shared in shared_arrays:
+            shared.close()
+        raise
+    
+    return shared_arrays, tasks
+
+
+def evaluate_entries_parallel(entries_args, num_workers, worker_memory_gb=None, entries_inputs=None):
+    '''
+    Evaluate entries on a process pool. Entries are grouped by GT: right before a group is
+    submitted the parent loads its GT and computes the class features of its entries into shared
+    memory, and releases them once the group is evaluated, so only the groups in flight (about
+    2 * num_workers entries) are held. Workers load the predictions and evaluate; the results are
+    written, and recorded with `entries_inputs`, by the parent as they come.
+    '''
+    entries_inputs = [None] * len(entries_args) if entries_inputs is None else entries_inputs
+    entries_args, entries_inputs = group_entries_by_gt(entries_args, entries_inputs)
+    
+    groups = get_gt_groups(entries_args)
+    max_in_flight = 2 * num_workers
+    
+    group_arrays = {}
+    group_remaining = {}
+    entry_group = {}
+    
+    # Callbacks run on a thread of the pool, results are handled by the parent loop
+    results = queue.Queue()
+    num_in_flight = 0
+    num_evaluated = 0
+    
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    context = multiprocessing.get_context('spawn')
+    
+    try:
+        with context.Pool(num_workers, initializer=init_worker, initargs=(num_threads, worker_memory_gb)) as pool:
+            next_group = 0
+            
+            while num_evaluated < len(entries_args):
+                while next_group < len(groups) and num_in_flight < max_in_flight:
+                    group_arrays[next_group], tasks = share_gt_group(entries_args, groups[next_group])
+                    group_remaining[next_group] = len(tasks)
+                    
+                    for i, task in tasks:
+                        entry_group[i] = next_group
+                        pool.apply_async(
+                            evaluate_entry_worker, 
+                            (task,), 
+                            callback = lambda result, i=i: results.put((i, result, None)),
+                            error_callback = lambda error, i=i: results.put((i, None, error))
+                        )
+                        
+                    num_in_flight += len(tasks)
+                    next_group += 1
+                
+                i, result, error = results.get()
+                num_in_flight -= 1
+                
+                if error is not None:
+                    raise error
+                
+                conf_matrix, association_report = result
+                num_evaluated += 1
+                print(f"[{num_evaluated}/{len(entries_args)}] Evaluated {describe_entry(entries_args[i])}")
+                
+                save_results(
+                    entries_args[i].output_path, 
+                    entries_args[i].result_tag, 
+                    conf_matrix = conf_matrix, 
+                    association_report = association_report
+                )
+                record_entry(entries_args[i], entries_inputs[i])
+                
+                group = entry_group[i]
+                group_remaining[group] -= 1
+                
+                if group_remaining[group] == 0:
+                    for shared in group_arrays.pop(group):
+                        shared.close()
+    finally:
+        for shared_arrays in group_arrays.values():
+            for shared in shared_arrays:
+                shared.close()
+
+
+def check_entry_mode(args, num_workers=1):
+    '''Evaluation mode options of an entry, which manifest entries may set too'''
+    if args.approx is not None:
+        if not 0 < args.approx <= 1:
+            raise ValueError("--approx must be a fraction in (0, 1]")
+        
+        if is_sweep(args):
+            raise ValueError("--approx is not supported together with sweeps")
+    
+    if num_workers > 1 and (is_sweep(args) or args.approx is not None):
+        raise ValueError("--num_workers is not supported together with sweeps or --approx")
+
+
+def get_evaluate_fn(args):
+    if is_sweep(args):
+        return sweep_entry
+    if args.approx is not None:
+        return approx_entry
+    
+    return evaluate_entry
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    
+    if args.manifest is None:
+        try:
+            check_required_args(args)
+            check_entry_mode(args)
+        except ValueError as e:
+            parser.error(str(e))
+        
+        entries_args = [args]
+    else:
+        if args.num_workers > 1 and args.knn_workers is None:
+            args.knn_workers = max(1, (os.cpu_count() or 1) // args.num_workers)
+        
+        entries_args = []
+        
+        for i, entry in enumerate(load_manifest(args.manifest)):
+            try:
+                entry_args = get_entry_args(parser, args, entry)
+                check_entry_mode(entry_args, args.num_workers)
+            except ValueError as e:
+                parser.error(f"Manifest entry {i + 1}: {e}")
+            
+            entries_args.append(entry_args)
+    
+    entries_inputs = [None] * len(entries_args)
+    
+    if args.skip_unchanged:
+        entries_args, entries_inputs = filter_unchanged_entries(entries_args)
+    
+    if args.manifest is None:
+        for entry_args, inputs in zip(entries_args, entries_inputs):
+            get_evaluate_fn(entry_args)(entry_args)
+            record_entry(entry_args, inputs)
+        return
+    
+    if args.num_workers > 1:
+        if entries_args:
+            evaluate_entries_parallel(entries_args, args.num_workers, args.worker_memory_gb, entries_inputs)
+        return
+    
+    # The GT cache then loads every GT once, whatever the manifest order
+    entries_args, entries_inputs = group_entries_by_gt(entries_args, entries_inputs)
+    gt_cache = PointCloudCache(max_size=args.gt_cache_size)
+    
+    for i, (entry_args, inputs) in enumerate(zip(entries_args, entries_inputs)):
+        print(f"[{i + 1}/{len(entries_args)}] Evaluating {describe_entry(entry_args)}")
+        
+        get_evaluate_fn(entry_args)(entry_args, gt_cache)
+        record_entry(entry_args, inputs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,168 @@
+import argparse
+from pathlib import Path
+
+from src.pipeline import (
+    expand_jobs, format_stage_summary, get_job_statuses, get_stage_summary, get_stages, load_pipeline, run_jobs
+)
+
+
+# /scripts/osma.py in the containers, next to /export/osma-bench/pipeline.yaml
+DEFAULT_PIPELINE_PATH = Path(__file__).resolve().parents[1] / "export" / "osma-bench" / "pipeline.yaml"
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Run the OSMa-Bench pipeline of an approach on a dataset as a DAG of scene/label jobs")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the jobs that are not done yet")
+    status_parser = subparsers.add_parser("status", help="Show the recorded status and timings of the jobs")
+
+    for subparser in [run_parser, status_parser]:
+        subparser.add_argument(
+            "--approach", type=str, required=True,
+            help="Approach of the pipeline, e.g., bbq, conceptgraphs, openscene"
+        )
+
+        subparser.add_argument(
+            "--dataset", type=str, required=True,
+            help="Dataset of the pipeline, e.g., replica_cad, hm3d"
+        )
+
+        subparser.add_argument(
+            "--pipeline", type=Path, default=DEFAULT_PIPELINE_PATH,
+            help="Pipeline YAML with the datasets, the approaches and their stages"
+        )
+
+        subparser.add_argument(
+            "--state_dir", type=Path, default=Path("/results/osma-runs"),
+            help="Directory of the job states, logs and working directories"
+        )
+
+        subparser.add_argument(
+            "--scenes", type=str, nargs="+", default=None,
+            help="Only these scenes of the dataset"
+        )
+
+        subparser.add_argument(
+            "--labels", type=str, nargs="+", default=None,
+            help="Only these labels of the dataset"
+        )
+
+        subparser.add_argument(
+            "--stages", type=str, nargs="+", default=None,
+            help="Only these stages, the stages they need are assumed to be done"
+        )
+
+        subparser.add_argument(
+            "--var", type=str, nargs="+", default=[],
+            help='Overrides of the pipeline vars, e.g., "clip_name=ViT-H-14"'
+        )
+
+    run_parser.add_argument(
+        "--max_parallel", type=int, default=4,
+        help="Maximum number of jobs running at once"
+    )
+
+    run_parser.add_argument(
+        "--concurrency", type=str, nargs="+", default=[],
+        help='Overrides of the per-stage limits of jobs running at once, e.g., "eval=4 mapping=1"'
+    )
+
+    run_parser.add_argument(
+        "--force", action="store_true",
+        help="Run the selected jobs again even if they are done"
+    )
+
+    run_parser.add_argument(
+        "--dry_run", action="store_true",
+        help="Print the jobs, their dependencies and commands without running them"
+    )
+
+    return parser
+
+
+def parse_assignments(assignments, value_type=str):
+    '''["name=value", ...] to {name: value}'''
+    result = {}
+
+    for assignment in assignments:
+        name, sep, value = assignment.partition("=")
+
+        if not sep:
+            raise ValueError(f'Expected "name=value", got "{assignment}"')
+
+        result[name.strip()] = value_type(value.strip())
+
+    return result
+
+
+def print_jobs(jobs, statuses):
+    for job in jobs:
+        print(f"[{statuses[job.id]}] {job.id}")
+
+        for need in job.needs:
+            print(f"    needs {need}")
+        for command in job.commands:
+            print(f"    $ {command}")
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    pipeline = load_pipeline(args.pipeline)
+
+    try:
+        jobs = expand_jobs(
+            pipeline,
+            approach = args.approach,
+            dataset = args.dataset,
+            state_dir = args.state_dir,
+            scenes = args.scenes,
+            labels = args.labels,
+            stages = args.stages,
+            var_overrides = parse_assignments(args.var)
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == "status" or args.dry_run:
+        statuses = get_job_statuses(jobs, args.state_dir)
+
+        if args.command == "run":
+            print_jobs(jobs, statuses)
+
+        print(format_stage_summary(get_stage_summary(jobs, statuses, args.state_dir)))
+        return
+
+    concurrency = {
+        name: stage["concurrency"]
+        for name, stage in get_stages(pipeline, args.approach).items() if "concurrency" in stage
+    }
+    concurrency.update(parse_assignments(args.concurrency, int))
+
+    statuses = run_jobs(
+        jobs,
+        state_dir = args.state_dir,
+        max_parallel = args.max_parallel,
+        concurrency = concurrency,
+        force = args.force
+    )
+
+    print()
+    print(format_stage_summary(get_stage_summary(jobs, statuses, args.state_dir)))
+
+    failed = [job_id for job_id, status in statuses.items() if status == "failed"]
+
+    if failed:
+        print(f"\n{len(failed)} jobs failed, their logs are in {args.state_dir / 'logs'}:")
+        for job_id in failed:
+            print(f"  {job_id}")
+
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
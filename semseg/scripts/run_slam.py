@@ -2,6 +2,8 @@ import argparse
 import glob
 import os
 import yaml
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from tqdm import tqdm
@@ -11,6 +13,11 @@ import torch
 import numpy as np
 import open3d as o3d
 
+from src.backproject import backproject_frames
+from src.fusion import VoxelFusionMap
+from src.geometry_cache import GeometryCache, gather_frame_colors
+from src.tiles import save_tiled_pointcloud
+
 
 @dataclass
 class Intrinsic:
@@ -65,32 +72,88 @@ class MappingDataset(torch.utils.data.Dataset):
             
             assert len(self._rgb_paths) == len(self._semantic_paths)
             
+        self._traj_path = os.path.join(self._data_path, traj_subpath)
+        self._camera_params_path = os.path.join(self._data_path, camera_params_subpath)
+        
         self._poses = self._load_poses(traj_subpath)
         
         assert len(self._poses) == len(self._rgb_paths)
         
+        # Sliced once here, indexing the sliced lists on every frame would copy them
+        self._rgb_paths = self._rgb_paths[self._slice]
+        self._depth_paths = self._depth_paths[self._slice]
+        self._poses = self._poses[self._slice]
+        
+        if self._load_semantics:
+            self._semantic_paths = self._semantic_paths[self._slice]
+        
         self._intrinsics = self._load_intrinsics(camera_params_subpath)
 
 
     def __len__(self):
-        return len(self._rgb_paths[self._slice])
+        return len(self._rgb_paths)
     
     
     def __getitem__(self, index):
-        rgb = o3d.io.read_image(self._rgb_paths[self._slice][index])
-        depth = o3d.io.read_image(self._depth_paths[self._slice][index])
+        rgb = o3d.io.read_image(self._rgb_paths[index])
+        depth = o3d.io.read_image(self._depth_paths[index])
         
         if self._load_semantics:
-            semantics = o3d.io.read_image(self._semantic_paths[self._slice][index])
+            semantics = o3d.io.read_image(self._semantic_paths[index])
         else:
             semantics = None
             
-        pose = self._poses[self._slice][index]
+        pose = self._poses[index]
         intrinsics = self._intrinsics
         
         return rgb, depth, semantics, pose, intrinsics
     
     
+    def load_rgb(self, index):
+        return o3d.io.read_image(self._rgb_paths[index])
+    
+    
+    def iter_prefetch(self, num_workers=4, prefetch_size=None, loader=None):
+        """Frames in order, decoded by a thread pool up to `prefetch_size` frames ahead"""
+        loader = loader or self.__getitem__
+        
+        if num_workers <= 1:
+            yield from (loader(index) for index in range(len(self)))
+            return
+        
+        prefetch_size = prefetch_size or 2 * num_workers
+        
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = deque()
+            
+            for index in range(len(self)):
+                futures.append(executor.submit(loader, index))
+                
+                if len(futures) >= prefetch_size:
+                    yield futures.popleft().result()
+                    
+            while futures:
+                yield futures.popleft().result()
+    
+    
+    def get_geometry_cache(self, cache_dir, **options):
+        """Cache entry of the back-projected geometry, shared by the sequences with the same trajectory and depth"""
+        return GeometryCache(
+            cache_dir,
+            traj_path = self._traj_path,
+            camera_params_path = self._camera_params_path,
+            depth_paths = self._depth_paths,
+            semantic_paths = self._semantic_paths if self._load_semantics else None,
+            slice = [self._slice.start, self._slice.stop, self._slice.step],
+            **options
+        )
+    
+    
+    @property
+    def poses(self):
+        return self._poses
+    
+    
     def _load_poses(self, traj_subpath):
         with open(os.path.join(self._data_path, traj_subpath), "r") as file:
             poses = []
@@ -150,10 +213,33 @@ def get_parser_args() -> argparse.ArgumentParser:
     
     parser.add_argument("--downsample_rate", type=int, default=1)
     
+    parser.add_argument("--fusion", type=str, choices=["concat", "voxel"], default="concat",
+                        help="'concat' keeps every back-projected point and down-samples at the end, "
+                             "'voxel' streams the frames into a sparse voxel map with running color means "
+                             "and per-class majority votes")
+    parser.add_argument("--voxel_size", type=float, default=0.01,
+                        help="Voxel size of the 'voxel' fusion, in meters")
+    parser.add_argument("--backprojection", type=str, choices=["open3d", "numpy"], default="open3d",
+                        help="'numpy' back-projects batches of frames over a precomputed ray grid and reads "
+                             "class ids as integers, 'open3d' builds RGBD images frame by frame")
+    parser.add_argument("--frame_batch_size", type=int, default=8,
+                        help="Number of frames back-projected at once by the 'numpy' back-projection")
+    parser.add_argument("--num_workers", type=int, default=4,
+                        help="Number of threads decoding the frames ahead of the fusion")
+    parser.add_argument("--fusion_merge_size", type=int, default=4_000_000,
+                        help="Number of pending points merged at once into the voxel map")
+    parser.add_argument("--geometry_cache_dir", type=Path, default=None,
+                        help="Cache of the back-projected points and their source pixels, keyed by the trajectory, "
+                             "depth and semantic hashes: the lighting variants of a scene reuse the geometry "
+                             "and only read their RGB frames ('concat' fusion only)")
+    
     parser.add_argument("--visualize", action="store_true")
     parser.add_argument("--save_pcd", action="store_true", default=True)
     parser.add_argument("--save_ply", action="store_true")
-    parser.add_argument("--save_h5", action="store_true")
+    parser.add_argument("--save_h5", action="store_true",
+                        help="Also save the map as pointcloud.h5, split into spatial tiles readable by region")
+    parser.add_argument("--tile_size", type=float, default=2.0,
+                        help="Edge of the cubic tiles of the .h5 map, in meters")
     
     parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--device", type=str, default="cuda")
@@ -171,6 +257,9 @@ def get_parser_args() -> argparse.ArgumentParser:
     
     args = parser.parse_args()
     
+    if args.geometry_cache_dir is not None and args.fusion != "concat":
+        parser.error("--geometry_cache_dir is only supported with --fusion concat")
+    
     if args.output_dir is None:
         args.output_dir = args.dataset_root
     
@@ -232,6 +321,70 @@ def create_semantic_point_cloud(
     return color_pcd, semantic_pcd
 
 
+def get_semantic_labels(semantic_pcd):
+    np_semantics = np.asarray(semantic_pcd.colors).round().astype(int)
+    
+    assert np.all(np_semantics[..., 0] == np_semantics[..., 1]) and \
+           np.all(np_semantics[..., 0] == np_semantics[..., 2])
+    
+    return np_semantics[..., 0]
+
+
+def iter_frame_batches(frames, batch_size):
+    batch = []
+    
+    for item in frames:
+        batch.append(item)
+        
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+            
+    if batch:
+        yield batch
+
+
+def iter_backprojected_frames(dataset, backprojection="open3d", frame_batch_size=8, num_workers=4):
+    '''
+    (poses, xyz, colors, labels, (frame, pixel)) of the frames of the dataset, back-projected in
+    batches, with the dataset frame index and flat pixel index of every point
+    '''
+    frames = dataset.iter_prefetch(num_workers=num_workers)
+    
+    if backprojection == "open3d":
+        for index, (rgb, depth, semantics, pose, intrinsics) in enumerate(tqdm(frames, total=len(dataset))):
+            color_pcd, semantic_pcd = create_semantic_point_cloud(
+                rgb, depth, intrinsics, pose, semantics
+            )
+            
+            # Both clouds come from the same valid depth pixels, so their points are aligned
+            labels = get_semantic_labels(semantic_pcd) if semantic_pcd is not None else None
+            
+            # Open3D keeps the pixels with positive depth, row by row
+            pixel = np.flatnonzero(np.asarray(depth).reshape(-1) > 0)
+            frame = np.full(len(pixel), index)
+            
+            yield [pose], np.asarray(color_pcd.points), np.asarray(color_pcd.colors), labels, (frame, pixel)
+        
+        return
+    
+    num_batches = (len(dataset) + frame_batch_size - 1) // frame_batch_size
+    
+    for batch_index, batch in enumerate(tqdm(iter_frame_batches(frames, frame_batch_size), total=num_batches)):
+        rgbs, depths, semantics, poses, intrinsics = zip(*batch)
+        
+        xyz, colors, labels, (frame, pixel) = backproject_frames(
+            depths = np.stack([np.asarray(depth) for depth in depths]),
+            poses = np.stack(poses),
+            intrinsic = intrinsics[0],
+            rgbs = np.stack([np.asarray(rgb) for rgb in rgbs]),
+            semantics = np.stack([np.asarray(sem) for sem in semantics]) if semantics[0] is not None else None,
+            return_pixels = True
+        )
+        
+        yield poses, xyz, colors, labels, (frame + batch_index * frame_batch_size, pixel)
+
+
 def main():
     args = get_parser_args()
     torch.manual_seed(args.seed)
@@ -250,32 +403,80 @@ def main():
         camera_params_subpath = args.camera_params_subpath
     )
     
-    color_map = o3d.geometry.PointCloud()
-    semantic_map = o3d.geometry.PointCloud() if args.load_semseg else None
-
-    geometries = []
-    is_first_point = True
-    for (rgb, depth, semantics, pose, intrinsics) in tqdm(dataset):
-        color_pcd, semantic_pcd = create_semantic_point_cloud(
-            rgb, depth, intrinsics, pose, semantics
+    fusion_map = VoxelFusionMap(args.voxel_size, merge_size=args.fusion_merge_size) if args.fusion == "voxel" else None
+    
+    geometry_cache, cached_geometry = None, None
+    
+    if args.geometry_cache_dir is not None:
+        geometry_cache = dataset.get_geometry_cache(
+            args.geometry_cache_dir, 
+            backprojection = args.backprojection, 
+            downsample_rate = args.downsample_rate
         )
+        cached_geometry = geometry_cache.load()
+    
+    if cached_geometry is not None:
+        print(f'Reusing the geometry cached in "{geometry_cache.entry_dir}", reading the RGB frames only')
         
-        color_map += color_pcd
+        map_xyz, map_frames, map_pixels, map_labels = cached_geometry
+        map_xyz = np.array(map_xyz)
+        map_labels = np.array(map_labels) if map_labels is not None else None
         
-        if semantic_map is not None:
-            semantic_map += semantic_pcd
+        rgbs = dataset.iter_prefetch(num_workers=args.num_workers, loader=dataset.load_rgb)
+        map_colors = gather_frame_colors(map_frames, map_pixels, tqdm(rgbs, total=len(dataset)))
+    else:
+        map_xyz, map_colors, map_labels, map_frames, map_pixels = [], [], [], [], []
+        
+        for _, xyz, colors, labels, (frames, pixels) in iter_backprojected_frames(
+            dataset, args.backprojection, args.frame_batch_size, args.num_workers
+        ):
+            if fusion_map is not None:
+                fusion_map.integrate(xyz, colors, labels)
+            else:
+                map_xyz.append(xyz)
+                map_colors.append(colors)
+                
+                # The frame pixels of the points are only needed by the geometry cache
+                if geometry_cache is not None:
+                    map_frames.append(frames)
+                    map_pixels.append(pixels)
+                
+                if labels is not None:
+                    map_labels.append(labels)
         
-        frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=(0.2 if is_first_point else 0.1))
+        if fusion_map is not None:
+            map_xyz, map_colors, map_labels = fusion_map.get_pointcloud()
+        else:
+            # Same points as Open3D's uniform_down_sample
+            map_xyz = np.concatenate(map_xyz)[::args.downsample_rate]
+            map_colors = np.concatenate(map_colors)[::args.downsample_rate]
+            map_labels = np.concatenate(map_labels)[::args.downsample_rate] if map_labels else None
+            
+            if geometry_cache is not None:
+                geometry_cache.save(
+                    map_xyz,
+                    np.concatenate(map_frames)[::args.downsample_rate],
+                    np.concatenate(map_pixels)[::args.downsample_rate],
+                    map_labels,
+                    source = os.path.join(args.dataset_root, args.scene_id)
+                )
+    
+    geometries = []
+    for i, pose in enumerate(dataset.poses):
+        frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=(0.2 if i == 0 else 0.1))
         frame.transform(pose)
         geometries.append(frame)
-        
-        is_first_point = False
-        
     
-    color_map = color_map.uniform_down_sample(every_k_points=args.downsample_rate)
+    color_map = o3d.geometry.PointCloud()
+    color_map.points = o3d.utility.Vector3dVector(map_xyz)
+    color_map.colors = o3d.utility.Vector3dVector(map_colors)
+    
+    semantic_map = None
     
-    if semantic_map is not None:
-        semantic_map = semantic_map.uniform_down_sample(every_k_points=args.downsample_rate)
+    if args.load_semseg:
+        semantic_map = o3d.geometry.PointCloud()
+        semantic_map.points = o3d.utility.Vector3dVector(map_xyz)
+        semantic_map.colors = o3d.utility.Vector3dVector(np.repeat(map_labels[:, None], 3, axis=1).astype(float))
 
     if args.visualize:
         o3d.visualization.draw_geometries([color_map] + geometries)
@@ -285,7 +486,7 @@ def main():
             
     dir_to_save_map = os.path.join(args.output_dir, args.scene_id)
     
-    if args.save_pcd or args.save_ply:
+    if args.save_pcd or args.save_ply or args.save_h5:
         try:
             os.makedirs(dir_to_save_map, exist_ok=False)
         except Exception as _:
@@ -309,16 +510,20 @@ def main():
             color_map
         )
         
+    if args.save_h5:
+        save_tiled_pointcloud(
+            os.path.join(dir_to_save_map, "pointcloud.h5"),
+            map_xyz,
+            colors = map_colors,
+            labels = map_labels,
+            tile_size = args.tile_size
+        )
+        
     if (args.save_pcd or args.save_ply) and semantic_map is not None:
         saving_path = os.path.join(dir_to_save_map, "semantic.npy")
         print(f'Saving semantics to "{saving_path}"')
         
-        np_semantics = np.asarray(semantic_map.colors).round().astype(int)
-        
-        assert np.all(np_semantics[..., 0] == np_semantics[..., 1]) and \
-               np.all(np_semantics[..., 0] == np_semantics[..., 2])
-        
-        np.save(saving_path, np_semantics[..., 0])
+        np.save(saving_path, np.asarray(map_labels).astype(int))
 
 if __name__ == "__main__":  
     main()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import numpy as np
+import hashlib
 import json
 import rerun as rr
 from pathlib import Path
@@ -6,6 +7,10 @@ import open3d as o3d
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
 
+from src.lod import LODPyramid, build_lod_pyramid, is_lod_pyramid
+from src.pred_store import is_pred_store, load_pred_store
+from src.tiles import TILED_PC_EXT, load_tiled_region, parse_bbox
+
 def load_point_cloud(pcd_path):
     """Load point cloud from .pcd file using Open3D"""
     pcd = o3d.io.read_point_cloud(str(pcd_path))
@@ -23,6 +28,32 @@ def load_point_cloud(pcd_path):
     
     return points, colors
 
+def load_pred_store_data(store_dir):
+    """
+    Load points, uint8 colors, semantic labels and annotations from a prediction store.
+    Stores of object-based approaches have no labels, their points are labelled by object
+    instead, and stores with neither are only colored by rgb (None labels)
+    """
+    store = load_pred_store(store_dir)
+    
+    points = store["xyz"]
+    colors = store.get("rgb")
+    semantic_ids = store.get("label")
+    annotations = store.annotations or {}
+    
+    if semantic_ids is None and "object_id" in store:
+        semantic_ids = store["object_id"]
+        annotations = {int(object_id): f"object_{object_id}" for object_id in np.unique(semantic_ids) if object_id >= 0}
+    
+    return points, colors, semantic_ids, annotations
+
+def load_tiled_data(h5_path, bbox=None):
+    """Load points, uint8 colors and semantic labels of the tiles of a .h5 map intersecting bbox"""
+    bbox_min, bbox_max = parse_bbox(bbox) if bbox is not None else (None, None)
+    region = load_tiled_region(h5_path, bbox_min, bbox_max)
+    
+    return region["xyz"], region.get("rgb"), region["label"]
+
 def load_semantic_labels(npy_path):
     """Load semantic labels from .npy file"""
     semantic_ids = np.load(npy_path)
@@ -48,30 +79,171 @@ def generate_colors_for_classes(num_classes):
     
     return colors
 
-def visualize_semantic_pointcloud(pcd_path, semantic_path, annotations_path, app_id="semantic_pointcloud"):
+def build_class_lut(class_mapping, class_colors):
+    """
+    Color lookup table indexed by class id: the class color, gray for classes without a
+    predefined color, and black in the last row for labels that are not in the mapping
+    """
+    class_ids = [class_id for class_id in class_mapping if class_id >= 0]
+    lut = np.zeros((max(class_ids, default=-1) + 2, 3), dtype=np.uint8)
+
+    for class_id in class_ids:
+        lut[class_id] = class_colors[class_id] if class_id < len(class_colors) else [128, 128, 128]
+
+    return lut
+
+def colorize_labels(semantic_ids, lut):
+    """Color every point with one LUT gather, labels outside the table map to its last row"""
+    semantic_ids = np.asarray(semantic_ids)
+    in_range = (semantic_ids >= 0) & (semantic_ids < len(lut) - 1)
+
+    return lut[np.where(in_range, semantic_ids, len(lut) - 1)]
+
+def load_semantic_pointcloud(pcd_path, semantic_path, annotations_path, bbox=None):
+    """Load points, colors, semantic labels and annotations of a .pcd, tiled .h5 or prediction store"""
+    if is_pred_store(pcd_path):
+        print("Loading prediction store...")
+        return load_pred_store_data(pcd_path)
+
+    if str(pcd_path).endswith(TILED_PC_EXT):
+        print("Loading tiled point cloud...")
+        points, rgb_colors, semantic_ids = load_tiled_data(pcd_path, bbox)
+    else:
+        print("Loading point cloud...")
+        points, rgb_colors = load_point_cloud(pcd_path)
+
+        print("Loading semantic labels...")
+        semantic_ids = load_semantic_labels(semantic_path)
+
+    print("Loading annotations...")
+    annotations = load_annotations(annotations_path)
+
+    return points, rgb_colors, semantic_ids, annotations
+
+def get_lod_cache_key(pcd_path, semantic_path, bbox, coarse_voxel_size, num_levels):
+    """Key of a LOD pyramid from the path, size and mtime of its sources and the pyramid parameters"""
+    if is_pred_store(pcd_path) or str(pcd_path).endswith(TILED_PC_EXT):
+        source_paths = [Path(pcd_path)]
+    else:
+        source_paths = [Path(pcd_path), Path(semantic_path)]
+
+    # Stats instead of content hashes, hashing a multi-GB map would cost as much as building the pyramid
+    digest = hashlib.sha1()
+    for source_path in source_paths:
+        files = sorted(p for p in source_path.rglob("*") if p.is_file()) if source_path.is_dir() else [source_path]
+        for file_path in files:
+            stat = file_path.stat()
+            digest.update(f"{file_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+
+    digest.update(f"{bbox}:{coarse_voxel_size}:{num_levels}".encode("utf-8"))
+
+    return digest.hexdigest()
+
+def load_lod_pyramid(pcd_path, semantic_path, annotations_path, bbox=None, cache_dir=None, coarse_voxel_size=0.32, num_levels=5):
+    """Load the cached LOD pyramid of a point cloud, building it on the first call"""
+    if cache_dir is None:
+        cache_dir = Path(pcd_path).resolve().parent / "lod_cache"
+
+    pyramid_dir = Path(cache_dir) / get_lod_cache_key(pcd_path, semantic_path, bbox, coarse_voxel_size, num_levels)
+
+    if not is_lod_pyramid(pyramid_dir):
+        print(f"Building LOD pyramid in {pyramid_dir}...")
+        points, rgb_colors, semantic_ids, annotations = load_semantic_pointcloud(pcd_path, semantic_path, annotations_path, bbox)
+
+        build_lod_pyramid(
+            pyramid_dir,
+            xyz = points,
+            colors = rgb_colors,
+            labels = semantic_ids,
+            coarse_voxel_size = coarse_voxel_size,
+            num_levels = num_levels,
+            meta = {"source": str(pcd_path), "annotations": annotations}
+        )
+
+    return LODPyramid(pyramid_dir)
+
+def visualize_semantic_pointcloud_lod(pcd_path, semantic_path, annotations_path, app_id="semantic_pointcloud", bbox=None,
+                                      cache_dir=None, coarse_voxel_size=0.32, num_levels=5):
+    """
+    Visualize a semantic point cloud level by level: the coarsest level of a cached voxel
+    octree pyramid is logged first and every finer level replaces it, up to the full point cloud
+    """
+    rr.init(app_id, spawn=True)
+    rr.log("", rr.ViewCoordinates.RIGHT_HAND_Y_UP, static=True)
+
+    pyramid = load_lod_pyramid(pcd_path, semantic_path, annotations_path, bbox, cache_dir, coarse_voxel_size, num_levels)
+
+    class_mapping = {int(k): v for k, v in pyramid.meta["annotations"].items()}
+    class_counts = pyramid.class_counts
+
+    print(f"Found {len(class_mapping)} semantic classes:")
+    for class_id, class_name in class_mapping.items():
+        print(f"  {class_id}: {class_name} ({class_counts.get(class_id, 0)} points)")
+
+    lut = build_class_lut(class_mapping, generate_colors_for_classes(len(class_mapping)))
+
+    for level, voxel_size, columns in pyramid.iter_levels():
+        points = columns["xyz"]
+        # Coarse points are drawn as large as their voxel, so the first levels have no holes
+        radii = 0.01 if voxel_size is None else max(voxel_size / 2, 0.01)
+
+        if "label" in columns:
+            rr.log(
+                "pointcloud/semantic_colored",
+                rr.Points3D(
+                    positions=points,
+                    colors=colorize_labels(columns["label"], lut),
+                    radii=radii
+                )
+            )
+
+        if "rgb" in columns:
+            rr.log(
+                "pointcloud/rgb_colored",
+                rr.Points3D(
+                    positions=points,
+                    colors=columns["rgb"],
+                    radii=radii
+                )
+            )
+
+        level_name = "full resolution" if voxel_size is None else f"voxel size {voxel_size:.3f}"
+        print(f"Logged LOD level {level + 1}/{pyramid.num_levels} ({level_name}): {len(points)} points")
+
+    print(f"\nVisualization complete! Total points: {pyramid.meta['num_points']}")
+
+def visualize_semantic_pointcloud(pcd_path, semantic_path, annotations_path, app_id="semantic_pointcloud", bbox=None):
     """
     Visualize semantic segmented point cloud using Rerun with RGB toggle capability
     
     Args:
-        pcd_path: Path to .pcd file
-        semantic_path: Path to semantic.npy file
-        annotations_path: Path to annotations.json file
+        pcd_path: Path to .pcd file, or to a prediction store directory holding all the data
+        semantic_path: Path to semantic.npy file (unused for prediction stores)
+        annotations_path: Path to annotations.json file (unused for prediction stores)
         app_id: Application ID for Rerun
+        bbox: Optional "xmin ymin zmin xmax ymax zmax" region, only the intersecting tiles of a
+            tiled .h5 map (run_slam.py --save_h5) are loaded
     """
     
     # Initialize Rerun
     rr.init(app_id, spawn=True)
     
-    # Load data
-    print("Loading point cloud...")
-    points, rgb_colors = load_point_cloud(pcd_path)
-    print(rgb_colors)
+    points, rgb_colors, semantic_ids, annotations = load_semantic_pointcloud(pcd_path, semantic_path, annotations_path, bbox)
     
-    print("Loading semantic labels...")
-    semantic_ids = load_semantic_labels(semantic_path)
-    
-    print("Loading annotations...")
-    annotations = load_annotations(annotations_path)
+    # Prediction stores without labels or objects
+    if semantic_ids is None:
+        print("No semantic labels found, showing the point cloud only")
+        rr.log(
+            "pointcloud/rgb_colored",
+            rr.Points3D(
+                positions=points,
+                colors=rgb_colors,
+                radii=0.01
+            )
+        )
+        rr.log("", rr.ViewCoordinates.RIGHT_HAND_Y_UP, static=True)
+        print(f"Total points: {len(points)}")
+        return
     
     # Validate data consistency
     if len(points) != len(semantic_ids):
@@ -97,15 +269,7 @@ def visualize_semantic_pointcloud(pcd_path, semantic_path, annotations_path, app
     class_colors = generate_colors_for_classes(num_classes)
     
     # Create semantic color array for points
-    semantic_point_colors = np.zeros((len(points), 3), dtype=np.uint8)
-    
-    for class_id, class_name in class_mapping.items():
-        mask = semantic_ids == class_id
-        if class_id < len(class_colors):
-            semantic_point_colors[mask] = class_colors[class_id]
-        else:
-            # Fallback color if we have more classes than predefined colors
-            semantic_point_colors[mask] = [128, 128, 128]  # Gray
+    semantic_point_colors = colorize_labels(semantic_ids, build_class_lut(class_mapping, class_colors))
     
     # Log the semantic colored point cloud
     rr.log(
@@ -228,6 +392,8 @@ def main():
     pcd_path = "results/visuals/osma-bench/conceptgraphs/replica_cad/baseline/apt_0/pointcloud.pcd"
     semantic_path = "results/visuals/osma-bench/conceptgraphs/replica_cad/baseline/apt_0/semantic.npy"
     annotations_path = "results/visuals/osma-bench/conceptgraphs/replica_cad/baseline/apt_0/annotations.json"
+    # Stream a cached voxel octree pyramid from coarse to full resolution, for multi-million-point maps
+    use_lod = False
 
     # Check if files exist
     for path, name in [(pcd_path, "Point cloud"), (semantic_path, "Semantic labels"), (annotations_path, "Annotations")]:
@@ -236,7 +402,10 @@ def main():
             return
     
     try:
-        visualize_semantic_pointcloud(pcd_path, semantic_path, annotations_path)
+        if use_lod:
+            visualize_semantic_pointcloud_lod(pcd_path, semantic_path, annotations_path)
+        else:
+            visualize_semantic_pointcloud(pcd_path, semantic_path, annotations_path)
     except Exception as e:
         print(f"Error during visualization: {e}")
 
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def stratified_sample(gt_class, fraction, min_per_class=100, seed=0):
+    '''
+    Sample `fraction` of the GT points of every class, but at least `min_per_class` of them
+    (all of them for smaller classes). Returns the sorted indices of the sampled points and,
+    for every GT class, its number of points and of sampled points.
+    '''
+    gt_class = np.asarray(gt_class)
+    rng = np.random.default_rng(seed)
+
+    # Random order within every class: a shuffle, then a stable sort by class
+    permutation = rng.permutation(len(gt_class))
+    order = permutation[np.argsort(gt_class[permutation], kind="stable")]
+
+    classes, class_starts, counts = np.unique(gt_class[order], return_index=True, return_counts=True)
+    sampled = np.minimum(counts, np.maximum(np.ceil(fraction * counts).astype(np.int64), min_per_class))
+
+    indices = np.concatenate([
+        order[start:start + size] for start, size in zip(class_starts, sampled)
+    ]) if len(classes) else np.zeros(0, dtype=np.int64)
+
+    return np.sort(indices), classes, counts, sampled
+
+
+def get_row_weights(labels, classes, counts, sampled):
+    '''Inverse sampling probability of the GT class of every confusion matrix row'''
+    weights = np.ones(len(labels), dtype=np.float64)
+
+    pos = np.searchsorted(classes, labels).clip(max=max(len(classes) - 1, 0))
+    found = (classes[pos] == labels) if len(classes) else np.zeros(len(labels), dtype=bool)
+
+    weights[found] = counts[pos[found]] / sampled[pos[found]]
+
+    return weights
+
+
+def bootstrap_conf_matrices(conf_matrix, num_bootstrap=200, seed=0):
+    '''
+    (num_bootstrap x C x C) confusion matrices of the sample resampled within every GT class:
+    every row is redrawn from a multinomial over its own predicted label frequencies.
+    '''
+    conf_matrix = np.asarray(conf_matrix, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+
+    resampled = np.zeros((num_bootstrap, *conf_matrix.shape), dtype=np.int64)
+
+    for row, row_counts in enumerate(conf_matrix):
+        row_size = row_counts.sum()
+
+        if row_size > 0:
+            resampled[:, row] = rng.multinomial(row_size, row_counts / row_size, size=num_bootstrap)
+
+    return resampled
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+class AssociationCache:
+    '''
+    On-disk cache of the geometry-only part of the evaluation of an object-based prediction:
+    the point -> object id mapping of the predicted cloud and the k nearest predicted points
+    of every GT point. Entries are keyed by the content hashes of the prediction and GT files,
+    so changing the CLIP model or the prompts only re-runs the object classification.
+    '''
+
+    VERSION = 1
+    POINT_OBJECT_NAME = "point_object.npy"
+    KNN_INDICES_NAME = "knn_indices.npy"
+    META_NAME = "meta.json"
+
+    def __init__(self, cache_dir, pred_hash, gt_hash, nn_count):
+        self.key = {
+            "version": self.VERSION,
+            "pred": pred_hash,
+            "gt": gt_hash,
+            "nn_count": int(nn_count),
+        }
+
+        digest = hashlib.sha1(json.dumps(self.key, sort_keys=True).encode("utf-8")).hexdigest()
+        self.entry_dir = os.path.join(str(cache_dir), digest)
+
+        self._pending_path = None
+
+    def _path(self, name):
+        return os.path.join(self.entry_dir, name)
+
+    def _load_meta(self):
+        try:
+            with open(self._path(self.META_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_meta(self, **kwargs):
+        meta = {**self._load_meta(), "key": self.key, **kwargs}
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.entry_dir, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(meta, f, indent=4)
+            os.replace(tmp_path, self._path(self.META_NAME))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load_point_object(self):
+        if not self._load_meta().get("point_object"):
+            return None
+
+        return np.load(self._path(self.POINT_OBJECT_NAME))
+
+    def save_point_object(self, point_object):
+        os.makedirs(self.entry_dir, exist_ok=True)
+
+        point_object = np.asarray(point_object, dtype=np.int32)
+        fd, tmp_path = tempfile.mkstemp(dir=self.entry_dir, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, point_object)
+            os.replace(tmp_path, self._path(self.POINT_OBJECT_NAME))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._update_meta(point_object={"num_points": len(point_object)})
+
+    def has_knn_indices(self):
+        return bool(self._load_meta().get("knn_indices"))
+
+    def get_knn_count(self, num_pred_points):
+        '''Neighbours per point, fewer than nn_count for predictions smaller than it'''
+        return min(self.key["nn_count"], num_pred_points)
+
+    def load_knn_indices(self, num_points, num_pred_points):
+        '''Memory-mapped (num_points x min(nn_count, num_pred_points)) neighbour indices, or None if not cached'''
+        meta = self._load_meta().get("knn_indices")
+
+        if not meta or meta["num_points"] != num_points:
+            return None
+
+        knn_indices = np.load(self._path(self.KNN_INDICES_NAME), mmap_mode="r")
+
+        if knn_indices.shape[1] != self.get_knn_count(num_pred_points):
+            return None
+
+        return knn_indices
+
+    def create_knn_indices(self, num_points, num_pred_points):
+        '''Writable memory map to be filled block by block and then committed'''
+        os.makedirs(self.entry_dir, exist_ok=True)
+
+        dtype = np.int32 if num_pred_points <= np.iinfo(np.int32).max else np.int64
+        fd, self._pending_path = tempfile.mkstemp(dir=self.entry_dir, suffix=".npy.tmp")
+        os.close(fd)
+
+        return np.lib.format.open_memmap(
+            self._pending_path,
+            mode = "w+",
+            dtype = dtype,
+            shape = (num_points, self.get_knn_count(num_pred_points))
+        )
+
+    def commit_knn_indices(self, knn_indices):
+        knn_indices.flush()
+        num_points = knn_indices.shape[0]
+
+        os.replace(self._pending_path, self._path(self.KNN_INDICES_NAME))
+        self._pending_path = None
+
+        self._update_meta(knn_indices={"num_points": num_points})
+
+    def discard_knn_indices(self):
+        if self._pending_path is not None and os.path.exists(self._pending_path):
+            os.remove(self._pending_path)
+
+        self._pending_path = None
@@ -0,0 +1,68 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=8)
+def get_ray_grid(width, height, fx, fy, cx, cy):
+    '''(H, W, 3) camera rays with unit depth of every pixel, computed once per intrinsics'''
+    u, v = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+
+    rays = np.stack([(u - cx) / fx, (v - cy) / fy, np.ones_like(u)], axis=-1)
+    rays.setflags(write=False)
+
+    return rays
+
+
+def get_class_ids(semantics):
+    '''Integer class ids of semantic images, taken from the first channel of RGB-encoded ones'''
+    semantics = np.asarray(semantics)
+
+    if semantics.ndim == 4:
+        semantics = semantics[..., 0]
+
+    return semantics.astype(np.int32)
+
+
+def backproject_frames(depths, poses, intrinsic, rgbs=None, semantics=None, return_pixels=False):
+    '''
+    Back-project a batch of same-sized frames into world coordinates in one pass.
+
+    depths: (B, H, W) raw depth images, pixels without depth (0) are skipped
+    poses: (B, 4, 4) camera-to-world transforms
+    rgbs: optional (B, H, W, 3) uint8 color images, returned as floats in [0, 1]
+    semantics: optional (B, H, W) or (B, H, W, C) class id images, returned as int32
+
+    Points are ordered frame by frame, row by row, as Open3D's create_from_rgbd_image does.
+    With `return_pixels` the batch frame index and flat pixel index of every point are returned too.
+    '''
+    depths = np.asarray(depths)
+    poses = np.asarray(poses, dtype=np.float64)
+
+    rays = get_ray_grid(intrinsic.width, intrinsic.height, intrinsic.fx, intrinsic.fy, intrinsic.cx, intrinsic.cy)
+
+    frame_idx, row_idx, col_idx = np.nonzero(depths > 0)
+    z = depths[frame_idx, row_idx, col_idx].astype(np.float64) / intrinsic.depth_scale
+
+    xyz_cam = rays[row_idx, col_idx] * z[:, None]
+
+    # Points are sorted by frame, so every frame is transformed with one matmul on its slice
+    frame_starts = np.searchsorted(frame_idx, np.arange(len(poses) + 1))
+
+    xyz = np.empty_like(xyz_cam)
+    for i, pose in enumerate(poses):
+        frame_slice = slice(frame_starts[i], frame_starts[i + 1])
+        xyz[frame_slice] = xyz_cam[frame_slice] @ pose[:3, :3].T + pose[:3, 3]
+
+    colors = None
+    if rgbs is not None:
+        colors = np.asarray(rgbs)[frame_idx, row_idx, col_idx, :3].astype(np.float64) / 255
+
+    labels = None
+    if semantics is not None:
+        labels = get_class_ids(semantics)[frame_idx, row_idx, col_idx]
+
+    if return_pixels:
+        return xyz, colors, labels, (frame_idx, row_idx * depths.shape[2] + col_idx)
+
+    return xyz, colors, labels
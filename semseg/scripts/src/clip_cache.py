@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def normalize_class_name(name):
+    return " ".join(name.replace('_', ' ').split())
+
+
+class TextEmbeddingCache:
+    '''
+    Content-addressed on-disk cache of CLIP text embeddings.
+
+    Every (model, pretrained, template, class name) embedding is stored as a separate
+    fp16 array named by the hash of its key, so scenes with different class subsets
+    share the entries of their common vocabulary. `index.json` describes the stored keys.
+    '''
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, cache_dir, model_name, pretrained):
+        self.cache_dir = str(cache_dir)
+        self.model_name = model_name
+        self.pretrained = pretrained
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, template, class_name):
+        return {
+            "model": self.model_name,
+            "pretrained": self.pretrained,
+            "template": template,
+            "name": normalize_class_name(class_name),
+        }
+
+    def get_digest(self, template, class_name):
+        key = json.dumps(self.get_key(template, class_name), sort_keys=True)
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _array_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.npy")
+
+    def load(self, template, class_name):
+        array_path = self._array_path(self.get_digest(template, class_name))
+
+        if not os.path.exists(array_path):
+            return None
+
+        try:
+            return np.load(array_path)
+        except (OSError, ValueError):
+            # A partially written or corrupted entry is recomputed
+            return None
+
+    def save(self, template, class_names, feats):
+        feats = np.asarray(feats, dtype=np.float16)
+        index_update = {}
+
+        for class_name, feat in zip(class_names, feats):
+            digest = self.get_digest(template, class_name)
+            self._atomic_write(self._array_path(digest), lambda f, feat=feat: np.save(f, feat))
+            index_update[digest] = {**self.get_key(template, class_name), "dim": int(feat.shape[-1])}
+
+        index = self.load_index()
+        index.update(index_update)
+        self._atomic_write(
+            os.path.join(self.cache_dir, self.INDEX_NAME),
+            lambda f: f.write(json.dumps(index, indent=4).encode("utf-8"))
+        )
+
+    def load_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_NAME)
+
+        if not os.path.exists(index_path):
+            return {}
+
+        try:
+            with open(index_path) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def _atomic_write(self, path, write_fn):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write_fn(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -5,39 +5,33 @@ import torch
 import numpy as np
 import open3d as o3d
 
-from pytorch3d.ops import knn_points
-from sklearn.metrics import confusion_matrix
-from sklearn.neighbors import BallTree
-
 from src.debug import debug_visualize_loaded_pointclouds
+from src.gt_bake import (
+    BAKED_GT_EXT, bake_gt_pointcloud, get_baked_gt_path, get_gt_source_paths, 
+    get_semantic_info_hash, is_baked_gt_fresh, load_baked_gt_pointcloud
+)
+from src.knn import build_knn_index
+from src.pred_store import is_pred_store, load_pred_store
+from src.tiles import TILED_PC_EXT, load_tiled_region, parse_bbox
+from src.voxel import VoxelLabelGrid
 
 
-def compute_knn_associations(src_xyz, dst_xyz, k=1):
-    knn_pred = knn_points(
-        src_xyz.unsqueeze(0).cuda().contiguous().float(),
-        dst_xyz.unsqueeze(0).cuda().contiguous().float(),
-        lengths1=None,
-        lengths2=None,
-        return_nn=True,
-        return_sorted=True,
-        K=k,
-    )
-    
-    dst_to_src_idx = knn_pred.idx.squeeze(0)
-    
-    return dst_to_src_idx
+# Bump whenever a change of the evaluation alters the confusion matrices, results recorded
+# in the evaluation manifests with another version are then computed again
+EVALUATOR_VERSION = 1
 
 
-# def compute_knn_associations(src_xyz, dst_xyz, k=1):
-#     src_np = src_xyz.cpu().numpy()
-#     dst_np = dst_xyz.cpu().numpy()
-    
-#     tree = BallTree(dst_np, metric="minkowski")
-#     dist, indices = tree.query(src_np, k=k)
+def compute_knn_associations(src_xyz, dst_xyz, k=1, backend='auto', chunk_size=262_144, num_workers=None):
+    knn_index = build_knn_index(
+        dst_xyz,
+        backend = backend,
+        chunk_size = chunk_size,
+        num_workers = num_workers
+    )
     
-#     dst_to_src_idx = torch.tensor(indices, device=src_xyz.device)
+    dst_to_src_idx = knn_index.query(src_xyz, k=k)
     
-#     return dst_to_src_idx
+    return dst_to_src_idx
 
 
 def load_slam_reconstructed_gt(args, scene_id):
@@ -50,9 +44,21 @@ def load_slam_reconstructed_gt(args, scene_id):
     return slam_xyz
 
 
-def load_gt_pointcloud(gt_pc_path, semantic_info):
+def load_gt_pointcloud(gt_pc_path, semantic_info, bake=False, bbox=None, bake_dir=None):
     gt_pc_ext = gt_pc_path.suffix
     
+    if bbox is not None and gt_pc_ext != TILED_PC_EXT:
+        raise ValueError(f"A GT bounding box needs a tiled {TILED_PC_EXT} GT point cloud: {gt_pc_path}")
+    
+    if gt_pc_ext == BAKED_GT_EXT:
+        return load_baked_gt_pointcloud(gt_pc_path)
+    
+    if gt_pc_ext == TILED_PC_EXT and (bbox is not None or not bake):
+        return load_gt_pointcloud_tiles(gt_pc_path, bbox)
+    
+    if bake:
+        return load_or_bake_gt_pointcloud(gt_pc_path, semantic_info, bake_dir)
+    
     if gt_pc_ext == '.ply':
         from src.pointcloud import load_gt_pointcloud_ply
         return load_gt_pointcloud_ply(gt_pc_path, semantic_info)
@@ -63,58 +69,282 @@ def load_gt_pointcloud(gt_pc_path, semantic_info):
         raise ValueError(f"Unknown GT pointcloud extension: {gt_pc_path}")
 
 
-def load_pred_pointcloud(approach_name, *args, **kwargs):
+def load_gt_pointcloud_tiles(gt_pc_path, bbox=None):
+    '''Load the GT points of a tiled point cloud, only of the tiles intersecting `bbox` if given'''
+    bbox_min, bbox_max = parse_bbox(bbox) if bbox is not None else (None, None)
+    
+    gt_region = load_tiled_region(gt_pc_path, bbox_min, bbox_max, columns=["xyz", "label"])
+    
+    return torch.from_numpy(gt_region["xyz"]), torch.from_numpy(gt_region["label"])
+
+
+def load_or_bake_gt_pointcloud(gt_pc_path, semantic_info, bake_dir=None):
+    '''
+    Load the baked copy of the GT point cloud, baking it first if it is missing or outdated.
+    If the copy can not be written, e.g. next to read-only GT, the source GT is used.
+    '''
+    baked_path = get_baked_gt_path(gt_pc_path, bake_dir)
+    source_paths = get_gt_source_paths(gt_pc_path)
+    semantic_hash = get_semantic_info_hash(gt_pc_path, semantic_info)
+    
+    if not is_baked_gt_fresh(baked_path, source_paths, semantic_hash):
+        gt_xyz, gt_class = load_gt_pointcloud(gt_pc_path, semantic_info)
+        
+        try:
+            bake_gt_pointcloud(
+                baked_path,
+                gt_xyz.numpy(),
+                gt_class.numpy(),
+                semantic_info,
+                source_paths = source_paths,
+                semantic_hash = semantic_hash
+            )
+        except OSError as e:
+            print(f"Warning: could not bake the GT to {baked_path}, evaluating the source GT: {e}")
+            return gt_xyz, gt_class
+        
+    return load_baked_gt_pointcloud(baked_path)
+
+
+def get_adaptor(approach_name, pred_pc_path=None):
+    # Prediction stores are read the same way whatever approach produced them
+    if pred_pc_path is not None and is_pred_store(pred_pc_path):
+        from adaptors import pred_store
+        return pred_store
+    
     if approach_name in ['cg', 'conceptgraphs']:
         from adaptors import conceptgraph as cg
-        return cg.load_pred_pointcloud(*args, **kwargs)
+        return cg
     elif approach_name in ['bbq', 'beyondbarequeries']:
         from adaptors import bbq
-        return bbq.load_pred_pointcloud(*args, **kwargs)
+        return bbq
     elif approach_name in ['bbq_experimental']:
         from adaptors import bbq_experimental
-        return bbq_experimental.load_pred_pointcloud(*args, **kwargs)
+        return bbq_experimental
     elif approach_name in ['hovsg', 'hov-sg']:
         from adaptors import hovsg
-        return hovsg.load_pred_pointcloud(*args, **kwargs)
+        return hovsg
     elif approach_name in ["openscene", "OpenScene"]:
         from adaptors import openscene
-        return openscene.load_pred_pointcloud(*args, **kwargs)
+        return openscene
     else:
         raise ValueError(f"Unknown approach name: {approach_name}")
 
 
+def load_pred_pointcloud(approach_name, pred_pc_path, *args, **kwargs):
+    return get_adaptor(approach_name, pred_pc_path).load_pred_pointcloud(pred_pc_path, *args, **kwargs)
+
+
+def has_pred_objects(approach_name, pred_pc_path=None):
+    '''Whether the approach predicts objects, whose class is broadcast to their points'''
+    if pred_pc_path is not None and is_pred_store(pred_pc_path):
+        return load_pred_store(pred_pc_path).has_objects
+    
+    return hasattr(get_adaptor(approach_name), 'load_pred_objects')
+
+
+def load_pred_objects(approach_name, pred_pc_path, *args, **kwargs):
+    return get_adaptor(approach_name, pred_pc_path).load_pred_objects(pred_pc_path, *args, **kwargs)
+
+
+def compute_confusion_matrix(gt_class, pred_class, labels):
+    '''
+    Integer confusion matrix over `labels`, as sklearn.metrics.confusion_matrix: points whose
+    GT or predicted class is not in `labels` are ignored.
+    '''
+    labels = torch.as_tensor(labels, dtype=torch.long)
+    num_labels = len(labels)
+    
+    sorted_labels, order = torch.sort(labels)
+    
+    def to_label_index(values):
+        values = values.long()
+        pos = torch.searchsorted(sorted_labels, values).clamp(max=num_labels - 1)
+        return order[pos], sorted_labels[pos] == values
+    
+    gt_index, gt_valid = to_label_index(gt_class)
+    pred_index, pred_valid = to_label_index(pred_class)
+    valid = gt_valid & pred_valid
+    
+    conf_matrix = torch.bincount(
+        gt_index[valid] * num_labels + pred_index[valid],
+        minlength = num_labels * num_labels
+    )
+    
+    return conf_matrix.reshape(num_labels, num_labels)
+
+
 def evaluate_scen(
     gt_pointcloud,
     pred_pointcloud, 
     class_feats,
-    nn_count = 5
+    nn_count = 5,
+    knn_backend = 'auto',
+    knn_chunk_size = 262_144,
+    knn_workers = None,
+    block_size = 1_000_000,
+    association = 'knn',
+    voxel_size = 0.05,
+    association_cache = None
 ):
+    '''
+    Streams GT points in blocks of `block_size`: every block is associated with the predicted
+    cloud, voted and accumulated into the confusion matrix, so peak memory does not grow with
+    the GT size. `block_size=None` processes all GT points at once.
+    
+    association='knn' votes over the `nn_count` nearest predicted points, or all of them if there
+    are fewer, association='voxel' takes the majority predicted label of the GT point voxel (or of
+    its closest occupied neighbour).
+    With an `association_cache` the k-NN indices are read from it, or written to it on a miss,
+    and `pred_xyz` is only used on a miss.
+    '''
     gt_xyz, gt_class = gt_pointcloud
     pred_xyz, pred_color, pred_class = pred_pointcloud
     
     # debug_visualize_loaded_pointclouds(pred_class, class_feats['names'], pred_xyz, gt_xyz, gt_class, class_feats['ids'])
-
-    pred_to_gt_idx = compute_knn_associations(gt_xyz, pred_xyz, k=nn_count).cpu()
     
-    class_feats['ids'] = list(class_feats['ids']) + [-1]
+    labels = list(class_feats['ids']) + [-1]
+    pred_class = pred_class.cpu()
     
-    abandoned_gt_points_idx = torch.isin(gt_class, torch.tensor(class_feats['ids']))
-    gt_class_mapped = gt_class[abandoned_gt_points_idx]
-    pred_class_mapped = torch.mode(pred_class[pred_to_gt_idx], dim=-1)[0]
-    pred_class_mapped = pred_class_mapped[abandoned_gt_points_idx]
+    knn_index = None
     
-    confmatrix = confusion_matrix(
-        y_true = gt_class_mapped.cpu().numpy(),
-        y_pred = pred_class_mapped.cpu().numpy(),
-        labels = class_feats['ids']
-    )
+    def knn_index_query(xyz, k=nn_count):
+        nonlocal knn_index
+        
+        # Built lazily, the voxel association only needs it for isolated GT points
+        if knn_index is None:
+            knn_index = build_knn_index(
+                pred_xyz,
+                backend = knn_backend,
+                chunk_size = knn_chunk_size,
+                num_workers = knn_workers
+            )
+        
+        return knn_index.query(torch.as_tensor(xyz), k=k).cpu()
+    
+    def predict_knn(xyz, k=nn_count):
+        pred_to_gt_idx = knn_index_query(xyz, k=k)
+        return torch.mode(pred_class[pred_to_gt_idx], dim=-1)[0]
+    
+    cached_knn_indices = None
+    pending_knn_indices = None
+    
+    if association == 'knn' and association_cache is not None:
+        cached_knn_indices = association_cache.load_knn_indices(len(gt_xyz), len(pred_class))
+        
+        if cached_knn_indices is None:
+            pending_knn_indices = association_cache.create_knn_indices(len(gt_xyz), len(pred_class))
+    
+    if association == 'knn':
+        predict = predict_knn
+    elif association == 'voxel':
+        voxel_grid = VoxelLabelGrid(
+            pred_xyz, 
+            pred_class, 
+            voxel_size = voxel_size,
+            bounds_xyz = [gt_xyz],
+            fallback_fn = lambda xyz: predict_knn(xyz, k=1)
+        )
+        predict = voxel_grid.predict
+    else:
+        raise ValueError(f"Unknown association: {association}")
+    
+    block_size = block_size or max(len(gt_xyz), 1)
+    confmatrix = torch.zeros((len(labels), len(labels)), dtype=torch.long)
+    
+    try:
+        for start in range(0, len(gt_xyz), block_size):
+            block = slice(start, start + block_size)
+            
+            if cached_knn_indices is not None:
+                pred_to_gt_idx = torch.from_numpy(cached_knn_indices[block].astype(np.int64))
+                pred_class_mapped = torch.mode(pred_class[pred_to_gt_idx], dim=-1)[0]
+            elif pending_knn_indices is not None:
+                pred_to_gt_idx = knn_index_query(gt_xyz[block])
+                pending_knn_indices[block] = pred_to_gt_idx.numpy()
+                pred_class_mapped = torch.mode(pred_class[pred_to_gt_idx], dim=-1)[0]
+            else:
+                pred_class_mapped = predict(gt_xyz[block])
+            
+            confmatrix += compute_confusion_matrix(
+                gt_class = gt_class[block],
+                pred_class = pred_class_mapped,
+                labels = labels
+            )
+    except BaseException:
+        if pending_knn_indices is not None:
+            association_cache.discard_knn_indices()
+        raise
+    
+    if pending_knn_indices is not None:
+        association_cache.commit_knn_indices(pending_knn_indices)
     
     # assert confmatrix.sum(0)[ignore_index].sum() == 0
     # assert confmatrix.sum(1)[ignore_index].sum() == 0
     
     return {
-        "conf_matrix": torch.tensor(confmatrix),
-        "labels": torch.tensor(class_feats['ids']),
+        "conf_matrix": confmatrix,
+        "labels": torch.tensor(labels),
+    }
+
+
+def evaluate_scen_sweep(
+    gt_pointcloud,
+    pred_xyz,
+    pred_classes,
+    nn_counts = (5,),
+    knn_backend = 'auto',
+    knn_chunk_size = 262_144,
+    knn_workers = None,
+    block_size = 1_000_000
+):
+    '''
+    Confusion matrices for every (class set, k) combination from a single k-NN pass.
+    `pred_classes` maps a class set name to the (pred_class, class_ids) pair obtained with it;
+    all of them must share `pred_xyz`. Neighbours are queried once with K = max(nn_counts),
+    the sorted first k of them give the k-NN vote for every smaller k.
+    '''
+    gt_xyz, gt_class = gt_pointcloud
+    max_nn_count = max(nn_counts)
+    
+    knn_index = build_knn_index(
+        pred_xyz,
+        backend = knn_backend,
+        chunk_size = knn_chunk_size,
+        num_workers = knn_workers
+    )
+    
+    labels = {name: list(class_ids) + [-1] for name, (_, class_ids) in pred_classes.items()}
+    
+    confmatrices = {
+        (name, k): torch.zeros((len(labels[name]), len(labels[name])), dtype=torch.long)
+        for name in pred_classes for k in nn_counts
+    }
+    
+    block_size = block_size or max(len(gt_xyz), 1)
+    
+    for start in range(0, len(gt_xyz), block_size):
+        pred_to_gt_idx = knn_index.query(gt_xyz[start:start + block_size], k=max_nn_count).cpu()
+        block_gt_class = gt_class[start:start + block_size]
+        
+        for name, (pred_class, _) in pred_classes.items():
+            neighbor_class = pred_class.cpu()[pred_to_gt_idx]
+            
+            for k in nn_counts:
+                pred_class_mapped = torch.mode(neighbor_class[:, :k], dim=-1)[0]
+                
+                confmatrices[(name, k)] += compute_confusion_matrix(
+                    gt_class = block_gt_class,
+                    pred_class = pred_class_mapped,
+                    labels = labels[name]
+                )
+    
+    return {
+        (name, k): {
+            "conf_matrix": confmatrix,
+            "labels": torch.tensor(labels[name]),
+        }
+        for (name, k), confmatrix in confmatrices.items()
     }
 
 
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import time
+
+
+EVAL_MANIFEST_NAME = "eval_manifest.json"
+
+
+class EvalManifest:
+    '''
+    JSON record, next to the outputs of a directory, of the inputs every result was produced
+    from (file hashes, model settings, options and code version). A result whose recorded
+    inputs are unchanged and whose output files exist does not need to be produced again.
+    '''
+
+    def __init__(self, output_dir, name=EVAL_MANIFEST_NAME):
+        self.path = os.path.join(str(output_dir), name)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get_changed_inputs(self, key, inputs, outputs):
+        '''
+        Names of the inputs that differ from the recorded ones, ["outputs"] if an output file
+        is missing and ["new"] if nothing is recorded for the key; an empty list means unchanged
+        '''
+        entry = self._load().get(key)
+
+        if entry is None:
+            return ["new"]
+
+        # Inputs go through a JSON round trip, so that tuples and paths compare as recorded
+        inputs = json.loads(json.dumps(inputs, default=str))
+        recorded = entry["inputs"]
+
+        changed = sorted(name for name in set(inputs) | set(recorded) if inputs.get(name) != recorded.get(name))
+
+        if not changed and not all(os.path.exists(output) for output in outputs):
+            return ["outputs"]
+
+        return changed
+
+    def record(self, key, inputs, outputs):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        # Re-read right before writing, other entries may have been recorded in the meantime
+        entries = self._load()
+        entries[key] = {
+            "inputs": inputs,
+            "outputs": [os.path.basename(output) for output in outputs],
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f, indent=4, default=str)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+# Voxel coordinates are packed into 16 bits per axis, the low 16 bits of vote keys hold the class
+VOXEL_AXIS_BITS = 16
+VOXEL_AXIS_OFFSET = 1 << (VOXEL_AXIS_BITS - 1)
+VOTE_CLASS_BITS = 16
+
+
+def pack_voxel_coords(coords):
+    '''Pack signed integer voxel coordinates into uint64 keys'''
+    shifted = coords.astype(np.int64) + VOXEL_AXIS_OFFSET
+
+    if shifted.size and (shifted.min() < 0 or shifted.max() >= 1 << VOXEL_AXIS_BITS):
+        raise ValueError(f"Voxel coordinates out of the +-{VOXEL_AXIS_OFFSET} voxels range, increase the voxel size")
+
+    shifted = shifted.astype(np.uint64)
+
+    return (shifted[:, 0] << np.uint64(2 * VOXEL_AXIS_BITS)) | (shifted[:, 1] << np.uint64(VOXEL_AXIS_BITS)) | shifted[:, 2]
+
+
+def _reduce_by_key(keys, values=None, weights=None):
+    '''Unique keys with the sums of the `values` rows and of `weights` over every key'''
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    counts = np.bincount(inverse, weights=weights, minlength=len(unique_keys))
+
+    if values is None:
+        return unique_keys, counts
+
+    # Column-wise bincount is much faster than np.add.at
+    sums = np.stack([
+        np.bincount(inverse, weights=values[:, i], minlength=len(unique_keys)) for i in range(values.shape[1])
+    ], axis=1)
+
+    return unique_keys, sums, counts
+
+
+class VoxelFusionMap:
+    '''
+    Sparse voxel hash map fusing back-projected frames on the fly. Every occupied voxel keeps
+    the running sums of its point positions and colors and the vote count of every class, so
+    memory is bounded by the number of occupied voxels plus `merge_size` pending points.
+    '''
+
+    def __init__(self, voxel_size, merge_size=4_000_000):
+        self.voxel_size = voxel_size
+        self.merge_size = merge_size
+
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._sums = np.zeros((0, 6), dtype=np.float64)  # xyz and rgb
+        self._counts = np.zeros(0, dtype=np.float64)
+
+        self._vote_keys = np.zeros(0, dtype=np.uint64)
+        self._vote_counts = np.zeros(0, dtype=np.float64)
+
+        self._pending = []
+        self._pending_size = 0
+
+    def integrate(self, xyz, colors, labels=None):
+        xyz = np.asarray(xyz)
+        keys = pack_voxel_coords(np.floor(xyz / self.voxel_size))
+
+        values = np.concatenate([xyz, np.asarray(colors)], axis=1)
+
+        if labels is not None:
+            labels = np.asarray(labels).astype(np.int64)
+
+            if labels.size and (labels.min() < 0 or labels.max() >= 1 << VOTE_CLASS_BITS):
+                raise ValueError(f"Class ids must be in [0, {1 << VOTE_CLASS_BITS})")
+
+            labels = labels.astype(np.uint64)
+
+        self._pending.append((keys, values, labels))
+        self._pending_size += len(keys)
+
+        if self._pending_size >= self.merge_size:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+
+        keys, values, labels = zip(*self._pending)
+        self._pending = []
+        self._pending_size = 0
+
+        # Existing voxels enter the reduction with their counts as weights
+        self._keys, self._sums, self._counts = _reduce_by_key(
+            np.concatenate([self._keys, *keys]),
+            values = np.concatenate([self._sums, *values]),
+            weights = np.concatenate([self._counts, np.ones(sum(map(len, keys)))])
+        )
+
+        vote_keys = [
+            (voxel_keys << np.uint64(VOTE_CLASS_BITS)) | voxel_labels
+            for voxel_keys, voxel_labels in zip(keys, labels) if voxel_labels is not None
+        ]
+
+        if vote_keys:
+            self._vote_keys, self._vote_counts = _reduce_by_key(
+                np.concatenate([self._vote_keys, *vote_keys]),
+                weights = np.concatenate([self._vote_counts, np.ones(sum(map(len, vote_keys)))])
+            )
+
+    def __len__(self):
+        self._merge()
+        return len(self._keys)
+
+    def get_pointcloud(self):
+        '''Mean position and color of every occupied voxel and, if labels were given, the majority class'''
+        self._merge()
+
+        means = self._sums / self._counts[:, None]
+        xyz, colors = means[:, :3], means[:, 3:]
+
+        if len(self._vote_keys) == 0:
+            return xyz, colors, None
+
+        vote_voxels = self._vote_keys >> np.uint64(VOTE_CLASS_BITS)
+        vote_classes = (self._vote_keys & np.uint64((1 << VOTE_CLASS_BITS) - 1)).astype(np.int64)
+
+        # Most voted class per voxel, the smallest class id on ties
+        order = np.lexsort((vote_classes, -self._vote_counts, vote_voxels))
+        first = order[np.r_[True, vote_voxels[order][1:] != vote_voxels[order][:-1]]]
+
+        labels = np.full(len(self._keys), -1, dtype=np.int64)
+        labels[np.searchsorted(self._keys, vote_voxels[first])] = vote_classes[first]
+
+        return xyz, colors, labels
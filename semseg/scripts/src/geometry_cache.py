@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from src.hashing import hash_file, hash_paths
+
+
+class GeometryCache:
+    '''
+    On-disk cache of the lighting-invariant part of the reconstruction of a scene: the
+    back-projected points, the frame and pixel every point comes from and its class id.
+    Entries are keyed by the content hashes of the trajectory, camera parameters, depth
+    (and semantic) images, so the lighting variants of a scene, which only differ in RGB,
+    share one entry and only gather their colors from the cached pixels.
+    '''
+
+    VERSION = 1
+    COLUMNS = ["xyz", "frame", "pixel", "labels"]
+    META_NAME = "meta.json"
+
+    def __init__(self, cache_dir, traj_path, camera_params_path, depth_paths, semantic_paths=None, **options):
+        self.key = {
+            "version": self.VERSION,
+            "traj": hash_file(traj_path),
+            "camera_params": hash_file(camera_params_path),
+            "depth": hash_paths(depth_paths),
+            "semantic": hash_paths(semantic_paths) if semantic_paths else None,
+            "num_frames": len(depth_paths),
+            **options,
+        }
+
+        digest = hashlib.sha1(json.dumps(self.key, sort_keys=True).encode("utf-8")).hexdigest()
+        self.entry_dir = os.path.join(str(cache_dir), digest)
+
+    def _path(self, name):
+        return os.path.join(self.entry_dir, f"{name}.npy" if name in self.COLUMNS else name)
+
+    def _load_meta(self):
+        try:
+            with open(self._path(self.META_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self):
+        '''(xyz, frame, pixel, labels) memory maps, labels None if not cached, or None on a miss'''
+        meta = self._load_meta()
+
+        if meta is None or meta["key"] != self.key:
+            return None
+
+        return tuple(
+            np.load(self._path(name), mmap_mode="r") if name in meta["columns"] else None
+            for name in self.COLUMNS
+        )
+
+    def save(self, xyz, frame, pixel, labels=None, source=None):
+        os.makedirs(self.entry_dir, exist_ok=True)
+
+        columns = {
+            "xyz": np.asarray(xyz, dtype=np.float64),
+            "frame": np.asarray(frame, dtype=np.int32),
+            "pixel": np.asarray(pixel, dtype=np.int32),
+        }
+        if labels is not None:
+            columns["labels"] = np.asarray(labels, dtype=np.int32)
+
+        for name, column in columns.items():
+            fd, tmp_path = tempfile.mkstemp(dir=self.entry_dir, suffix=".npy.tmp")
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, column)
+                os.replace(tmp_path, self._path(name))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        # The meta is written last, an interrupted save leaves a miss
+        meta = {"key": self.key, "columns": list(columns), "num_points": len(columns["xyz"]), "source": source}
+        fd, tmp_path = tempfile.mkstemp(dir=self.entry_dir, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(meta, f, indent=4)
+            os.replace(tmp_path, self._path(self.META_NAME))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def gather_frame_colors(frame, pixel, rgbs):
+    '''
+    Colors in [0, 1] of points sorted by frame, gathered from their flat pixel indices.
+    rgbs: iterable of the (H, W, 3+) uint8 images of frames 0, 1, ...
+    '''
+    colors = np.empty((len(frame), 3), dtype=np.float64)
+    frame_starts = np.searchsorted(frame, np.arange(np.max(frame, initial=-1) + 2))
+
+    for i, rgb in enumerate(rgbs):
+        if i + 1 >= len(frame_starts):
+            break
+
+        frame_slice = slice(frame_starts[i], frame_starts[i + 1])
+        rgb = np.asarray(rgb)
+
+        colors[frame_slice] = rgb.reshape(-1, rgb.shape[-1])[pixel[frame_slice], :3] / 255
+
+    return colors
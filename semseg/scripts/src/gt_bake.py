@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+import torch
+import numpy as np
+
+
+BAKED_GT_EXT = ".osmgt"
+BAKED_GT_MAGIC = b"OSMAGT01"
+BAKED_GT_ALIGNMENT = 64
+
+
+def get_baked_gt_path(gt_pc_path, bake_dir=None):
+    '''Next to the GT point cloud, or in `bake_dir` under a name unique to its path'''
+    if bake_dir is None:
+        return gt_pc_path.with_suffix(BAKED_GT_EXT)
+
+    path_hash = hashlib.sha1(os.path.abspath(gt_pc_path).encode("utf-8")).hexdigest()[:16]
+
+    return Path(bake_dir) / f"{gt_pc_path.stem}_{path_hash}{BAKED_GT_EXT}"
+
+
+def get_gt_source_paths(gt_pc_path):
+    if gt_pc_path.suffix == '.pcd':
+        return [gt_pc_path, gt_pc_path.with_name("semantic.npy")]
+
+    return [gt_pc_path]
+
+
+def get_semantic_info_hash(gt_pc_path, semantic_info):
+    '''Hash of the parts of the semantic info the GT labels depend on'''
+    if gt_pc_path.suffix != '.ply':
+        return None
+
+    objects = sorted((obj["id"], obj["class_id"]) for obj in semantic_info["objects"])
+
+    return hashlib.sha1(json.dumps(objects).encode("utf-8")).hexdigest()
+
+
+def get_source_stats(source_paths):
+    stats = []
+
+    for path in source_paths:
+        stat = os.stat(path)
+        stats.append({"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+    return stats
+
+
+def _align(offset):
+    return (offset + BAKED_GT_ALIGNMENT - 1) // BAKED_GT_ALIGNMENT * BAKED_GT_ALIGNMENT
+
+
+def bake_gt_pointcloud(baked_path, gt_xyz, gt_class, semantic_info, source_paths=(), semantic_hash=None):
+    '''
+    Write the GT point cloud into a single memory-mappable file: a JSON header followed by
+    float32 xyz and int16/int32 class ids, aligned to 64 bytes.
+    '''
+    xyz = np.ascontiguousarray(np.asarray(gt_xyz), dtype=np.float32)
+    labels = np.asarray(gt_class)
+
+    classes = {int(obj["id"]): obj["name"] for obj in semantic_info["classes"]}
+    class_ids = list(classes.keys()) + ([int(labels.min()), int(labels.max())] if labels.size else [])
+
+    int16 = np.iinfo(np.int16)
+    labels_dtype = np.int16 if int16.min <= min(class_ids, default=0) and max(class_ids, default=0) <= int16.max else np.int32
+    labels = np.ascontiguousarray(labels, dtype=labels_dtype)
+
+    content_hash = hashlib.sha1()
+    content_hash.update(xyz.tobytes())
+    content_hash.update(labels.tobytes())
+
+    header = {
+        "version": 1,
+        "num_points": int(xyz.shape[0]),
+        "xyz": {"dtype": "float32", "shape": list(xyz.shape)},
+        "class": {"dtype": np.dtype(labels_dtype).name, "shape": list(labels.shape)},
+        "classes": classes,
+        "content_hash": content_hash.hexdigest(),
+        "semantic_hash": semantic_hash,
+        "sources": get_source_stats(source_paths),
+    }
+
+    # Array offsets depend on the header size, so the header is sized with placeholders first
+    header_prefix = len(BAKED_GT_MAGIC) + 8
+    header["xyz"]["offset"] = header["class"]["offset"] = 0
+    header_size = len(json.dumps(header).encode("utf-8")) + 64
+
+    header["xyz"]["offset"] = _align(header_prefix + header_size)
+    header["class"]["offset"] = _align(header["xyz"]["offset"] + xyz.nbytes)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    assert len(header_bytes) <= header_size
+    header_bytes = header_bytes.ljust(header_size)
+
+    baked_dir = os.path.dirname(os.path.abspath(baked_path))
+    os.makedirs(baked_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=baked_dir, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(BAKED_GT_MAGIC)
+            f.write(struct.pack("<Q", header_size))
+            f.write(header_bytes)
+
+            f.seek(header["xyz"]["offset"])
+            f.write(xyz.tobytes())
+
+            f.seek(header["class"]["offset"])
+            f.write(labels.tobytes())
+
+        os.replace(tmp_path, baked_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    print(f'Saved baked GT to "{baked_path}"')
+
+    return header
+
+
+def read_baked_gt_header(baked_path):
+    with open(baked_path, "rb") as f:
+        magic = f.read(len(BAKED_GT_MAGIC))
+
+        if magic != BAKED_GT_MAGIC:
+            raise ValueError(f"Not a baked GT file: {baked_path}")
+
+        header_size, = struct.unpack("<Q", f.read(8))
+
+        return json.loads(f.read(header_size).decode("utf-8"))
+
+
+def is_baked_gt_fresh(baked_path, source_paths, semantic_hash=None):
+    if not os.path.exists(baked_path):
+        return False
+
+    try:
+        header = read_baked_gt_header(baked_path)
+    except ValueError:
+        return False
+
+    return header["sources"] == get_source_stats(source_paths) and header["semantic_hash"] == semantic_hash
+
+
+def load_baked_gt_pointcloud(baked_path):
+    '''Open a baked GT file without copying: the arrays are copy-on-write memory maps'''
+    header = read_baked_gt_header(baked_path)
+
+    arrays = []
+    for name in ["xyz", "class"]:
+        array = np.memmap(
+            baked_path,
+            dtype = np.dtype(header[name]["dtype"]),
+            mode = "c",
+            offset = header[name]["offset"],
+            shape = tuple(header[name]["shape"]),
+        )
+        arrays.append(torch.from_numpy(array))
+
+    gt_xyz, gt_class = arrays
+
+    return gt_xyz, gt_class
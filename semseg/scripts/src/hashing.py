@@ -0,0 +1,64 @@
+import hashlib
+import os
+from functools import lru_cache
+
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+@lru_cache(maxsize=256)
+def _hash_file(path, size, mtime_ns):
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    '''Content hash of a file, memoized per process while its size and mtime are unchanged'''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    return _hash_file(path, stat.st_size, stat.st_mtime_ns)
+
+
+def hash_path(path):
+    '''Content hash of a file, or of every file of a directory together with its relative path'''
+    if not os.path.isdir(path):
+        return hash_file(path)
+
+    digest = hashlib.sha1()
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+
+        for filename in sorted(files):
+            file_path = os.path.join(root, filename)
+
+            digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+            digest.update(hash_file(file_path).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def hash_paths(paths):
+    digest = hashlib.sha1()
+
+    for path in paths:
+        digest.update(hash_path(path).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def hash_stats(paths):
+    '''Cheap key of many files from their paths, sizes and mtimes, e.g. the frames of a sequence'''
+    digest = hashlib.sha1()
+
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+
+    return digest.hexdigest()
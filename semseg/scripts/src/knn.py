@@ -0,0 +1,102 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import numpy as np
+
+
+KNN_BACKENDS = ['cuda', 'kdtree', 'auto']
+
+
+def resolve_knn_backend(backend='auto'):
+    if backend not in KNN_BACKENDS:
+        raise ValueError(f"Unknown k-NN backend: {backend}")
+
+    if backend != 'auto':
+        return backend
+
+    if torch.cuda.is_available():
+        try:
+            import pytorch3d.ops  # noqa: F401
+            return 'cuda'
+        except ImportError:
+            pass
+
+    return 'kdtree'
+
+
+class CudaKnnIndex:
+    '''
+    Brute-force k-NN on GPU with pytorch3d. Like the KD-tree index, it returns min(k, n)
+    neighbours per query for a destination cloud of n points
+    '''
+
+    def __init__(self, dst_xyz, device='cuda'):
+        self._dst_xyz = dst_xyz.unsqueeze(0).to(device).contiguous().float()
+
+    def query(self, src_xyz, k=1):
+        from pytorch3d.ops import knn_points
+
+        knn_pred = knn_points(
+            src_xyz.unsqueeze(0).to(self._dst_xyz.device).contiguous().float(),
+            self._dst_xyz,
+            lengths1=None,
+            lengths2=None,
+            return_nn=False,
+            return_sorted=True,
+            K=min(k, self._dst_xyz.shape[1]),
+        )
+
+        return knn_pred.idx.squeeze(0)
+
+
+class KDTreeKnnIndex:
+    '''
+    CPU k-NN over a KD-tree built once on the destination cloud. Queries are split into
+    fixed-size chunks processed by a thread pool, so only `num_workers` chunks are in flight.
+    '''
+
+    def __init__(self, dst_xyz, chunk_size=262_144, num_workers=None):
+        from scipy.spatial import cKDTree
+
+        # float32 coordinates, as in the CUDA path
+        dst_np = np.ascontiguousarray(_to_numpy(dst_xyz), dtype=np.float32)
+
+        self._tree = cKDTree(dst_np)
+        self._chunk_size = chunk_size
+        self._num_workers = num_workers or os.cpu_count() or 1
+
+    def query(self, src_xyz, k=1):
+        # cKDTree pads the neighbours beyond its size with index n, only the existing ones are queried
+        k = min(k, self._tree.n)
+
+        src_np = np.ascontiguousarray(_to_numpy(src_xyz), dtype=np.float32)
+        dst_to_src_idx = np.empty((src_np.shape[0], k), dtype=np.int64)
+
+        def query_chunk(start):
+            _, indices = self._tree.query(src_np[start:start + self._chunk_size], k=k)
+            dst_to_src_idx[start:start + self._chunk_size] = indices.reshape(-1, k)
+
+        starts = range(0, src_np.shape[0], self._chunk_size)
+
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            # cKDTree releases the GIL while querying
+            list(executor.map(query_chunk, starts))
+
+        return torch.from_numpy(dst_to_src_idx)
+
+
+def build_knn_index(dst_xyz, backend='auto', chunk_size=262_144, num_workers=None):
+    backend = resolve_knn_backend(backend)
+
+    if backend == 'cuda':
+        return CudaKnnIndex(dst_xyz)
+
+    return KDTreeKnnIndex(dst_xyz, chunk_size=chunk_size, num_workers=num_workers)
+
+
+def _to_numpy(xyz):
+    if isinstance(xyz, torch.Tensor):
+        return xyz.detach().cpu().numpy()
+
+    return np.asarray(xyz)
@@ -0,0 +1,164 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+LOD_FORMAT = "osma-lod"
+LOD_META_NAME = "meta.json"
+
+# Octree cell coordinates are packed into 21 bits per axis
+LOD_AXIS_BITS = 21
+
+
+def get_lod_voxel_sizes(coarse_voxel_size, num_levels):
+    '''Voxel sizes of the octree levels, halved from one level to the next'''
+    return [coarse_voxel_size / 2 ** level for level in range(num_levels)]
+
+
+def get_lod_levels(xyz, voxel_sizes, seed=0):
+    '''
+    Order of the points and the number of points of every level of a voxel octree pyramid.
+
+    Level i keeps one random point per occupied voxel of voxel_sizes[i], the extra last level
+    holds all the remaining points. Representatives are the first points of a random
+    permutation, so every level is a subset of the next one and the pyramid is stored once:
+    level i is the prefix of the ordered points up to the end of level i.
+    '''
+    xyz = np.asarray(xyz)
+    num_levels = len(voxel_sizes)
+
+    perm = np.random.default_rng(seed).permutation(len(xyz))
+
+    if len(xyz) == 0:
+        return perm, np.zeros(num_levels + 1, dtype=np.int64)
+
+    # Cells of the finest level, coarser cells are its coordinates shifted right
+    finest_coords = np.floor((xyz[perm] - xyz.min(axis=0)) / voxel_sizes[-1]).astype(np.int64)
+
+    if finest_coords.max() >= 1 << LOD_AXIS_BITS:
+        raise ValueError(f"Point cloud spans more than {1 << LOD_AXIS_BITS} finest voxels, increase the voxel size")
+
+    point_level = np.full(len(xyz), num_levels, dtype=np.int64)
+
+    for level in reversed(range(num_levels)):
+        coords = finest_coords >> (num_levels - 1 - level)
+        keys = (coords[:, 0] << (2 * LOD_AXIS_BITS)) | (coords[:, 1] << LOD_AXIS_BITS) | coords[:, 2]
+
+        _, first = np.unique(keys, return_index=True)
+        point_level[first] = level
+
+    level_order = np.argsort(point_level, kind="stable")
+    level_counts = np.bincount(point_level, minlength=num_levels + 1)
+
+    return perm[level_order], level_counts
+
+
+def build_lod_pyramid(cache_dir, xyz, colors=None, labels=None, coarse_voxel_size=0.32, num_levels=5, meta=None):
+    '''
+    Write the points, uint8 colors and labels ordered level by level into memory-mappable
+    .npy columns, with the level sizes and class counts in meta.json.
+    '''
+    cache_dir = str(cache_dir)
+    voxel_sizes = get_lod_voxel_sizes(coarse_voxel_size, num_levels)
+
+    order, level_counts = get_lod_levels(xyz, voxel_sizes)
+
+    columns = {"xyz": np.asarray(xyz, dtype=np.float32)}
+    if colors is not None:
+        columns["rgb"] = np.asarray(colors, dtype=np.uint8)
+    if labels is not None:
+        columns["label"] = np.asarray(labels, dtype=np.int32)
+
+    class_counts = {}
+    if labels is not None:
+        class_ids, counts = np.unique(columns["label"], return_counts=True)
+        class_counts = {str(class_id): int(count) for class_id, count in zip(class_ids, counts)}
+
+    parent_dir = os.path.dirname(os.path.abspath(cache_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, suffix=".tmp")
+
+    try:
+        for name, values in columns.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), values[order])
+
+        lod_meta = {
+            "format": LOD_FORMAT,
+            "version": 1,
+            "num_points": len(order),
+            "voxel_sizes": voxel_sizes,
+            "level_ends": np.cumsum(level_counts).tolist(),
+            "columns": list(columns),
+            "class_counts": class_counts,
+            **(meta or {}),
+        }
+
+        with open(os.path.join(tmp_dir, LOD_META_NAME), "w") as f:
+            json.dump(lod_meta, f, indent=4)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(tmp_dir, cache_dir)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+    print(f'Saved LOD pyramid with {num_levels} levels to "{cache_dir}"')
+
+
+def is_lod_pyramid(cache_dir):
+    meta_path = os.path.join(str(cache_dir), LOD_META_NAME)
+
+    if not os.path.isfile(meta_path):
+        return False
+
+    try:
+        with open(meta_path) as f:
+            return json.load(f).get("format") == LOD_FORMAT
+    except ValueError:
+        return False
+
+
+class LODPyramid:
+    '''Reader of a cached LOD pyramid, the columns are memory-mapped so coarse levels read only their prefix'''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = str(cache_dir)
+
+        with open(os.path.join(self.cache_dir, LOD_META_NAME)) as f:
+            self.meta = json.load(f)
+
+        if self.meta.get("format") != LOD_FORMAT:
+            raise ValueError(f"Not a LOD pyramid: {self.cache_dir}")
+
+        self._columns = {
+            name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode="r")
+            for name in self.meta["columns"]
+        }
+
+    @property
+    def num_levels(self):
+        '''Number of levels, the last one being the full point cloud'''
+        return len(self.meta["level_ends"])
+
+    @property
+    def class_counts(self):
+        return {int(class_id): count for class_id, count in self.meta["class_counts"].items()}
+
+    def get_voxel_size(self, level):
+        '''Voxel size of a level, None for the full point cloud'''
+        voxel_sizes = self.meta["voxel_sizes"]
+        return voxel_sizes[level] if level < len(voxel_sizes) else None
+
+    def load_level(self, level):
+        '''{column: values} of all the points of a level'''
+        end = self.meta["level_ends"][level]
+        return {name: np.asarray(values[:end]) for name, values in self._columns.items()}
+
+    def iter_levels(self):
+        '''(level, voxel size, columns) from the coarsest level to the full point cloud'''
+        for level in range(self.num_levels):
+            yield level, self.get_voxel_size(level), self.load_level(level)
@@ -0,0 +1,52 @@
+import torch
+import numpy as np
+
+
+def classify_objects(object_feats, class_feats, device='cuda'):
+    '''Assign to every object the class of its most similar text embedding'''
+    object_feats = torch.as_tensor(object_feats).to(device)
+
+    object_class_sim = torch.nn.functional.cosine_similarity(
+        object_feats.unsqueeze(1), class_feats['feats'].unsqueeze(0), dim=-1
+    )
+
+    class_ids = torch.tensor(class_feats['ids'])
+
+    return class_ids[object_class_sim.argmax(dim=-1).detach().cpu()] # (num_objects,)
+
+
+def get_point_object(num_object_points):
+    '''Object index of every point of the concatenated object point clouds'''
+    num_object_points = torch.as_tensor(num_object_points)
+
+    return torch.repeat_interleave(torch.arange(len(num_object_points)), num_object_points)
+
+
+def broadcast_object_class(object_class, point_object):
+    return object_class[torch.as_tensor(point_object).long()].long()
+
+
+def classify_point_features(feats, class_feats, device='cuda', batch_size=65_536):
+    '''
+    Class of every row of a (possibly memory-mapped) feature array, scored chunk by chunk so that
+    only the chunk being scored and the labels are held in memory. float16 features are supported.
+    '''
+    # Half precision matmuls are only fast on GPU
+    compute_dtype = torch.float16 if feats.dtype == np.float16 and torch.device(device).type == 'cuda' else torch.float
+
+    # The argmax of the cosine similarity over classes does not depend on the norm of the point
+    # feature, so only the class matrix is normalized and every chunk is scored with one matmul
+    class_matrix = torch.nn.functional.normalize(class_feats['feats'].to(device).float(), dim=-1)
+    class_matrix = class_matrix.to(compute_dtype).T.contiguous()
+
+    class_ids = torch.tensor(class_feats['ids'])
+    pred_class = torch.empty(feats.shape[0], dtype=torch.long)
+
+    for i in range(0, feats.shape[0], batch_size):
+        batch_feats = torch.from_numpy(np.array(feats[i:i+batch_size]))
+        batch_feats = batch_feats.to(device).to(compute_dtype)
+
+        class_sim = batch_feats @ class_matrix
+        pred_class[i:i+batch_size] = class_ids[class_sim.argmax(dim=-1).cpu()] # (batch_size,)
+
+    return pred_class
@@ -0,0 +1,411 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+import traceback
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+
+# Keys of the dataset matrix a stage can be expanded over, in the order of the job ids
+SCOPE_KEYS = ["label", "scene"]
+
+DONE_STATUSES = ["done", "cached"]
+
+
+def load_pipeline(pipeline_path):
+    import yaml
+
+    with open(pipeline_path) as f:
+        return yaml.safe_load(f)
+
+
+def resolve_vars(variables, context):
+    '''Format the vars with each other and the context until no placeholder of a var is left'''
+    resolved = {**context, **variables}
+
+    for _ in range(len(resolved) + 1):
+        updated = {name: value.format_map(resolved) if isinstance(value, str) else value for name, value in resolved.items()}
+
+        if updated == resolved:
+            return resolved
+
+        resolved = updated
+
+    raise ValueError(f"Cyclic pipeline vars: {sorted(variables)}")
+
+
+@dataclass
+class Job:
+    id: str
+    stage: str
+    keys: dict
+    commands: list
+    env: dict = field(default_factory=dict)
+    cwd: str = None
+    needs: list = field(default_factory=list)
+
+    @property
+    def signature(self):
+        '''Hash of what the job runs, a finished job is run again when it changes'''
+        spec = {"commands": self.commands, "env": self.env, "cwd": self.cwd}
+        return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_stages(pipeline, approach):
+    '''Stage specs of an approach, the common stages included, in dependency order'''
+    if approach not in pipeline["approaches"]:
+        raise ValueError(f"Unknown approach {approach}, expected one of {sorted(pipeline['approaches'])}")
+
+    stages = {**pipeline.get("stages", {}), **pipeline["approaches"][approach]["stages"]}
+
+    ordered = []
+    visiting = set()
+
+    def visit(name):
+        if name in ordered:
+            return
+        if name not in stages:
+            raise ValueError(f"Unknown stage {name} of approach {approach}")
+        if name in visiting:
+            raise ValueError(f"Cyclic dependency through stage {name}")
+
+        visiting.add(name)
+        for need in stages[name].get("needs", []):
+            visit(need)
+        visiting.discard(name)
+
+        ordered.append(name)
+
+    for name in stages:
+        visit(name)
+
+    return {name: stages[name] for name in ordered}
+
+
+def get_job_id(dataset, approach, stage_name, stage, keys):
+    prefix = [dataset] if stage.get("shared") else [dataset, approach]
+    return "/".join(prefix + [stage_name] + [keys[key] for key in SCOPE_KEYS if key in keys])
+
+
+def expand_jobs(pipeline, approach, dataset, state_dir, scenes=None, labels=None, stages=None, var_overrides=None):
+    '''
+    Jobs of the scene x label matrix of a dataset, in dependency order. A job depends on the jobs
+    of its needed stages that agree on their common scope keys, e.g. metrics of a label on the
+    evaluations of all the scenes of the label. Dependencies on stages that are not selected are
+    assumed to be satisfied.
+    '''
+    if dataset not in pipeline["datasets"]:
+        raise ValueError(f"Unknown dataset {dataset}, expected one of {sorted(pipeline['datasets'])}")
+
+    dataset_spec = pipeline["datasets"][dataset]
+    approach_spec = pipeline["approaches"].get(approach, {})
+    approach_dataset_spec = approach_spec.get("datasets", {}).get(dataset, {})
+
+    matrix = {"scene": dataset_spec["scenes"], "label": dataset_spec["labels"]}
+
+    for key, selected in [("scene", scenes), ("label", labels)]:
+        if selected is not None:
+            unknown = sorted(set(selected) - set(matrix[key]))
+            if unknown:
+                raise ValueError(f"Unknown {key}s of dataset {dataset}: {unknown}")
+
+            matrix[key] = [value for value in matrix[key] if value in selected]
+
+    all_stages = get_stages(pipeline, approach)
+
+    if stages is not None:
+        unknown = sorted(set(stages) - set(all_stages))
+        if unknown:
+            raise ValueError(f"Unknown stages of approach {approach}: {unknown}")
+
+    variables = {
+        **dataset_spec.get("vars", {}),
+        **approach_spec.get("vars", {}),
+        **approach_dataset_spec.get("vars", {}),
+        **(var_overrides or {}),
+    }
+    env = {**approach_spec.get("env", {}), **approach_dataset_spec.get("env", {})}
+
+    jobs = []
+    stage_jobs = defaultdict(list)
+
+    for stage_name, stage in all_stages.items():
+        if stages is not None and stage_name not in stages:
+            continue
+
+        scope = stage.get("scope", SCOPE_KEYS)
+        combinations = [{}]
+
+        for key in SCOPE_KEYS:
+            if key in scope:
+                combinations = [{**keys, key: value} for keys in combinations for value in matrix[key]]
+
+        for keys in combinations:
+            job_id = get_job_id(dataset, approach, stage_name, stage, keys)
+            job_dir = os.path.join(str(state_dir), "work", job_id)
+
+            context = {"dataset": dataset, "approach": approach, "stage": stage_name, "job_dir": job_dir, **keys}
+            job_vars = resolve_vars(variables, context)
+
+            needs = [
+                need_job.id
+                for need in stage.get("needs", []) for need_job in stage_jobs[need]
+                if all(need_job.keys[key] == value for key, value in keys.items() if key in need_job.keys)
+            ]
+
+            job = Job(
+                id = job_id,
+                stage = stage_name,
+                keys = keys,
+                commands = [command.format_map(job_vars) for command in stage["commands"]],
+                env = {name: str(value).format_map(job_vars) for name, value in {**env, **stage.get("env", {})}.items()},
+                cwd = stage["cwd"].format_map(job_vars) if stage.get("cwd") else None,
+                needs = needs
+            )
+
+            jobs.append(job)
+            stage_jobs[stage_name].append(job)
+
+    return jobs
+
+
+def get_state_path(state_dir, job_id):
+    return os.path.join(str(state_dir), "jobs", f"{job_id}.json")
+
+
+def get_log_path(state_dir, job_id):
+    return os.path.join(str(state_dir), "logs", f"{job_id}.log")
+
+
+def load_job_state(state_dir, job_id):
+    try:
+        with open(get_state_path(state_dir, job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_job_state(state_dir, job_id, state):
+    state_path = get_state_path(state_dir, job_id)
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(state_path), suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp_path, state_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_need_finish_times(state_dir, job):
+    '''Finish time of the last run of every need of a job, None for the needs that never ran'''
+    finish_times = {}
+
+    for need in job.needs:
+        state = load_job_state(state_dir, need)
+        finish_times[need] = state.get("finished") if state is not None else None
+
+    return finish_times
+
+
+def is_job_done(state_dir, job):
+    '''Done with the same commands after the last run of every need, a need that ran again makes it stale'''
+    state = load_job_state(state_dir, job.id)
+
+    if state is None or state["status"] != "done" or state["signature"] != job.signature:
+        return False
+
+    return state.get("needs") == get_need_finish_times(state_dir, job)
+
+
+def write_job_error(log_path, error):
+    '''Append an error to the job log, or print it if the log can not be written'''
+    try:
+        with open(log_path, "a") as log:
+            log.write(f"\n{error}")
+    except OSError:
+        print(error)
+
+
+def run_job(job, state_dir):
+    '''
+    Run the commands of a job one after the other, stopping at the first failure, with their
+    output in the job log. A command that can not be started fails the job, with its traceback in the log.
+    '''
+    log_path = get_log_path(state_dir, job.id)
+    job_dir = os.path.join(str(state_dir), "work", job.id)
+
+    state = {
+        "id": job.id,
+        "signature": job.signature,
+        "log": log_path,
+        "needs": get_need_finish_times(state_dir, job),
+        "commands": [],
+    }
+    start_time = time.time()
+    status = "done"
+
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        os.makedirs(job_dir, exist_ok=True)
+
+        with open(log_path, "w") as log:
+            for command in job.commands:
+                log.write(f"$ {command}\n")
+                log.flush()
+
+                command_start = time.perf_counter()
+
+                returncode = subprocess.run(
+                    command,
+                    shell = True,
+                    executable = "/bin/bash",
+                    cwd = job.cwd,
+                    env = {**os.environ, **job.env},
+                    stdout = log,
+                    stderr = subprocess.STDOUT
+                ).returncode
+
+                state["commands"].append({"returncode": returncode, "time": time.perf_counter() - command_start})
+
+                if returncode != 0:
+                    log.write(f"\nCommand failed with exit code {returncode}\n")
+                    status = "failed"
+                    break
+    except Exception:
+        status = "failed"
+        write_job_error(log_path, traceback.format_exc())
+
+    state.update({
+        "status": status,
+        "start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time)),
+        "time": time.time() - start_time,
+        "finished": time.time(),
+    })
+
+    return state
+
+
+def run_jobs(jobs, state_dir, max_parallel=4, concurrency=None, force=False):
+    '''
+    Run the jobs on a thread pool as soon as their dependencies are done, with at most
+    `concurrency[stage]` jobs of a stage at once. Jobs done after the last run of their
+    dependencies are skipped unless `force`, so the dependents of a job that runs again run
+    again too. The dependents of a failed job are blocked while the other jobs go on.
+    Returns the status of every job: done, cached, failed or blocked.
+    '''
+    concurrency = concurrency or {}
+
+    statuses = {}
+    pending = list(jobs)
+
+    running = {}
+    stage_running = Counter()
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while pending or running:
+            for job in list(pending):
+                need_statuses = [statuses.get(need) for need in job.needs]
+
+                if any(status in ["failed", "blocked"] for status in need_statuses):
+                    statuses[job.id] = "blocked"
+                    pending.remove(job)
+                    print(f"Blocked {job.id}: a dependency failed")
+                    continue
+
+                if not all(status in DONE_STATUSES for status in need_statuses):
+                    continue
+
+                # Checked once the needs are final, they may just have run again
+                if not force and is_job_done(state_dir, job):
+                    statuses[job.id] = "cached"
+                    pending.remove(job)
+                    continue
+
+                if len(running) >= max_parallel or stage_running[job.stage] >= concurrency.get(job.stage, max_parallel):
+                    continue
+
+                print(f"Started {job.id}")
+                running[executor.submit(run_job, job, state_dir)] = job
+                stage_running[job.stage] += 1
+                pending.remove(job)
+
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Jobs can not be started: {[job.id for job in pending]}")
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                job = running.pop(future)
+                stage_running[job.stage] -= 1
+
+                state = future.result()
+                save_job_state(state_dir, job.id, state)
+
+                statuses[job.id] = state["status"]
+
+                print(f"{state['status'].capitalize()} {job.id} in {state['time']:.1f}s" +
+                      (f", see {state['log']}" if state["status"] == "failed" else ""))
+
+    num_cached = sum(status == "cached" for status in statuses.values())
+    print(f"{num_cached} of {len(jobs)} jobs were up to date, ran {len(jobs) - num_cached}")
+
+    return statuses
+
+
+def get_job_statuses(jobs, state_dir):
+    '''Recorded status of every job, pending if it never ran, or if it or one of its needs changed since'''
+    statuses = {}
+
+    for job in jobs:
+        state = load_job_state(state_dir, job.id)
+
+        if state is None or state["signature"] != job.signature:
+            statuses[job.id] = "pending"
+        elif state["status"] == "done" and not is_job_done(state_dir, job):
+            statuses[job.id] = "pending"
+        else:
+            statuses[job.id] = state["status"]
+
+    return statuses
+
+
+def get_stage_summary(jobs, statuses, state_dir):
+    '''Per stage counts of every status and the time of its finished jobs'''
+    summary = {}
+
+    for job in jobs:
+        stage_summary = summary.setdefault(job.stage, {"jobs": 0, "time": 0.0, "max_time": 0.0, **{status: 0 for status in ["done", "cached", "failed", "blocked", "pending"]}})
+
+        status = statuses.get(job.id, "pending")
+        stage_summary["jobs"] += 1
+        stage_summary[status] += 1
+
+        state = load_job_state(state_dir, job.id)
+        if state is not None and status != "pending":
+            stage_summary["time"] += state["time"]
+            stage_summary["max_time"] = max(stage_summary["max_time"], state["time"])
+
+    return summary
+
+
+def format_stage_summary(summary):
+    columns = ["jobs", "done", "cached", "failed", "blocked", "pending"]
+    lines = [f"{'stage':<20}" + "".join(f"{column:>9}" for column in columns) + f"{'time, s':>12}{'max, s':>10}"]
+
+    for stage, stage_summary in summary.items():
+        lines.append(
+            f"{stage:<20}" + "".join(f"{stage_summary[column]:>9}" for column in columns) +
+            f"{stage_summary['time']:>12.1f}{stage_summary['max_time']:>10.1f}"
+        )
+
+    return "\n".join(lines)
@@ -7,15 +7,47 @@ import torch
 import numpy as np
 import open3d as o3d
 
-from collections import defaultdict, Counter
+from src.pred_store import save_pred_store
 
 
-def has_tie(lst):
-    counts = Counter(lst)
-    if not counts:
-        return False  # Empty list
-    max_count = max(counts.values())
-    return list(counts.values()).count(max_count) > 1
+def vote_vertex_labels(num_vertices, face_vertices, face_labels):
+    '''
+    Majority label of the faces adjacent to each vertex. Vertices with a tie between the
+    most frequent labels, or without any face, get -1.
+    '''
+    face_sizes = np.fromiter((len(vertices) for vertices in face_vertices), dtype=np.int64, count=len(face_vertices))
+    
+    if face_sizes.sum() == 0:
+        return np.full(num_vertices, -1, dtype=np.int64)
+    
+    # (vertex, class) pair of every face-vertex incidence
+    pair_vertex = np.concatenate(list(face_vertices)).astype(np.int64)
+    pair_class = np.repeat(np.asarray(face_labels, dtype=np.int64), face_sizes)
+    
+    classes, pair_class_idx = np.unique(pair_class, return_inverse=True)
+    num_classes = len(classes)
+    
+    pair_keys, pair_counts = np.unique(pair_vertex * num_classes + pair_class_idx, return_counts=True)
+    pair_vertex = pair_keys // num_classes
+    pair_class_idx = pair_keys % num_classes
+    
+    # Pairs are sorted by vertex, so every vertex is a contiguous segment
+    segment_starts = np.flatnonzero(np.r_[True, pair_vertex[1:] != pair_vertex[:-1]])
+    segment_sizes = np.diff(np.r_[segment_starts, len(pair_keys)])
+    segment_vertex = pair_vertex[segment_starts]
+    
+    max_counts = np.maximum.reduceat(pair_counts, segment_starts)
+    is_max = pair_counts == np.repeat(max_counts, segment_sizes)
+    num_max = np.add.reduceat(is_max.astype(np.int64), segment_starts)
+    
+    max_pairs = np.flatnonzero(is_max)
+    first_max_pairs = max_pairs[np.r_[True, pair_vertex[max_pairs][1:] != pair_vertex[max_pairs][:-1]]]
+    
+    vertex_labels = np.full(num_vertices, -1, dtype=np.int64)
+    vertex_labels[segment_vertex] = classes[pair_class_idx[first_max_pairs]]
+    vertex_labels[segment_vertex[num_max > 1]] = -1
+    
+    return vertex_labels
 
 
 def load_gt_pointcloud_ply(gt_pc_path, semantic_info):
@@ -26,19 +58,16 @@ def load_gt_pointcloud_ply(gt_pc_path, semantic_info):
     vertices_xyz = np.vstack([plydata["vertex"]["x"], plydata["vertex"]["y"], plydata["vertex"]["z"]]).T
     
     each_face_vertices = plydata["face"]["vertex_indices"]
-    each_face_object_id = plydata["face"]["object_id"]
-
-    vertex_id_to_semantic = defaultdict(list)
-
-    for i, face_vertices_idx in enumerate(each_face_vertices):
-        for idx in face_vertices_idx:
-            vertex_id_to_semantic[idx].append(
-                object_to_class_mapping.get(each_face_object_id[i], -1)
-            )
-            
-    vertex_labels = np.array([Counter(vertex_id_to_semantic.get(i, [-1])).most_common(1)[0][0] for i in range(vertices_xyz.shape[0])])
-    vertex_with_ties = np.array([has_tie(vertex_id_to_semantic.get(i, [-1])) for i in range(vertices_xyz.shape[0])])
-    vertex_labels[vertex_with_ties] = -1
+    each_face_object_id = np.asarray(plydata["face"]["object_id"])
+    
+    face_object_ids, face_object_idx = np.unique(each_face_object_id, return_inverse=True)
+    object_classes = np.array([object_to_class_mapping.get(obj_id, -1) for obj_id in face_object_ids], dtype=np.int64)
+    
+    vertex_labels = vote_vertex_labels(
+        num_vertices = vertices_xyz.shape[0],
+        face_vertices = each_face_vertices,
+        face_labels = object_classes[face_object_idx.reshape(-1)]
+    )
     
     gt_xyz = torch.tensor(vertices_xyz)
     gt_class = torch.tensor(vertex_labels, dtype=int)
@@ -61,10 +90,34 @@ def load_gt_pointcloud_pcd(gt_pc_path, semantic_info):
     return gt_xyz, gt_class
 
 
-def save_pointcloud(save_dir, o3d_pcd=None, xyz=None, colors=None, semantics=None, annotations=None):
+SAVE_FORMATS = ['pcd', 'osmpred']
+
+
+def save_pointcloud(save_dir, o3d_pcd=None, xyz=None, colors=None, semantics=None, annotations=None, save_format='pcd'):
+    '''
+    save_format='pcd' writes pointcloud.pcd, semantic.npy and annotations.json,
+    save_format='osmpred' writes `save_dir` as a prediction store (see src/pred_store.py)
+    '''
     if o3d_pcd is not None and (xyz is not None or colors is not None):
         raise ValueError("Provide either 'o3d_pcd' or 'xyz/colors', not both.")
     
+    if save_format not in SAVE_FORMATS:
+        raise ValueError(f"Unknown point cloud save format: {save_format}")
+    
+    if save_format == 'osmpred':
+        if o3d_pcd is not None:
+            xyz = np.asarray(o3d_pcd.points)
+            colors = np.asarray(o3d_pcd.colors) if o3d_pcd.has_colors() else None
+        
+        save_pred_store(
+            save_dir,
+            xyz = np.asarray(xyz),
+            rgb = np.asarray(colors) if colors is not None else None,
+            label = np.asarray(semantics) if semantics is not None else None,
+            annotations = annotations
+        )
+        return
+    
     os.makedirs(save_dir, exist_ok=True)
     
     if o3d_pcd is None:
@@ -0,0 +1,244 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+PRED_STORE_FORMAT = "osma-pred"
+PRED_STORE_META_NAME = "meta.json"
+PRED_STORE_CHUNK_SIZE = 1_048_576
+
+# Column name -> stored dtype
+PRED_STORE_COLUMNS = {
+    "xyz": np.float32,
+    "rgb": np.uint8,
+    "label": np.int32,
+    "features": np.float16,
+    "object_id": np.int32,
+    "object_features": np.float16,
+}
+
+# Columns indexed by object instead of by point
+PRED_STORE_OBJECT_COLUMNS = ["object_features"]
+
+
+def is_pred_store(path):
+    meta_path = os.path.join(str(path), PRED_STORE_META_NAME)
+    
+    if not os.path.isfile(meta_path):
+        return False
+    
+    try:
+        with open(meta_path) as f:
+            return json.load(f).get("format") == PRED_STORE_FORMAT
+    except ValueError:
+        return False
+
+
+def _is_empty_dir(path):
+    return os.path.isdir(path) and not os.listdir(path)
+
+
+def to_store_rgb(colors):
+    '''Open3D colors in [0, 1] to uint8, colors already in [0, 255] are kept'''
+    colors = np.asarray(colors)
+
+    if colors.dtype == np.uint8:
+        return colors
+
+    if colors.size and colors.max() <= 1.0:
+        colors = colors * 255
+
+    return np.clip(np.round(colors), 0, 255).astype(np.uint8)
+
+
+def _write_column(path, values, dtype, chunk_size=PRED_STORE_CHUNK_SIZE):
+    '''Copy a column chunk by chunk, so memory-mapped sources are never fully loaded'''
+    column = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=values.shape)
+
+    for start in range(0, len(values), chunk_size):
+        column[start:start + chunk_size] = np.asarray(values[start:start + chunk_size])
+
+    column.flush()
+
+
+def save_pred_store(store_dir, xyz, annotations=None, meta=None, **columns):
+    '''
+    Write a prediction into a directory of memory-mappable .npy columns: float32 xyz,
+    uint8 rgb, int32 label, fp16 per-point features, int32 object_id and fp16 object_features,
+    described by meta.json. Only xyz is required. An existing `store_dir` is only replaced
+    if it is empty or a prediction store.
+    '''
+    store_dir = str(store_dir)
+
+    if os.path.lexists(store_dir) and not (is_pred_store(store_dir) or _is_empty_dir(store_dir)):
+        raise FileExistsError(f"Not replacing {store_dir}: it exists and is not a prediction store")
+
+    columns = {"xyz": xyz, **{name: values for name, values in columns.items() if values is not None}}
+
+    unknown_columns = set(columns) - set(PRED_STORE_COLUMNS)
+    if unknown_columns:
+        raise ValueError(f"Unknown prediction store columns: {sorted(unknown_columns)}")
+
+    parent_dir = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, suffix=".tmp")
+
+    try:
+        num_points = len(columns["xyz"])
+        columns_meta = {}
+
+        for name, values in columns.items():
+            if hasattr(values, "detach"):
+                values = values.detach().cpu().numpy()
+            if name == "rgb":
+                values = to_store_rgb(values)
+
+            dtype = PRED_STORE_COLUMNS[name]
+
+            if name not in PRED_STORE_OBJECT_COLUMNS and len(values) != num_points:
+                raise ValueError(f"Column {name} has {len(values)} rows, expected {num_points}")
+
+            _write_column(os.path.join(tmp_dir, f"{name}.npy"), values, dtype)
+            columns_meta[name] = {"dtype": np.dtype(dtype).name, "shape": list(values.shape)}
+
+        store_meta = {
+            "format": PRED_STORE_FORMAT,
+            "version": 1,
+            "num_points": num_points,
+            "columns": columns_meta,
+            "annotations": annotations,
+            **(meta or {}),
+        }
+
+        with open(os.path.join(tmp_dir, PRED_STORE_META_NAME), "w") as f:
+            json.dump(store_meta, f, indent=4)
+
+        if os.path.isdir(store_dir):
+            shutil.rmtree(store_dir)
+        os.replace(tmp_dir, store_dir)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+    print(f'Saved prediction store to "{store_dir}"')
+
+
+class PredStore:
+    '''Lazy reader of a prediction store: every column is memory-mapped on first access'''
+
+    def __init__(self, store_dir):
+        self.store_dir = str(store_dir)
+
+        with open(os.path.join(self.store_dir, PRED_STORE_META_NAME)) as f:
+            self.meta = json.load(f)
+
+        if self.meta.get("format") != PRED_STORE_FORMAT:
+            raise ValueError(f"Not a prediction store: {self.store_dir}")
+
+        self._columns = {}
+
+    @property
+    def num_points(self):
+        return self.meta["num_points"]
+
+    @property
+    def annotations(self):
+        return self.meta.get("annotations")
+
+    @property
+    def has_objects(self):
+        return "object_id" in self and "object_features" in self
+
+    def __contains__(self, name):
+        return name in self.meta["columns"]
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(f"Column {name} is not in the prediction store {self.store_dir}")
+
+        if name not in self._columns:
+            # Copy-on-write maps, so the columns can be wrapped by torch tensors without copies
+            self._columns[name] = np.load(os.path.join(self.store_dir, f"{name}.npy"), mmap_mode="c")
+
+        return self._columns[name]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def iter_chunks(self, names, chunk_size=PRED_STORE_CHUNK_SIZE):
+        '''(start, {name: chunk}) over the per-point columns, read chunk by chunk'''
+        for start in range(0, self.num_points, chunk_size):
+            yield start, {name: np.asarray(self[name][start:start + chunk_size]) for name in names}
+
+
+def load_pred_store(store_dir):
+    return PredStore(store_dir)
+
+
+def convert_pred_pointcloud(approach_name, pred_pc_path, store_dir, annotations=None):
+    '''Convert the native output of an approach, or a save_pointcloud directory, into a prediction store'''
+    from src.eval import get_adaptor, has_pred_objects
+
+    meta = {"approach": approach_name, "source": str(pred_pc_path)}
+
+    if os.path.isfile(os.path.join(str(pred_pc_path), "pointcloud.pcd")):
+        convert_saved_pointcloud(pred_pc_path, store_dir, meta=meta)
+    elif has_pred_objects(approach_name):
+        pred_objects = get_adaptor(approach_name).load_pred_objects(pred_pc_path)
+
+        save_pred_store(
+            store_dir,
+            xyz = pred_objects['xyz'],
+            rgb = pred_objects['color'],
+            object_id = pred_objects['point_object'],
+            object_features = pred_objects['object_feats'],
+            annotations = annotations,
+            meta = meta
+        )
+    elif approach_name in ["openscene", "OpenScene"]:
+        convert_openscene_prediction(pred_pc_path, store_dir, annotations=annotations, meta=meta)
+    else:
+        raise ValueError(f"No prediction store converter for approach: {approach_name}")
+
+
+def convert_openscene_prediction(pred_pc_path, store_dir, annotations=None, meta=None):
+    import open3d as o3d
+
+    pcd = o3d.io.read_point_cloud(os.path.join(str(pred_pc_path), "gt.ply"))
+
+    save_pred_store(
+        store_dir,
+        xyz = np.asarray(pcd.points),
+        rgb = np.asarray(pcd.colors),
+        features = np.load(os.path.join(str(pred_pc_path), "predictions.npy"), mmap_mode="r"),
+        annotations = annotations,
+        meta = meta
+    )
+
+
+def convert_saved_pointcloud(save_dir, store_dir, meta=None):
+    '''Convert the pointcloud.pcd, semantic.npy and annotations.json written by save_pointcloud'''
+    import open3d as o3d
+
+    save_dir = str(save_dir)
+    pcd = o3d.io.read_point_cloud(os.path.join(save_dir, "pointcloud.pcd"))
+
+    semantic_path = os.path.join(save_dir, "semantic.npy")
+    annotations_path = os.path.join(save_dir, "annotations.json")
+
+    annotations = None
+    if os.path.exists(annotations_path):
+        with open(annotations_path) as f:
+            annotations = json.load(f)
+
+    save_pred_store(
+        store_dir,
+        xyz = np.asarray(pcd.points),
+        rgb = np.asarray(pcd.colors) if pcd.has_colors() else None,
+        label = np.load(semantic_path, mmap_mode="r") if os.path.exists(semantic_path) else None,
+        annotations = annotations,
+        meta = meta
+    )
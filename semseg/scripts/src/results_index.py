@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import time
+from glob import glob
+
+from src.hashing import hash_file
+
+
+RESULTS_INDEX_NAME = "results_index.sqlite"
+RESULTS_ROOT_NAME = "osma-bench"
+METRICS_FILE_NAME = "metrics.csv"
+METRIC_NAMES = ["miou", "fmiou", "macc"]
+
+# compute_metrics.py writes the scene rows first, every row from the first of these on is an aggregate
+SUMMARY_SCENES = ["overall_mean", "overall"]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metrics (
+    approach TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    label TEXT NOT NULL,
+    scene TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    miou REAL,
+    fmiou REAL,
+    macc REAL,
+    PRIMARY KEY (approach, dataset, label, scene)
+);
+CREATE INDEX IF NOT EXISTS metrics_dataset_kind ON metrics (dataset, kind);
+CREATE TABLE IF NOT EXISTS sources (
+    approach TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    label TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (approach, dataset, label)
+);
+'''
+
+
+def get_run_key(results_dir):
+    '''(approach, dataset, label) of a results/osma-bench/<approach>/<dataset>/<label> directory'''
+    parts = os.path.normpath(os.path.abspath(str(results_dir))).split(os.sep)
+    return tuple(parts[-3:])
+
+
+def get_default_index_path(results_dir):
+    '''
+    Index at the root of the results tree, three levels above a run directory, or None if the
+    directory is not laid out as <root>/<approach>/<dataset>/<label>: the root has to be an
+    osma-bench directory or to hold an index already
+    '''
+    parts = os.path.normpath(os.path.abspath(str(results_dir))).split(os.sep)
+
+    if len(parts) < 5:
+        return None
+
+    root = os.sep.join(parts[:-3]) or os.sep
+    index_path = os.path.join(root, RESULTS_INDEX_NAME)
+
+    if os.path.basename(root) != RESULTS_ROOT_NAME and not os.path.isfile(index_path):
+        return None
+
+    return index_path
+
+
+def get_row_kinds(scenes):
+    '''"scene" or "summary" for the rows of a metrics table, chunk rows follow the overall ones'''
+    kinds = []
+    for scene in scenes:
+        kinds.append("summary" if scene in SUMMARY_SCENES or (kinds and kinds[-1] == "summary") else "scene")
+
+    return kinds
+
+
+def connect_results_index(index_path):
+    connection = sqlite3.connect(str(index_path), timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def upsert_run_metrics(index_path, run_key, metrics_df, source_path=None):
+    '''
+    Replace the rows of one run (approach, dataset, label) with the rows of its metrics table,
+    and record the size, mtime and hash of the metrics.csv they come from.
+    '''
+    records = metrics_df[["scene", *METRIC_NAMES]].to_dict("records")
+    kinds = get_row_kinds([str(row["scene"]) for row in records])
+
+    rows = [
+        (*run_key, str(row["scene"]), kind, *[row[name] for name in METRIC_NAMES])
+        for row, kind in zip(records, kinds)
+    ]
+
+    connection = connect_results_index(index_path)
+
+    try:
+        with connection:
+            connection.execute("DELETE FROM metrics WHERE approach = ? AND dataset = ? AND label = ?", run_key)
+            connection.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+            if source_path is not None:
+                stat = os.stat(source_path)
+                connection.execute(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*run_key, os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns, hash_file(source_path), time.time())
+                )
+    finally:
+        connection.close()
+
+
+def sync_results_index(index_path, root_dir):
+    '''
+    Bring the index up to date with the <approach>/<dataset>/<label>/metrics.csv files of a
+    results tree: index the files that are new or changed since they were indexed, by their size
+    and mtime, and drop the runs of the tree whose indexed file was deleted
+    '''
+    import pandas as pd
+
+    root_dir = os.path.abspath(str(root_dir))
+    connection = connect_results_index(index_path)
+
+    try:
+        sources = connection.execute("SELECT approach, dataset, label, path, size, mtime_ns FROM sources").fetchall()
+    finally:
+        connection.close()
+
+    indexed = {(path, size, mtime_ns) for *_, path, size, mtime_ns in sources}
+    removed = [
+        tuple(run_key) for *run_key, path, _, _ in sources
+        if os.path.commonpath([root_dir, path]) == root_dir and not os.path.isfile(path)
+    ]
+
+    num_updated = 0
+    for metrics_path in sorted(glob(os.path.join(root_dir, "*", "*", "*", METRICS_FILE_NAME))):
+        stat = os.stat(metrics_path)
+
+        if (os.path.abspath(metrics_path), stat.st_size, stat.st_mtime_ns) in indexed:
+            continue
+
+        upsert_run_metrics(index_path, get_run_key(os.path.dirname(metrics_path)), pd.read_csv(metrics_path), source_path=metrics_path)
+        num_updated += 1
+
+    if removed:
+        connection = connect_results_index(index_path)
+
+        try:
+            with connection:
+                for table in ["metrics", "sources"]:
+                    connection.executemany(f"DELETE FROM {table} WHERE approach = ? AND dataset = ? AND label = ?", removed)
+        finally:
+            connection.close()
+
+    if num_updated or removed:
+        print(f"Indexed {num_updated} new or changed metrics files into {index_path}, removed {len(removed)} deleted ones")
+
+
+def query_metrics(index_path, kind=None, **filters):
+    '''Metrics rows as a DataFrame, filtered by kind ("scene" or "summary") and approach/dataset/label/scene values'''
+    import pandas as pd
+
+    conditions, params = [], []
+
+    if kind is not None:
+        filters["kind"] = kind
+
+    for name, value in filters.items():
+        if name not in ["approach", "dataset", "label", "scene", "kind"]:
+            raise ValueError(f"Unknown metrics filter: {name}")
+
+        conditions.append(f"{name} = ?")
+        params.append(value)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = connect_results_index(index_path)
+
+    try:
+        return pd.read_sql_query(f"SELECT * FROM metrics {where} ORDER BY approach, dataset, label, scene", connection, params=params)
+    finally:
+        connection.close()
+
+
+def query_run_summaries(index_path, summary_scenes):
+    '''
+    One summary row per run with its number of scenes, `summary_scenes` maps every dataset to
+    the summary row used for it, e.g. {"hm3d": "overall_mean"}; other datasets are skipped
+    '''
+    import pandas as pd
+
+    connection = connect_results_index(index_path)
+
+    try:
+        summaries = pd.read_sql_query(
+            '''
+            SELECT m.approach, m.dataset, m.label, m.scene, m.miou, m.fmiou, m.macc,
+                   COALESCE(c.scene_count, 0) AS scene_count
+            FROM metrics m
+            LEFT JOIN (
+                SELECT approach, dataset, label, COUNT(*) AS scene_count
+                FROM metrics WHERE kind = 'scene'
+                GROUP BY approach, dataset, label
+            ) c USING (approach, dataset, label)
+            WHERE m.kind = 'summary'
+            ''',
+            connection
+        )
+    finally:
+        connection.close()
+
+    summaries = summaries[summaries["scene"] == summaries["dataset"].map(summary_scenes)]
+
+    return summaries.drop(columns="scene").reset_index(drop=True)
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+class SharedArray:
+    '''Numpy array backed by a named shared memory block, attachable from other processes'''
+
+    def __init__(self, shm, shape, dtype, owner=False):
+        self._shm = shm
+        self._owner = owner
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.asarray(array)
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+
+        shared = cls(shm, array.shape, array.dtype, owner=True)
+        shared.array[...] = array
+
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor):
+        name, shape, dtype = descriptor
+
+        try:
+            shm = SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 always tracks the block, pool workers share the tracker of the parent
+            # that unlinks it, so this only registers the same name again
+            shm = SharedMemory(name=name)
+
+        return cls(shm, shape, dtype)
+
+    @property
+    def descriptor(self):
+        return self._shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.array = None
+
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views of the array are still alive, the mapping is released with them
+            pass
+
+        if self._owner:
+            self._shm.unlink()
+
+
+# Attached arrays kept mapped per process, the GT of a scene is reused by its next entries
+# while the address space of a worker stays bounded
+MAX_ATTACHED_ARRAYS = 4
+
+_ATTACHED_ARRAYS = OrderedDict()
+
+
+def attach_shared_array(descriptor):
+    '''Attach to a shared array, reusing the mappings of the most recently attached arrays'''
+    name = descriptor[0]
+
+    if name in _ATTACHED_ARRAYS:
+        _ATTACHED_ARRAYS.move_to_end(name)
+    else:
+        _ATTACHED_ARRAYS[name] = SharedArray.attach(descriptor)
+
+        while len(_ATTACHED_ARRAYS) > MAX_ATTACHED_ARRAYS:
+            _ATTACHED_ARRAYS.popitem(last=False)[1].close()
+
+    return _ATTACHED_ARRAYS[name].array
+
+
+def detach_shared_array(descriptor):
+    '''Release the mapping of an attached array, once no view of it is left'''
+    shared = _ATTACHED_ARRAYS.pop(descriptor[0], None)
+
+    if shared is not None:
+        shared.close()
@@ -0,0 +1,183 @@
+import numpy as np
+
+
+TILED_PC_EXT = ".h5"
+TILED_PC_FORMAT = "osma-tiles"
+TILED_PC_COLUMNS = {
+    "xyz": np.float32,
+    "rgb": np.uint8,
+    "label": np.int32,
+}
+TILED_PC_CHUNK_ROWS = 65_536
+
+
+def get_tile_coords(xyz, tile_size):
+    return np.floor(np.asarray(xyz) / tile_size).astype(np.int64)
+
+
+def save_tiled_pointcloud(path, xyz, colors=None, labels=None, tile_size=2.0, compression="lzf"):
+    '''
+    Write a point cloud into HDF5 split into cubic spatial tiles of `tile_size` meters.
+
+    Points are sorted by tile, so every tile is a contiguous row range of the chunked
+    /xyz, /rgb and /label datasets. /tiles holds the index: integer tile coordinates,
+    AABB of the points, row offset and count of every tile.
+    '''
+    import h5py
+
+    xyz = np.asarray(xyz)
+    tile_coords = get_tile_coords(xyz, tile_size)
+
+    unique_coords, tile_idx, tile_counts = np.unique(tile_coords, axis=0, return_inverse=True, return_counts=True)
+    tile_idx = tile_idx.reshape(-1)
+    order = np.argsort(tile_idx, kind="stable")
+
+    tile_offsets = np.concatenate([[0], np.cumsum(tile_counts)[:-1]]).astype(np.int64)
+
+    columns = {"xyz": xyz}
+    if colors is not None:
+        colors = np.asarray(colors)
+        columns["rgb"] = np.clip(np.round(colors * 255), 0, 255) if colors.dtype != np.uint8 else colors
+    if labels is not None:
+        columns["label"] = np.asarray(labels)
+
+    with h5py.File(path, "w") as f:
+        f.attrs["format"] = TILED_PC_FORMAT
+        f.attrs["version"] = 1
+        f.attrs["tile_size"] = tile_size
+        f.attrs["num_points"] = len(xyz)
+
+        for name, values in columns.items():
+            dtype = TILED_PC_COLUMNS[name]
+            sorted_values = values[order].astype(dtype)
+
+            f.create_dataset(
+                name,
+                data = sorted_values,
+                chunks = (min(TILED_PC_CHUNK_ROWS, max(len(sorted_values), 1)),) + sorted_values.shape[1:],
+                compression = compression
+            )
+
+        sorted_xyz = f["xyz"][...]
+
+        aabb_min = np.minimum.reduceat(sorted_xyz, tile_offsets, axis=0) if len(xyz) else np.zeros((0, 3))
+        aabb_max = np.maximum.reduceat(sorted_xyz, tile_offsets, axis=0) if len(xyz) else np.zeros((0, 3))
+
+        tiles = f.create_group("tiles")
+        tiles.create_dataset("coords", data=unique_coords.astype(np.int32))
+        tiles.create_dataset("aabb_min", data=aabb_min.astype(np.float32))
+        tiles.create_dataset("aabb_max", data=aabb_max.astype(np.float32))
+        tiles.create_dataset("offset", data=tile_offsets)
+        tiles.create_dataset("count", data=tile_counts.astype(np.int64))
+
+    print(f'Saved {len(unique_coords)} tiles to "{path}"')
+
+
+class TiledPointCloud:
+    '''Reader of a tiled point cloud, loading only the tiles intersecting a query box'''
+
+    def __init__(self, path):
+        import h5py
+
+        self.path = str(path)
+        self._file = h5py.File(self.path, "r")
+
+        if self._file.attrs.get("format") != TILED_PC_FORMAT:
+            self.close()
+            raise ValueError(f"Not a tiled point cloud: {self.path}")
+
+        self.tile_size = float(self._file.attrs["tile_size"])
+        self.num_points = int(self._file.attrs["num_points"])
+
+        tiles = self._file["tiles"]
+        self.tile_coords = tiles["coords"][...]
+        self.aabb_min = tiles["aabb_min"][...]
+        self.aabb_max = tiles["aabb_max"][...]
+        self.offsets = tiles["offset"][...]
+        self.counts = tiles["count"][...]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def columns(self):
+        return [name for name in TILED_PC_COLUMNS if name in self._file]
+
+    @property
+    def bounds(self):
+        return self.aabb_min.min(axis=0), self.aabb_max.max(axis=0)
+
+    def query_tiles(self, bbox_min=None, bbox_max=None):
+        '''Indices of the tiles whose AABB intersects [bbox_min, bbox_max]'''
+        mask = np.ones(len(self.offsets), dtype=bool)
+
+        if bbox_min is not None:
+            mask &= np.all(self.aabb_max >= np.asarray(bbox_min), axis=1)
+        if bbox_max is not None:
+            mask &= np.all(self.aabb_min <= np.asarray(bbox_max), axis=1)
+
+        return np.flatnonzero(mask)
+
+    def load_tiles(self, tile_indices, columns=None):
+        columns = self.columns if columns is None else columns
+        tile_indices = np.sort(np.asarray(tile_indices, dtype=np.int64))
+
+        # Adjacent tiles are contiguous rows, they are read with a single slice
+        ranges = []
+        for start, count in zip(self.offsets[tile_indices], self.counts[tile_indices]):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = start + count
+            else:
+                ranges.append([start, start + count])
+
+        result = {}
+        for name in columns:
+            dataset = self._file[name]
+            parts = [dataset[start:end] for start, end in ranges]
+
+            result[name] = np.concatenate(parts) if parts else np.zeros((0,) + dataset.shape[1:], dtype=dataset.dtype)
+
+        return result
+
+    def load_region(self, bbox_min=None, bbox_max=None, columns=None, clip=True):
+        '''
+        Columns of the points of the tiles intersecting the box, and with `clip` only of the
+        points inside it. Without a box the whole point cloud is loaded.
+        '''
+        columns = self.columns if columns is None else list(columns)
+        read_columns = columns if not clip or "xyz" in columns else columns + ["xyz"]
+
+        result = self.load_tiles(self.query_tiles(bbox_min, bbox_max), read_columns)
+
+        if clip and (bbox_min is not None or bbox_max is not None):
+            inside = np.ones(len(result["xyz"]), dtype=bool)
+
+            if bbox_min is not None:
+                inside &= np.all(result["xyz"] >= np.asarray(bbox_min), axis=1)
+            if bbox_max is not None:
+                inside &= np.all(result["xyz"] <= np.asarray(bbox_max), axis=1)
+
+            result = {name: values[inside] for name, values in result.items()}
+
+        return {name: result[name] for name in columns}
+
+
+def load_tiled_region(path, bbox_min=None, bbox_max=None, columns=None, clip=True):
+    with TiledPointCloud(path) as tiled_pc:
+        return tiled_pc.load_region(bbox_min, bbox_max, columns=columns, clip=clip)
+
+
+def parse_bbox(bbox):
+    '''"xmin ymin zmin xmax ymax zmax" to (bbox_min, bbox_max)'''
+    values = np.asarray(list(map(float, bbox.split())) if isinstance(bbox, str) else bbox, dtype=np.float64)
+
+    if values.shape != (6,):
+        raise ValueError(f"Expected 6 values for a bounding box, got {bbox}")
+
+    return values[:3], values[3:]
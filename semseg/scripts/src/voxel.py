@@ -0,0 +1,107 @@
+import itertools
+
+import torch
+import numpy as np
+
+
+# 26-neighbourhood sorted by distance: faces, then edges, then corners
+NEIGHBOR_OFFSETS = np.array(
+    sorted(
+        (offset for offset in itertools.product([-1, 0, 1], repeat=3) if any(offset)),
+        key = lambda offset: sum(map(abs, offset))
+    ),
+    dtype = np.int64
+)
+
+
+def ravel_hash_vec(coords, dims):
+    '''Ravel non-negative integer voxel coordinates into int64 keys of a grid of size `dims`'''
+    keys = coords[:, 0].astype(np.int64, copy=True)
+    keys *= dims[1]
+    keys += coords[:, 1]
+    keys *= dims[2]
+    keys += coords[:, 2]
+
+    return keys
+
+
+def _to_numpy(array):
+    if isinstance(array, torch.Tensor):
+        return array.detach().cpu().numpy()
+
+    return np.asarray(array)
+
+
+class VoxelLabelGrid:
+    '''
+    Sparse voxel grid holding the majority predicted label of every occupied voxel.
+    GT points take the label of their voxel, or of the closest occupied neighbouring voxel;
+    points without any occupied voxel around fall back to `fallback_fn`.
+    '''
+
+    def __init__(self, pred_xyz, pred_class, voxel_size, bounds_xyz=(), fallback_fn=None):
+        pred_xyz = _to_numpy(pred_xyz)
+        pred_class = _to_numpy(pred_class).astype(np.int64)
+
+        self.voxel_size = voxel_size
+        self._fallback_fn = fallback_fn
+
+        # Shared grid covering the predicted cloud and every other cloud to be queried,
+        # with a one voxel margin for the neighbour lookup
+        mins = [pred_xyz.min(axis=0)] + [_to_numpy(xyz).min(axis=0) for xyz in bounds_xyz]
+        maxs = [pred_xyz.max(axis=0)] + [_to_numpy(xyz).max(axis=0) for xyz in bounds_xyz]
+
+        self._origin = np.floor(np.min(mins, axis=0) / voxel_size).astype(np.int64) - 1
+        self._dims = np.floor(np.max(maxs, axis=0) / voxel_size).astype(np.int64) - self._origin + 2
+
+        pred_keys = self.get_keys(pred_xyz)
+        self._keys, pred_voxel = np.unique(pred_keys, return_inverse=True)
+
+        classes, pred_class_idx = np.unique(pred_class, return_inverse=True)
+        num_classes = len(classes)
+
+        pair_keys, pair_counts = np.unique(pred_voxel.reshape(-1) * num_classes + pred_class_idx.reshape(-1), return_counts=True)
+        pair_voxel = pair_keys // num_classes
+
+        # Most frequent class per voxel, the smallest class id on ties
+        order = np.lexsort((-pair_counts, pair_voxel))
+        first = order[np.r_[True, pair_voxel[order][1:] != pair_voxel[order][:-1]]]
+
+        self._labels = classes[pair_keys[first] % num_classes]
+
+    def get_keys(self, xyz):
+        coords = np.floor(_to_numpy(xyz) / self.voxel_size).astype(np.int64) - self._origin
+
+        return ravel_hash_vec(coords, self._dims)
+
+    def _lookup(self, keys):
+        pos = np.searchsorted(self._keys, keys).clip(max=len(self._keys) - 1)
+        found = self._keys[pos] == keys
+
+        return self._labels[pos], found
+
+    def predict(self, xyz):
+        keys = self.get_keys(xyz)
+        labels, found = self._lookup(keys)
+
+        offset_keys = ravel_hash_vec(NEIGHBOR_OFFSETS, self._dims)
+
+        for offset_key in offset_keys:
+            missing = np.flatnonzero(~found)
+
+            if len(missing) == 0:
+                break
+
+            neighbor_labels, neighbor_found = self._lookup(keys[missing] + offset_key)
+            labels[missing[neighbor_found]] = neighbor_labels[neighbor_found]
+            found[missing[neighbor_found]] = True
+
+        missing = np.flatnonzero(~found)
+
+        if len(missing) > 0:
+            if self._fallback_fn is None:
+                labels[missing] = -1
+            else:
+                labels[missing] = _to_numpy(self._fallback_fn(_to_numpy(xyz)[missing]))
+
+        return torch.from_numpy(labels)
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+
+# The scripts import their modules as `src.X` and `adaptors.X`, as they do from /scripts in the containers
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
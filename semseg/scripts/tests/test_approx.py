@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from src.approx import bootstrap_conf_matrices, get_row_weights, stratified_sample
+
+
+def make_gt_class(seed=0):
+    rng = np.random.default_rng(seed)
+    # Large, small and single point classes
+    return rng.permutation(np.repeat([-1, 0, 3, 7, 12], [5000, 20000, 150, 40, 1]))
+
+
+def conf_matrix(gt_class, pred_class, labels, weights=None):
+    '''Dense confusion matrix with an optional weight of every GT row'''
+    matrix = np.zeros((len(labels), len(labels)))
+    index = {label: i for i, label in enumerate(labels)}
+
+    for gt, pred in zip(gt_class, pred_class):
+        matrix[index[gt], index[pred]] += 1
+
+    return matrix if weights is None else matrix * weights[:, None]
+
+
+@pytest.mark.parametrize("fraction", [0.01, 0.1, 0.5, 1.0])
+def test_stratified_sample_counts(fraction):
+    gt_class = make_gt_class()
+    indices, classes, counts, sampled = stratified_sample(gt_class, fraction, min_per_class=100)
+
+    np.testing.assert_array_equal(classes, [-1, 0, 3, 7, 12])
+    np.testing.assert_array_equal(counts, [5000, 20000, 150, 40, 1])
+    np.testing.assert_array_equal(sampled, np.minimum(counts, np.maximum(np.ceil(fraction * counts), 100)))
+
+    assert np.all(np.diff(indices) > 0)
+    np.testing.assert_array_equal(np.unique(gt_class[indices], return_counts=True)[1], sampled)
+
+
+def test_stratified_sample_is_seeded():
+    gt_class = make_gt_class()
+
+    np.testing.assert_array_equal(stratified_sample(gt_class, 0.1, seed=3)[0], stratified_sample(gt_class, 0.1, seed=3)[0])
+    assert not np.array_equal(stratified_sample(gt_class, 0.1, seed=3)[0], stratified_sample(gt_class, 0.1, seed=4)[0])
+
+
+def test_stratified_sample_of_empty_gt():
+    indices, classes, counts, sampled = stratified_sample(np.zeros(0, dtype=np.int64), 0.1)
+    assert len(indices) == len(classes) == len(counts) == len(sampled) == 0
+
+
+def test_row_weights_are_inverse_sampling_probabilities():
+    classes, counts, sampled = np.array([-1, 0, 3]), np.array([50, 1000, 10]), np.array([50, 100, 10])
+
+    weights = get_row_weights(np.array([3, 0, 5, -1, 9]), classes, counts, sampled)
+    np.testing.assert_array_equal(weights, [1, 10, 1, 1, 1])
+
+    np.testing.assert_array_equal(get_row_weights(np.array([0, 1]), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)), [1, 1])
+
+
+def test_weighted_sample_matrix_estimates_the_exact_one():
+    gt_class = make_gt_class()
+    labels = [0, 3, 7, 12, -1]
+
+    # A prediction that only depends on the GT class makes the weighted estimate exact
+    pred_class = np.select([gt_class == 0, gt_class == 3], [3, 3], gt_class)
+    exact = conf_matrix(gt_class, pred_class, labels)
+
+    for fraction in [0.05, 1.0]:
+        indices, classes, counts, sampled = stratified_sample(gt_class, fraction, min_per_class=10)
+        weights = get_row_weights(np.array(labels), classes, counts, sampled)
+
+        np.testing.assert_allclose(conf_matrix(gt_class[indices], pred_class[indices], labels, weights), exact)
+
+    # With noisy predictions the weighted rows still sum to the class sizes
+    pred_class = np.random.default_rng(1).choice(labels, size=len(gt_class))
+    indices, classes, counts, sampled = stratified_sample(gt_class, 0.05, min_per_class=10)
+    weights = get_row_weights(np.array(labels), classes, counts, sampled)
+
+    np.testing.assert_allclose(
+        conf_matrix(gt_class[indices], pred_class[indices], labels, weights).sum(axis=1),
+        conf_matrix(gt_class, pred_class, labels).sum(axis=1)
+    )
+
+
+def test_bootstrap_preserves_row_sums():
+    matrix = np.array([
+        [50, 3, 0],
+        [0, 0, 0],
+        [7, 1, 12],
+    ])
+
+    resampled = bootstrap_conf_matrices(matrix, num_bootstrap=300, seed=0)
+
+    assert resampled.shape == (300, 3, 3)
+    np.testing.assert_array_equal(resampled.sum(axis=2), np.broadcast_to(matrix.sum(axis=1), (300, 3)))
+
+    # Predictions that never occur in a row are never drawn, the mean tends to the sample
+    assert np.all(resampled[:, matrix == 0] == 0)
+    np.testing.assert_allclose(resampled.mean(axis=0), matrix, atol=1.5)
+
+    np.testing.assert_array_equal(resampled, bootstrap_conf_matrices(matrix, num_bootstrap=300, seed=0))
+    assert bootstrap_conf_matrices(matrix, num_bootstrap=0).shape == (0, 3, 3)
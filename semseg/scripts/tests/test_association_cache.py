@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("open3d")
+pytest.importorskip("scipy")
+
+from src.association_cache import AssociationCache
+from src.eval import evaluate_scen
+
+
+CLASS_IDS = [0, 2, 5, 9]
+
+
+def make_scene(seed=0, num_gt=2000, num_pred=400):
+    rng = np.random.default_rng(seed)
+
+    gt_pointcloud = (torch.from_numpy(rng.uniform(0, 4, (num_gt, 3))), torch.from_numpy(rng.choice(CLASS_IDS, size=num_gt)))
+    pred_pointcloud = (torch.from_numpy(rng.uniform(0, 4, (num_pred, 3))), None, torch.from_numpy(rng.choice(CLASS_IDS, size=num_pred)))
+
+    return gt_pointcloud, pred_pointcloud
+
+
+def evaluate(gt_pointcloud, pred_pointcloud, association_cache=None):
+    return evaluate_scen(
+        gt_pointcloud,
+        pred_pointcloud,
+        {"ids": CLASS_IDS},
+        nn_count = 3,
+        knn_backend = 'kdtree',
+        block_size = 700,
+        association_cache = association_cache
+    )["conf_matrix"].numpy()
+
+
+def test_cached_knn_indices_give_the_same_confusion_matrix(tmp_path):
+    gt_pointcloud, pred_pointcloud = make_scene()
+    expected = evaluate(gt_pointcloud, pred_pointcloud)
+
+    cache = AssociationCache(tmp_path, pred_hash="pred", gt_hash="gt", nn_count=3)
+    assert cache.load_knn_indices(len(gt_pointcloud[0]), len(pred_pointcloud[2])) is None
+
+    # Miss: the indices are computed and committed
+    np.testing.assert_array_equal(evaluate(gt_pointcloud, pred_pointcloud, cache), expected)
+    assert cache.has_knn_indices()
+
+    # Hit: only the classes are needed, the predicted points are not used any more
+    relabelled = torch.from_numpy(np.random.default_rng(1).choice(CLASS_IDS, size=len(pred_pointcloud[2])))
+    hit_pointcloud = (torch.full_like(pred_pointcloud[0], np.nan), None, relabelled)
+
+    np.testing.assert_array_equal(
+        evaluate(gt_pointcloud, hit_pointcloud, AssociationCache(tmp_path, pred_hash="pred", gt_hash="gt", nn_count=3)),
+        evaluate(gt_pointcloud, (pred_pointcloud[0], None, relabelled))
+    )
+
+
+def test_entries_are_keyed_by_inputs_and_nn_count(tmp_path):
+    gt_pointcloud, pred_pointcloud = make_scene()
+    evaluate(gt_pointcloud, pred_pointcloud, AssociationCache(tmp_path, pred_hash="pred", gt_hash="gt", nn_count=3))
+
+    for pred_hash, gt_hash, nn_count in [("other", "gt", 3), ("pred", "other", 3), ("pred", "gt", 5)]:
+        cache = AssociationCache(tmp_path, pred_hash=pred_hash, gt_hash=gt_hash, nn_count=nn_count)
+        assert not cache.has_knn_indices()
+
+
+def test_failed_evaluation_leaves_no_partial_indices(tmp_path):
+    gt_pointcloud, pred_pointcloud = make_scene()
+    cache = AssociationCache(tmp_path, pred_hash="pred", gt_hash="gt", nn_count=3)
+
+    # Classes of another size fail the vote after the first block was queried
+    with pytest.raises(IndexError):
+        evaluate(gt_pointcloud, (pred_pointcloud[0], None, pred_pointcloud[2][:10]), cache)
+
+    assert not cache.has_knn_indices()
+    assert not os.path.exists(cache.entry_dir) or not [name for name in os.listdir(cache.entry_dir) if name.endswith(".tmp")]
+
+
+def test_point_object_round_trip(tmp_path):
+    cache = AssociationCache(tmp_path, pred_hash="pred", gt_hash="gt", nn_count=3)
+    assert cache.load_point_object() is None
+
+    point_object = np.array([0, 0, 1, -1, 2])
+    cache.save_point_object(point_object)
+
+    loaded = AssociationCache(tmp_path, pred_hash="pred", gt_hash="gt", nn_count=3).load_point_object()
+    np.testing.assert_array_equal(loaded, point_object)
+    assert loaded.dtype == np.int32
@@ -0,0 +1,127 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from compute_metrics import (
+    CONF_MATRIX_STORE_NAME, build_conf_matrix_store, compute_metrics, compute_metrics_batched,
+    get_label_mask, process_scenes, stack_conf_matrices
+)
+
+
+def baseline_compute_metrics(confmatrix, labels=None, excluded=None):
+    '''compute_metrics of the baseline, on one matrix at a time'''
+    nonzero_mask = (confmatrix.sum(axis=1) != 0)
+
+    if labels is not None and excluded is not None:
+        nonzero_mask = nonzero_mask * np.isin(labels, np.array(excluded), invert=True)
+
+    tp = np.diag(confmatrix)[nonzero_mask]
+    fp = confmatrix.sum(axis=0)[nonzero_mask] - tp
+    fn = confmatrix.sum(axis=1)[nonzero_mask] - tp
+
+    ious = tp / np.maximum(fn + fp + tp, 1e-7)
+    recall = tp / np.maximum(tp + fn, 1e-7)
+
+    return {
+        "miou": ious.mean().item(),
+        "fmiou": (ious * (tp + fn) / (tp + fn).sum()).sum().item(),
+        "macc": recall.mean().item(),
+    }
+
+
+def baseline_overall_conf_matrix(matrices):
+    '''get_overall_conf_matrix of the baseline'''
+    overall_labels = np.unique([idx for data in matrices.values() for idx in data['labels']])
+    overall_conf_matrix = np.zeros((len(overall_labels), len(overall_labels)), dtype=int)
+
+    for data in matrices.values():
+        index_map = {int(val): idx for idx, val in enumerate(overall_labels)}
+        indices = np.array([index_map[int(val)] for val in data['labels']])
+
+        I, J = np.meshgrid(indices, indices, indexing='ij')
+        overall_conf_matrix[I, J] += data["conf_matrix"].numpy()
+
+    return overall_conf_matrix, overall_labels
+
+
+def make_scene_matrices(seed=0, num_scenes=4):
+    rng = np.random.default_rng(seed)
+    matrices = {}
+
+    for i in range(num_scenes):
+        labels = np.sort(rng.choice(np.arange(-1, 30), size=rng.integers(3, 12), replace=False))
+        conf_matrix = rng.integers(0, 50, size=(len(labels), len(labels)))
+        # Some GT classes without points
+        conf_matrix[rng.random(len(labels)) < 0.2] = 0
+
+        matrices[f"scene_{i}"] = {"conf_matrix": torch.tensor(conf_matrix), "labels": torch.tensor(labels)}
+
+    return matrices
+
+
+def write_scene_matrices(results_dir, matrices):
+    for scene, data in matrices.items():
+        with open(os.path.join(results_dir, f"{scene}_conf_matrix.pkl"), "wb") as f:
+            pickle.dump(data, f)
+
+
+@pytest.mark.parametrize("excluded", [None, [0], [-1, 0, 3]])
+def test_batched_metrics_match_baseline(excluded):
+    for data in make_scene_matrices().values():
+        conf_matrix = data["conf_matrix"].numpy()
+        labels = data["labels"].numpy()
+
+        expected = baseline_compute_metrics(conf_matrix, labels, excluded=excluded)
+        result = compute_metrics(conf_matrix, labels, excluded=excluded)
+
+        for name in expected:
+            np.testing.assert_allclose(result[name], expected[name], rtol=1e-12)
+
+
+def test_stacked_matrices_match_baseline_overall_matrix():
+    matrices = make_scene_matrices()
+
+    conf_matrices, labels = stack_conf_matrices(matrices)
+    expected_matrix, expected_labels = baseline_overall_conf_matrix(matrices)
+
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_array_equal(conf_matrices.sum(axis=0), expected_matrix)
+
+
+def test_batched_metrics_of_stacked_matrices_match_per_scene_metrics():
+    matrices = make_scene_matrices()
+    conf_matrices, labels = stack_conf_matrices(matrices)
+
+    batched = compute_metrics_batched(conf_matrices, get_label_mask(labels, excluded=[0])[None])
+
+    for i, data in enumerate(matrices.values()):
+        expected = baseline_compute_metrics(data["conf_matrix"].numpy(), data["labels"].numpy(), excluded=[0])
+
+        for name in expected:
+            np.testing.assert_allclose(batched[name][i], expected[name], rtol=1e-12)
+
+
+def test_process_scenes_reuses_and_refreshes_the_store(tmp_path):
+    matrices = make_scene_matrices()
+    write_scene_matrices(tmp_path, matrices)
+
+    overall_matrix, labels, metrics_df = process_scenes(tmp_path, excluded=[0])
+    expected_matrix, _ = baseline_overall_conf_matrix(matrices)
+
+    np.testing.assert_array_equal(overall_matrix, expected_matrix)
+    assert list(metrics_df["scene"]) == list(matrices)
+    assert os.path.exists(tmp_path / CONF_MATRIX_STORE_NAME)
+
+    # A changed scene makes the store stale
+    matrices["scene_0"] = make_scene_matrices(seed=1, num_scenes=1)["scene_0"]
+    write_scene_matrices(tmp_path, {"scene_0": matrices["scene_0"]})
+
+    store = build_conf_matrix_store(tmp_path)
+    expected_matrix, expected_labels = baseline_overall_conf_matrix(matrices)
+
+    np.testing.assert_array_equal(store["labels"], expected_labels)
+    np.testing.assert_array_equal(store["conf_matrices"].sum(axis=0), expected_matrix)
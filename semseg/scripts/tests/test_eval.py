@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("open3d")
+pytest.importorskip("scipy")
+sklearn_metrics = pytest.importorskip("sklearn.metrics")
+
+from src.eval import compute_confusion_matrix, evaluate_scen
+
+
+CLASS_IDS = [0, 2, 5, 9]
+
+
+def make_scene(seed=0, num_gt=3000, num_pred=500):
+    rng = np.random.default_rng(seed)
+
+    gt_xyz = torch.from_numpy(rng.uniform(0, 4, (num_gt, 3)))
+    # GT classes outside CLASS_IDS are ignored by the evaluation
+    gt_class = torch.from_numpy(rng.choice(CLASS_IDS + [7, -1], size=num_gt))
+
+    pred_xyz = torch.from_numpy(rng.uniform(0, 4, (num_pred, 3)))
+    pred_class = torch.from_numpy(rng.choice(CLASS_IDS + [-1], size=num_pred))
+
+    return (gt_xyz, gt_class), (pred_xyz, None, pred_class)
+
+
+def baseline_evaluate_scen(gt_pointcloud, pred_pointcloud, nn_count):
+    '''Dense evaluate_scen of the baseline: all GT points at once, brute-force k-NN and sklearn'''
+    gt_xyz, gt_class = gt_pointcloud
+    pred_xyz, _, pred_class = pred_pointcloud
+
+    pred_to_gt_idx = torch.cdist(gt_xyz, pred_xyz).topk(min(nn_count, len(pred_xyz)), largest=False).indices
+
+    labels = CLASS_IDS + [-1]
+    in_labels = torch.isin(gt_class, torch.tensor(labels))
+    pred_class_mapped = torch.mode(pred_class[pred_to_gt_idx], dim=-1)[0]
+
+    return sklearn_metrics.confusion_matrix(
+        y_true = gt_class[in_labels].numpy(),
+        y_pred = pred_class_mapped[in_labels].numpy(),
+        labels = labels
+    )
+
+
+def test_confusion_matrix_matches_sklearn():
+    rng = np.random.default_rng(0)
+    labels = [3, -1, 0, 8]
+
+    gt_class = rng.choice([-1, 0, 1, 3, 8], size=1000)
+    pred_class = rng.choice([-1, 0, 3, 5, 8], size=1000)
+
+    np.testing.assert_array_equal(
+        compute_confusion_matrix(torch.from_numpy(gt_class), torch.from_numpy(pred_class), labels).numpy(),
+        sklearn_metrics.confusion_matrix(gt_class, pred_class, labels=labels)
+    )
+
+
+@pytest.mark.parametrize("block_size", [None, 1, 333, 1_000_000])
+@pytest.mark.parametrize("nn_count", [1, 5])
+def test_blocked_evaluation_matches_dense_baseline(block_size, nn_count):
+    gt_pointcloud, pred_pointcloud = make_scene()
+
+    result = evaluate_scen(
+        gt_pointcloud,
+        pred_pointcloud,
+        {"ids": CLASS_IDS},
+        nn_count = nn_count,
+        knn_backend = 'kdtree',
+        knn_chunk_size = 97,
+        block_size = block_size
+    )
+
+    assert result["labels"].tolist() == CLASS_IDS + [-1]
+    np.testing.assert_array_equal(
+        result["conf_matrix"].numpy(),
+        baseline_evaluate_scen(gt_pointcloud, pred_pointcloud, nn_count)
+    )
+
+
+def test_knn_count_larger_than_the_prediction():
+    gt_pointcloud, pred_pointcloud = make_scene(num_pred=3)
+
+    result = evaluate_scen(gt_pointcloud, pred_pointcloud, {"ids": CLASS_IDS}, nn_count=5, knn_backend='kdtree')
+
+    np.testing.assert_array_equal(
+        result["conf_matrix"].numpy(),
+        baseline_evaluate_scen(gt_pointcloud, pred_pointcloud, nn_count=5)
+    )
@@ -0,0 +1,132 @@
+import pytest
+
+from src.pipeline import Job, expand_jobs, get_job_statuses, run_jobs
+
+
+def make_job(job_id, runs_path, needs=(), command="true", cwd=None):
+    '''Job that records its runs in a file before running its command'''
+    return Job(
+        id = job_id,
+        stage = job_id,
+        keys = {},
+        commands = [f"echo {job_id} >> {runs_path}", command],
+        cwd = cwd,
+        needs = list(needs)
+    )
+
+
+def read_runs(runs_path):
+    return runs_path.read_text().split() if runs_path.exists() else []
+
+
+def test_finished_jobs_are_cached(tmp_path):
+    runs_path = tmp_path / "runs.txt"
+    jobs = [make_job("a", runs_path), make_job("b", runs_path, needs=["a"])]
+
+    assert run_jobs(jobs, tmp_path / "state") == {"a": "done", "b": "done"}
+    assert run_jobs(jobs, tmp_path / "state") == {"a": "cached", "b": "cached"}
+    assert read_runs(runs_path) == ["a", "b"]
+
+    assert run_jobs(jobs, tmp_path / "state", force=True) == {"a": "done", "b": "done"}
+    assert read_runs(runs_path) == ["a", "b", "a", "b"]
+
+
+def test_dependents_of_a_job_that_ran_again_are_stale(tmp_path):
+    runs_path = tmp_path / "runs.txt"
+    jobs = [make_job("a", runs_path), make_job("b", runs_path, needs=["a"]), make_job("c", runs_path)]
+    run_jobs(jobs, tmp_path / "state")
+
+    # Only `a` is selected, its dependent is not up to date any more
+    run_jobs(jobs[:1], tmp_path / "state", force=True)
+    assert get_job_statuses(jobs, tmp_path / "state") == {"a": "done", "b": "pending", "c": "done"}
+
+    assert run_jobs(jobs, tmp_path / "state") == {"a": "cached", "b": "done", "c": "cached"}
+    assert sorted(read_runs(runs_path)) == ["a", "a", "b", "b", "c"]
+
+
+def test_changed_commands_run_again(tmp_path):
+    runs_path = tmp_path / "runs.txt"
+    run_jobs([make_job("a", runs_path)], tmp_path / "state")
+
+    changed = [make_job("a", runs_path, command="echo changed")]
+    assert get_job_statuses(changed, tmp_path / "state") == {"a": "pending"}
+    assert run_jobs(changed, tmp_path / "state") == {"a": "done"}
+
+
+def test_dependents_of_a_failed_job_are_blocked(tmp_path):
+    runs_path = tmp_path / "runs.txt"
+    jobs = [
+        make_job("a", runs_path, command="exit 3"),
+        make_job("b", runs_path, needs=["a"]),
+        make_job("c", runs_path, needs=["b"]),
+        make_job("d", runs_path),
+    ]
+
+    assert run_jobs(jobs, tmp_path / "state") == {"a": "failed", "b": "blocked", "c": "blocked", "d": "done"}
+    assert sorted(read_runs(runs_path)) == ["a", "d"]
+
+    log = (tmp_path / "state" / "logs" / "a.log").read_text()
+    assert "exit code 3" in log
+
+    # A failed job is not cached
+    assert get_job_statuses(jobs, tmp_path / "state")["a"] == "failed"
+    assert run_jobs(jobs[:1], tmp_path / "state") == {"a": "failed"}
+
+
+def test_job_that_can_not_start_fails_without_stopping_the_others(tmp_path):
+    runs_path = tmp_path / "runs.txt"
+    jobs = [
+        make_job("a", runs_path, cwd=str(tmp_path / "missing")),
+        make_job("b", runs_path, needs=["a"]),
+        make_job("c", runs_path),
+    ]
+
+    assert run_jobs(jobs, tmp_path / "state") == {"a": "failed", "b": "blocked", "c": "done"}
+    assert "Traceback" in (tmp_path / "state" / "logs" / "a.log").read_text()
+
+
+def test_stage_concurrency_limit(tmp_path):
+    lock_path = tmp_path / "lock"
+    # Fails if another job of the stage holds the lock
+    command = f"set -o noclobber; echo > {lock_path} && sleep 0.2 && rm {lock_path}"
+    jobs = [Job(id=f"job_{i}", stage="gpu", keys={}, commands=[command]) for i in range(3)]
+
+    statuses = run_jobs(jobs, tmp_path / "state", max_parallel=3, concurrency={"gpu": 1})
+    assert set(statuses.values()) == {"done"}
+
+
+PIPELINE = {
+    "datasets": {"data": {"scenes": ["s0", "s1"], "labels": ["l0", "l1"], "vars": {"root": "/data/{dataset}"}}},
+    "stages": {"gt": {"scope": ["scene"], "shared": True, "commands": ["make_gt {root}/{scene}"]}},
+    "approaches": {
+        "app": {
+            "stages": {
+                "slam": {"needs": ["gt"], "commands": ["slam {root}/{label}/{scene}"]},
+                "metrics": {"scope": ["label"], "needs": ["slam"], "commands": ["metrics {label}"]},
+            }
+        }
+    },
+}
+
+
+def test_expand_jobs_matches_needs_by_scope(tmp_path):
+    jobs = {job.id: job for job in expand_jobs(PIPELINE, "app", "data", tmp_path)}
+
+    assert sorted(jobs) == sorted([
+        "data/gt/s0", "data/gt/s1",
+        "data/app/slam/l0/s0", "data/app/slam/l1/s0", "data/app/slam/l0/s1", "data/app/slam/l1/s1",
+        "data/app/metrics/l0", "data/app/metrics/l1",
+    ])
+
+    assert jobs["data/app/slam/l0/s1"].needs == ["data/gt/s1"]
+    assert jobs["data/app/slam/l0/s1"].commands == ["slam /data/data/l0/s1"]
+    assert jobs["data/app/metrics/l1"].needs == ["data/app/slam/l1/s0", "data/app/slam/l1/s1"]
+
+
+def test_expand_jobs_selection(tmp_path):
+    jobs = expand_jobs(PIPELINE, "app", "data", tmp_path, scenes=["s1"], stages=["slam"])
+    assert [job.id for job in jobs] == ["data/app/slam/l0/s1", "data/app/slam/l1/s1"]
+    assert all(job.needs == [] for job in jobs)
+
+    with pytest.raises(ValueError):
+        expand_jobs(PIPELINE, "app", "data", tmp_path, scenes=["s2"])
@@ -0,0 +1,48 @@
+from collections import Counter, defaultdict
+
+import numpy as np
+import pytest
+
+pytest.importorskip("open3d")
+pytest.importorskip("plyfile")
+
+from src.pointcloud import vote_vertex_labels
+
+
+def baseline_vote_vertex_labels(num_vertices, face_vertices, face_labels):
+    '''Per-vertex Counter voting of the baseline load_gt_pointcloud_ply'''
+    vertex_id_to_semantic = defaultdict(list)
+
+    for vertices, label in zip(face_vertices, face_labels):
+        for idx in vertices:
+            vertex_id_to_semantic[idx].append(label)
+
+    def has_tie(lst):
+        counts = Counter(lst)
+        max_count = max(counts.values())
+        return list(counts.values()).count(max_count) > 1
+
+    vertex_labels = np.array([Counter(vertex_id_to_semantic.get(i, [-1])).most_common(1)[0][0] for i in range(num_vertices)])
+    vertex_with_ties = np.array([has_tie(vertex_id_to_semantic.get(i, [-1])) for i in range(num_vertices)])
+    vertex_labels[vertex_with_ties] = -1
+
+    return vertex_labels
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vote_vertex_labels_matches_counter_voting(seed):
+    rng = np.random.default_rng(seed)
+    num_vertices = 200
+
+    # Triangles and quads, few labels so that ties are common; some vertices have no face
+    face_vertices = [rng.choice(num_vertices - 10, size=rng.choice([3, 4]), replace=False) for _ in range(300)]
+    face_labels = rng.choice([-1, 0, 3, 7, 12], size=len(face_vertices))
+
+    np.testing.assert_array_equal(
+        vote_vertex_labels(num_vertices, face_vertices, face_labels),
+        baseline_vote_vertex_labels(num_vertices, face_vertices, face_labels)
+    )
+
+
+def test_vote_vertex_labels_without_faces():
+    np.testing.assert_array_equal(vote_vertex_labels(3, [], []), [-1, -1, -1])
@@ -0,0 +1,117 @@
+import json
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from adaptors import pred_store as pred_store_adaptor
+from src.objects import classify_objects
+from src.pred_store import PRED_STORE_META_NAME, is_pred_store, load_pred_store, save_pred_store
+
+
+def make_columns(seed=0, num_points=1000, num_objects=7):
+    rng = np.random.default_rng(seed)
+
+    return {
+        "xyz": rng.uniform(-5, 5, (num_points, 3)),
+        "rgb": rng.uniform(0, 1, (num_points, 3)),
+        "label": rng.integers(-1, 20, num_points),
+        "object_id": rng.integers(0, num_objects, num_points),
+        "object_features": rng.normal(size=(num_objects, 16)),
+    }
+
+
+def test_round_trip(tmp_path):
+    columns = make_columns()
+    annotations = {"0": "wall", "3": "chair"}
+
+    save_pred_store(tmp_path / "store", annotations=annotations, meta={"approach": "cg"}, **columns)
+    store = load_pred_store(tmp_path / "store")
+
+    assert is_pred_store(tmp_path / "store")
+    assert store.num_points == len(columns["xyz"])
+    assert store.annotations == annotations
+    assert store.meta["approach"] == "cg"
+    assert store.has_objects and "features" not in store
+
+    np.testing.assert_array_equal(store["xyz"], columns["xyz"].astype(np.float32))
+    np.testing.assert_array_equal(store["rgb"], np.round(columns["rgb"] * 255).astype(np.uint8))
+    np.testing.assert_array_equal(store["label"], columns["label"])
+    np.testing.assert_array_equal(store["object_id"], columns["object_id"])
+    np.testing.assert_array_equal(store["object_features"], columns["object_features"].astype(np.float16))
+
+    assert store["label"].dtype == np.int32
+    assert store["object_features"].dtype == np.float16
+
+
+def test_chunked_reads_cover_every_point(tmp_path):
+    columns = make_columns(num_points=2500)
+    save_pred_store(tmp_path / "store", xyz=columns["xyz"], label=columns["label"])
+
+    store = load_pred_store(tmp_path / "store")
+    chunks = list(store.iter_chunks(["label"], chunk_size=1000))
+
+    assert [start for start, _ in chunks] == [0, 1000, 2000]
+    np.testing.assert_array_equal(np.concatenate([chunk["label"] for _, chunk in chunks]), columns["label"])
+
+
+def test_invalid_columns_are_rejected(tmp_path):
+    columns = make_columns()
+
+    with pytest.raises(ValueError):
+        save_pred_store(tmp_path / "store", xyz=columns["xyz"], normals=columns["xyz"])
+
+    with pytest.raises(ValueError):
+        save_pred_store(tmp_path / "store", xyz=columns["xyz"], label=columns["label"][:10])
+
+    assert not (tmp_path / "store").exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_only_stores_and_empty_directories_are_replaced(tmp_path):
+    columns = make_columns()
+
+    save_pred_store(tmp_path / "store", xyz=columns["xyz"])
+    save_pred_store(tmp_path / "store", xyz=columns["xyz"][:10])
+    assert load_pred_store(tmp_path / "store").num_points == 10
+
+    (tmp_path / "empty").mkdir()
+    save_pred_store(tmp_path / "empty", xyz=columns["xyz"])
+    assert is_pred_store(tmp_path / "empty")
+
+    results_dir = tmp_path / "results"
+    results_dir.mkdir()
+    (results_dir / "metrics.csv").write_text("scene,miou\n")
+    (results_dir / PRED_STORE_META_NAME).write_text(json.dumps({"format": "something else"}))
+
+    with pytest.raises(FileExistsError):
+        save_pred_store(results_dir, xyz=columns["xyz"])
+
+    assert (results_dir / "metrics.csv").read_text() == "scene,miou\n"
+
+
+def test_adaptor_classifies_the_objects_of_a_store(tmp_path):
+    columns = make_columns()
+    save_pred_store(tmp_path / "store", **columns)
+
+    class_feats = {"feats": torch.from_numpy(np.random.default_rng(1).normal(size=(4, 16))).float(), "ids": [0, 3, 5, 8]}
+
+    pred_xyz, pred_color, pred_class = pred_store_adaptor.load_pred_pointcloud(tmp_path / "store", class_feats, device="cpu")
+
+    object_feats = torch.from_numpy(columns["object_features"].astype(np.float16)).float()
+    object_class = classify_objects(object_feats, class_feats, device="cpu")
+
+    np.testing.assert_array_equal(pred_class.numpy(), object_class[columns["object_id"]].numpy())
+    np.testing.assert_allclose(pred_xyz.numpy(), columns["xyz"], atol=1e-5)
+    np.testing.assert_allclose(pred_color.numpy(), columns["rgb"], atol=1 / 255)
+
+
+def test_adaptor_uses_the_stored_labels(tmp_path):
+    columns = make_columns()
+    save_pred_store(tmp_path / "store", xyz=columns["xyz"], label=columns["label"])
+
+    _, pred_color, pred_class = pred_store_adaptor.load_pred_pointcloud(tmp_path / "store", class_feats=None, device="cpu")
+
+    assert pred_color is None
+    np.testing.assert_array_equal(pred_class.numpy(), columns["label"])
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("h5py")
+
+from src.tiles import TiledPointCloud, load_tiled_region, parse_bbox, save_tiled_pointcloud
+
+
+def make_pointcloud(seed=0, num_points=5000):
+    rng = np.random.default_rng(seed)
+
+    xyz = rng.uniform([-3, -1, 0], [5, 4, 2.5], (num_points, 3)).astype(np.float32)
+    colors = rng.integers(0, 256, (num_points, 3), dtype=np.uint8)
+    labels = rng.integers(-1, 30, num_points).astype(np.int32)
+
+    return xyz, colors, labels
+
+
+def sort_rows(*columns):
+    '''Rows of the columns in a canonical order, as tiles reorder the points'''
+    order = np.lexsort(columns[0].T[::-1])
+    return [column[order] for column in columns]
+
+
+@pytest.fixture
+def tiled_path(tmp_path):
+    path = tmp_path / "pointcloud.h5"
+    save_tiled_pointcloud(path, *make_pointcloud(), tile_size=1.0)
+    return path
+
+
+def test_full_load_round_trip(tiled_path):
+    xyz, colors, labels = make_pointcloud()
+    region = load_tiled_region(tiled_path)
+
+    for loaded, expected in zip(sort_rows(region["xyz"], region["rgb"], region["label"]), sort_rows(xyz, colors, labels)):
+        np.testing.assert_array_equal(loaded, expected)
+
+
+def test_tile_aabbs_bound_their_points(tiled_path):
+    with TiledPointCloud(tiled_path) as tiled_pc:
+        assert tiled_pc.counts.sum() == tiled_pc.num_points
+
+        for tile in range(len(tiled_pc.offsets)):
+            tile_xyz = tiled_pc.load_tiles([tile], ["xyz"])["xyz"]
+
+            assert len(tile_xyz) == tiled_pc.counts[tile]
+            np.testing.assert_array_equal(tile_xyz.min(axis=0), tiled_pc.aabb_min[tile])
+            np.testing.assert_array_equal(tile_xyz.max(axis=0), tiled_pc.aabb_max[tile])
+            np.testing.assert_array_equal(np.floor(tile_xyz / tiled_pc.tile_size), np.broadcast_to(tiled_pc.tile_coords[tile], tile_xyz.shape))
+
+
+@pytest.mark.parametrize("bbox", [
+    "0.2 0.3 0.1 1.7 2.9 1.2",
+    "-10 -10 -10 10 10 10",
+    "4.5 3.5 2.0 4.9 3.9 2.4",
+    "20 20 20 21 21 21",
+])
+def test_region_query_matches_brute_force(tiled_path, bbox):
+    xyz, colors, labels = make_pointcloud()
+    bbox_min, bbox_max = parse_bbox(bbox)
+
+    inside = np.all((xyz >= bbox_min) & (xyz <= bbox_max), axis=1)
+    region = load_tiled_region(tiled_path, bbox_min, bbox_max)
+
+    for loaded, expected in zip(sort_rows(region["xyz"], region["label"]), sort_rows(xyz[inside], labels[inside])):
+        np.testing.assert_array_equal(loaded, expected)
+
+
+def test_region_query_reads_only_intersecting_tiles(tiled_path):
+    bbox_min, bbox_max = parse_bbox("0.2 0.3 0.1 1.7 2.9 1.2")
+
+    with TiledPointCloud(tiled_path) as tiled_pc:
+        tiles = tiled_pc.query_tiles(bbox_min, bbox_max)
+
+        intersects = np.all((tiled_pc.aabb_max >= bbox_min) & (tiled_pc.aabb_min <= bbox_max), axis=1)
+        np.testing.assert_array_equal(tiles, np.flatnonzero(intersects))
+        assert 0 < len(tiles) < len(tiled_pc.offsets)
+
+        # Without clipping, whole tiles are returned
+        unclipped = tiled_pc.load_region(bbox_min, bbox_max, columns=["label"], clip=False)
+        assert len(unclipped["label"]) == tiled_pc.counts[tiles].sum()
+
+
+def test_parse_bbox_rejects_wrong_sizes():
+    with pytest.raises(ValueError):
+        parse_bbox("0 0 0 1 1")